@@ -0,0 +1,72 @@
+"""Benchmark of batch compression throughput against the number of encoder workers.
+
+Batches of telemetry shaped like that of benchmarks/load_generator.py are compressed
+through BatchEncoder with 1 to N workers, showing how compression scales across cores.
+
+Usage:
+    python -m benchmarks.batch_encoder [--batches 32] [--batch-size 2000] [--mode thread]
+        [--compression gzip] [--level 9]
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from typing import List
+
+from benchmarks.json_codec import generate_message
+from src.BatchEncoder import ENCODER_MODES, BatchEncoder, write_jsonl_batch
+from src.Compression import COMPRESSIONS, Compression
+
+
+async def compress(
+    encoder: BatchEncoder, compression: Compression, batches: int, messages: List[bytes], directory: str
+) -> float:
+    """Returns the time taken to compress `batches` copies of `messages`."""
+
+    start = time.perf_counter()
+    futures = [
+        await encoder.submit(
+            write_jsonl_batch, os.path.join(directory, f"{i}.jsonl"), messages, compression
+        )
+        for i in range(batches)
+    ]
+    await asyncio.gather(*futures)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batches", type=int, default=32)
+    parser.add_argument("--batch-size", type=int, default=2000)
+    parser.add_argument("--mode", choices=ENCODER_MODES, default="thread")
+    parser.add_argument("--compression", choices=COMPRESSIONS, default="gzip")
+    parser.add_argument("--level", type=int)
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    compression = Compression(codec=args.compression, level=args.level)
+    messages = [generate_message(str(i % 100), 1024) for i in range(args.batch_size)]
+    batch_bytes = sum(len(message) + 1 for message in messages)
+    print(
+        f"{batch_bytes / 1e6:.1f} MB per batch, {args.batches} batches, {args.mode} pool, "
+        f"{compression.codec} level {compression.level}"
+    )
+    print(f"{'workers':>8} {'batches/s':>10} {'MB/s':>8} {'speedup':>8}")
+
+    baseline = None
+    with tempfile.TemporaryDirectory() as directory:
+        for workers in range(1, args.max_workers + 1):
+            encoder = BatchEncoder(workers=workers, mode=args.mode, max_pending=workers * 2)
+            elapsed = asyncio.run(compress(encoder, compression, args.batches, messages, directory))
+            encoder.close()
+
+            rate = args.batches / elapsed
+            baseline = baseline or rate
+            print(f"{workers:>8} {rate:>10.1f} {rate * batch_bytes / 1e6:>8.1f} {rate / baseline:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
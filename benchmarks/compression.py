@@ -0,0 +1,60 @@
+"""Benchmark of compression throughput against compression ratio per codec and level.
+
+Batches of telemetry shaped like that of benchmarks/load_generator.py are compressed
+with each codec and level, to help pick per-device Compression settings.
+
+Usage:
+    python -m benchmarks.compression [--batch-size 2000] [--message-size 1024]
+"""
+
+import argparse
+import timeit
+
+from typing import List
+
+from benchmarks.json_codec import generate_message
+from src.Compression import Compression, zstandard
+
+GZIP_LEVELS = (1, 3, 6, 9)
+ZSTD_LEVELS = (1, 3, 6, 9, 15, 19)
+
+
+def candidates() -> List[Compression]:
+    """Returns every compression setting to measure."""
+
+    settings = [Compression(codec="none")]
+    settings += [Compression(codec="gzip", level=level) for level in GZIP_LEVELS]
+    if zstandard is not None:
+        settings += [Compression(codec="zstd", level=level) for level in ZSTD_LEVELS]
+        settings.append(Compression(codec="zstd", level=3, threads=-1))
+    return settings
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch-size", type=int, default=2000)
+    parser.add_argument("--message-size", type=int, default=1024)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if zstandard is None:
+        print("zstandard is not installed, skipping zstd")
+
+    data = b"\n".join(
+        generate_message(str(i % 100), args.message_size) for i in range(args.batch_size)
+    ) + b"\n"
+    print(f"{len(data) / 1e6:.1f} MB batch of {args.batch_size} messages")
+    print(f"{'codec':>6} {'level':>6} {'threads':>8} {'MB/s':>9} {'ratio':>7} {'size MB':>8}")
+
+    for compression in candidates():
+        best = min(timeit.repeat(lambda: compression.compress(data), number=1, repeat=args.repeat))
+        size = len(compression.compress(data))
+        level = "-" if compression.level is None else compression.level
+        print(
+            f"{compression.codec:>6} {level:>6} {compression.threads:>8} "
+            f"{len(data) / best / 1e6:>9.1f} {len(data) / size:>7.2f} {size / 1e6:>8.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""End-to-end benchmark of main.main, from messages appended to files in S3.
+
+The component runs unchanged against FakeStreamManagerClient, an in-memory stand-in
+for StreamManager whose S3 export copies files to a local "bucket" directory. A
+producer thread appends telemetry shaped like that of benchmarks/load_generator.py, each
+message stamped with the time it was appended, at a target rate. Once every message
+has reached the bucket, the exported files are read back to measure:
+
+* throughput, in messages per second from the first append to the last export;
+* p50 and p99 ingest-to-S3 latency, from append to the export of its file;
+* peak RSS of the process, which includes the stand-in and the producer.
+
+Results can be saved as JSON and compared with those of another commit; the exit
+status is 1 if any result regressed by more than the threshold.
+
+Usage:
+    python -m benchmarks.end_to_end [--messages 50000] [--rate 5000] [--size 512]
+        [--compression gzip] [--encoder-mode sharded --encoder-workers 4] [--output results.json]
+        [--baseline baseline.json] [--max-regression 0.2]
+"""
+
+import argparse
+import asyncio
+import gzip
+import io
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from typing import Any, Dict, List, Optional
+
+from stream_manager import MessageStreamDefinition
+
+import main as component
+from benchmarks.fake_stream_manager import ExportedFile, FakeStreamManagerClient
+from benchmarks.json_codec import generate_message
+from src.BatchEncoder import ENCODER_MODES
+from src.BatchMessageProcessor import BatchMessageProcessor, ProcessorConfig
+from src.Compression import COMPRESSIONS
+from src.DirectoryUploader import UploaderConfig
+from src.Metrics import Metrics
+from src.MetricsExporter import MetricsExporter
+from src.Profiler import Profiler
+from src.SpoolQuota import SpoolQuota
+
+try:
+    import zstandard as zstd
+except ImportError:
+    zstd = None
+
+STREAM_NAME = "BenchmarkStream"
+BUCKET_NAME = "benchmark-bucket"
+
+# Results where a higher value is better; a lower value is better for the others.
+HIGHER_IS_BETTER = ("messages_per_second",)
+COMPARED = ("messages_per_second", "latency_p50_seconds", "latency_p99_seconds", "peak_rss_bytes")
+
+
+def produce(client: FakeStreamManagerClient, messages: int, rate: float, size: int, devices: int):
+    """Appends `messages` messages at `rate` per second, or as fast as possible if 0."""
+
+    payloads = [generate_message(str(device), size) for device in range(devices)]
+    start = time.monotonic()
+    for i in range(messages):
+        if rate:
+            delay = start + i / rate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        # The append time goes first, so it survives any codec.
+        payload = b'{"sent_at":%.6f,' % time.time() + payloads[i % devices][1:]
+        client.append_message(STREAM_NAME, payload)
+
+
+def metric_total(metrics: Metrics, name: str) -> float:
+    """Returns the sum of a counter over all its labels."""
+
+    family = metrics.snapshot().get("s3ingestor_" + name)
+    return sum(sample["total"] for sample in family["samples"]) if family else 0
+
+
+async def run_component(
+    client: FakeStreamManagerClient, args: argparse.Namespace, spool: str, messages: int
+) -> float:
+    """Runs main.main until every message has been exported; returns when the last
+    export completed, in wall clock time."""
+
+    logger = logging.getLogger("benchmark")
+    processor_config = ProcessorConfig(
+        stream_name=STREAM_NAME,
+        batch_size=args.batch_size,
+        interval=1,
+        path=spool,
+        batch_max_age=1,
+        encoder_workers=args.encoder_workers,
+        encoder_mode=args.encoder_mode,
+        compression=args.compression,
+    )
+    extension = BatchMessageProcessor.file_extension_for(processor_config)
+    uploader_config = UploaderConfig(
+        bucket_name=BUCKET_NAME,
+        prefix="benchmark",
+        interval=1,
+        path=os.path.join(spool, "**", "*" + extension),
+        ledger_path=os.path.join(spool, ".upload-ledger.sqlite"),
+        coalesce_target_size=args.coalesce_target_size,
+        coalesce_max_age=args.coalesce_max_age,
+    )
+    quota = SpoolQuota(spool, 0)
+    exporter = MetricsExporter(Metrics(), logger)
+    profiler = Profiler(spool, logger)
+
+    task = asyncio.create_task(
+        component.main(logger, [processor_config], uploader_config, quota, exporter, profiler, client=client)
+    )
+    try:
+        while not task.done():
+            await asyncio.sleep(0.05)
+            metrics = exporter.metrics
+            if (
+                metric_total(metrics, "messages_written") >= messages
+                and client.exported_bytes >= metric_total(metrics, "batch_compressed_bytes") > 0
+            ):
+                return max(exported.exported_at for exported in client.exported_files())
+        return task.result()
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
+def read_lines(path: str) -> List[bytes]:
+    with open(path, "rb") as f:
+        data = f.read()
+    if path.endswith(".gz"):
+        data = gzip.decompress(data)
+    elif path.endswith(".zst"):
+        # Merged files hold several frames.
+        with zstd.ZstdDecompressor().stream_reader(io.BytesIO(data), read_across_frames=True) as reader:
+            data = reader.read()
+    return data.splitlines()
+
+
+def latencies(exported: List[ExportedFile]) -> List[float]:
+    """Returns the ingest-to-S3 latency of every exported message."""
+
+    result = []
+    for file in exported:
+        for line in read_lines(file.path):
+            result.append(file.exported_at - json.loads(line)["sent_at"])
+    return result
+
+
+def quantile(values: List[float], q: float) -> float:
+    return sorted(values)[min(int(q * len(values)), len(values) - 1)]
+
+
+def current_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], max_regression: float) -> bool:
+    """Prints the change of each result against the baseline; returns whether none
+    regressed by more than `max_regression`."""
+
+    ok = True
+    print(f"{'':22} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name in COMPARED:
+        before, after = baseline[name], results[name]
+        change = (after - before) / before if before else 0.0
+        regressed = -change > max_regression if name in HIGHER_IS_BETTER else change > max_regression
+        ok = ok and not regressed
+        print(f"{name:22} {before:>12.4g} {after:>12.4g} {change:>+7.1%}{'  REGRESSED' if regressed else ''}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=50000)
+    parser.add_argument("--rate", type=float, default=5000, help="Messages per second, 0 for as fast as possible")
+    parser.add_argument("--size", type=int, default=512, help="Approximate size of a message in bytes")
+    parser.add_argument("--devices", type=int, default=100)
+    parser.add_argument("--batch-size", type=int, default=2000)
+    parser.add_argument("--encoder-workers", type=int, default=1)
+    parser.add_argument("--encoder-mode", choices=ENCODER_MODES, default="thread")
+    parser.add_argument("--compression", choices=COMPRESSIONS, default="gzip")
+    parser.add_argument("--coalesce-target-size", type=int, default=0)
+    parser.add_argument("--coalesce-max-age", type=int, default=5)
+    parser.add_argument("--export-latency", type=float, default=0.05, help="Seconds added to each S3 export")
+    parser.add_argument("--output", help="File to save the results to, as JSON")
+    parser.add_argument("--baseline", help="Results of an earlier run to compare with")
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level)
+    with tempfile.TemporaryDirectory() as directory:
+        spool = os.path.join(directory, "spool")
+        bucket = os.path.join(directory, "bucket")
+        client = FakeStreamManagerClient(bucket, export_latency=args.export_latency, drop_read_messages=True)
+        client.create_message_stream(MessageStreamDefinition(name=STREAM_NAME))
+        producer = threading.Thread(
+            target=produce, args=(client, args.messages, args.rate, args.size, args.devices), daemon=True
+        )
+        started_at = time.time()
+        producer.start()
+        finished_at = asyncio.run(run_component(client, args, spool, args.messages))
+        producer.join()
+        client.shutdown()
+
+        exported = list(client.exported_files())
+        values = latencies(exported)
+
+    results = {
+        "commit": current_commit(),
+        "messages": len(values),
+        "messages_per_second": len(values) / (finished_at - started_at),
+        "latency_p50_seconds": quantile(values, 0.5),
+        "latency_p99_seconds": quantile(values, 0.99),
+        # Kilobytes on Linux.
+        "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        "files": len(exported),
+        "arguments": {name: value for name, value in vars(args).items() if name not in ("output", "baseline")},
+    }
+    print(json.dumps(results, indent=2))
+    if results["messages"] != args.messages:
+        print(f"Expected {args.messages} messages in the bucket, found {results['messages']}")
+        sys.exit(1)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if not compare(results, baseline, args.max_regression):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+"""In-memory stand-in for StreamManager, for benchmarks that run the whole component.
+
+FakeStreamManagerClient has the methods of StreamManagerClient the component uses,
+with the same read semantics, and simulates the S3 export of streams that have an
+S3 export definition: each task's file is copied into a local "bucket" directory
+after a configurable latency, and Success or Failure statuses are appended to the
+task's status stream, as StreamManager does.
+"""
+
+import os
+import shutil
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from stream_manager import (
+    InvalidRequestException,
+    NotEnoughMessagesException,
+    ResourceNotFoundException,
+)
+from stream_manager.data import (
+    EventType,
+    Message,
+    MessageStreamDefinition,
+    MessageStreamInfo,
+    ReadMessagesOptions,
+    S3ExportTaskDefinition,
+    Status,
+    StatusContext,
+    StatusLevel,
+    StatusMessage,
+)
+from stream_manager.util import Util
+
+
+@dataclass
+class FakeStream:
+    """Messages of one stream, oldest first.
+
+    Attributes:
+        definition (MessageStreamDefinition): Definition the stream was created with.
+        messages (List[Message]): Messages still held by the stream.
+        next_sequence_number (int): Sequence number of the next message appended.
+        total_bytes (int): Size of the payloads held.
+    """
+    definition: MessageStreamDefinition
+    messages: List[Message] = field(default_factory=list)
+    next_sequence_number: int = 0
+    total_bytes: int = 0
+
+    @property
+    def oldest_sequence_number(self) -> int:
+        return self.messages[0].sequence_number if self.messages else self.next_sequence_number
+
+
+@dataclass
+class ExportedFile:
+    """A file the simulated S3 export copied into the bucket directory.
+
+    Attributes:
+        key (str): S3 key of the file.
+        path (str): Location of the copy.
+        size (int): Size of the file in bytes.
+        exported_at (float): Wall clock time the copy completed at.
+    """
+    key: str
+    path: str
+    size: int
+    exported_at: float
+
+
+class FakeStreamManagerClient:
+    """Keeps message streams in memory and exports S3 tasks to a local directory.
+
+    Calls are thread-safe, as the component makes them from executor threads. Unlike
+    StreamManager, which runs in its own process, this client shares the memory of
+    the process it is used in. Streams hold up to their `max_size` and then drop their
+    oldest messages. With `drop_read_messages`, messages are also dropped once a read
+    starts after them, so a single reader's backlog is all the stand-in holds.
+
+    Attributes:
+        bucket_dir (str): Directory exported files are copied to, under `<bucket>/<key>`.
+        export_latency (float): Time (in seconds) each export takes on top of the copy.
+        exported (List[ExportedFile]): Exported files, in the order they completed.
+        exported_bytes (int): Total size of the exported files.
+    """
+
+    def __init__(
+        self,
+        bucket_dir: str,
+        export_latency: float = 0.0,
+        export_workers: int = 4,
+        drop_read_messages: bool = False,
+    ):
+        """Initializes FakeStreamManagerClient.
+
+        Args:
+            bucket_dir (str): Directory exported files are copied to.
+            export_latency (float, optional): Added time per export. Defaults to 0.
+            export_workers (int, optional): Number of exports running at once. Defaults to 4.
+            drop_read_messages (bool, optional): Drop messages once read past. Defaults to False.
+        """
+
+        self.bucket_dir = bucket_dir
+        self.export_latency = export_latency
+        self.drop_read_messages = drop_read_messages
+        self.exported: List[ExportedFile] = []
+        self.exported_bytes = 0
+        self._streams: Dict[str, FakeStream] = {}
+        self._changed = threading.Condition()
+        self._exports = ThreadPoolExecutor(max_workers=export_workers, thread_name_prefix="fake-s3-export")
+
+    def create_message_stream(self, definition: MessageStreamDefinition) -> None:
+        with self._changed:
+            if definition.name in self._streams:
+                raise InvalidRequestException(f"Stream {definition.name} already exists")
+            self._streams[definition.name] = FakeStream(definition)
+
+    def delete_message_stream(self, stream_name: str) -> None:
+        with self._changed:
+            self._stream(stream_name)
+            del self._streams[stream_name]
+            self._changed.notify_all()
+
+    def describe_message_stream(self, stream_name: str) -> MessageStreamInfo:
+        with self._changed:
+            stream = self._stream(stream_name)
+            return MessageStreamInfo(
+                definition=stream.definition,
+                storage_status=MessageStreamInfo.storageStatus(
+                    oldest_sequence_number=stream.oldest_sequence_number if stream.messages else None,
+                    newest_sequence_number=stream.next_sequence_number - 1 if stream.next_sequence_number else None,
+                    total_bytes=stream.total_bytes,
+                ),
+            )
+
+    def append_message(self, stream_name: str, data: bytes) -> int:
+        with self._changed:
+            stream = self._stream(stream_name)
+            sequence_number = stream.next_sequence_number
+            stream.messages.append(
+                Message(
+                    stream_name=stream_name,
+                    sequence_number=sequence_number,
+                    ingest_time=int(time.time() * 1000),
+                    payload=data,
+                )
+            )
+            stream.next_sequence_number += 1
+            stream.total_bytes += len(data)
+            if stream.definition.max_size and stream.total_bytes > stream.definition.max_size:
+                self._overwrite_oldest(stream)
+            self._changed.notify_all()
+            export = self._status_stream_name(stream.definition)
+        if export is not None:
+            task = Util.deserialize_json_bytes_to_obj(data, S3ExportTaskDefinition)
+            self._exports.submit(self._export, task, export)
+        return sequence_number
+
+    def read_messages(self, stream_name: str, options: Optional[ReadMessagesOptions] = None) -> List[Message]:
+        """Reads like StreamManager: waits up to `read_timeout_millis` for at least
+        `min_message_count` messages from `desired_start_sequence_number` on, and
+        returns up to `max_message_count` of them."""
+
+        options = options or ReadMessagesOptions()
+        start = options.desired_start_sequence_number or 0
+        min_count = options.min_message_count or 1
+        deadline = time.monotonic() + (options.read_timeout_millis or 0) / 1000
+        with self._changed:
+            while True:
+                stream = self._stream(stream_name)
+                messages = self._messages_from(stream, start, options.max_message_count)
+                if len(messages) >= min_count:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise NotEnoughMessagesException(
+                        f"Found {len(messages)} messages from sequence number {start}, expected {min_count}"
+                    )
+                self._changed.wait(remaining)
+            if self.drop_read_messages:
+                dropped = start - stream.oldest_sequence_number
+                if dropped > 0:
+                    stream.total_bytes -= sum(len(message.payload) for message in stream.messages[:dropped])
+                    del stream.messages[:dropped]
+            return messages
+
+    def close(self):
+        # The component closes its client on every restart; the stand-in lives on.
+        pass
+
+    def exported_files(self) -> Tuple[ExportedFile, ...]:
+        """Returns the files exported so far."""
+
+        with self._changed:
+            return tuple(self.exported)
+
+    def shutdown(self):
+        """Stops the simulated exports."""
+
+        self._exports.shutdown(wait=True, cancel_futures=True)
+
+    def _stream(self, stream_name: str) -> FakeStream:
+        stream = self._streams.get(stream_name)
+        if stream is None:
+            raise ResourceNotFoundException(f"Stream {stream_name} not found")
+        return stream
+
+    @staticmethod
+    def _overwrite_oldest(stream: FakeStream):
+        """Drops the oldest messages of a full stream, a tenth of its size at a time, as
+        StreamManager drops whole segments."""
+
+        target = stream.definition.max_size * 0.9
+        dropped = 0
+        while stream.total_bytes > target and dropped < len(stream.messages):
+            stream.total_bytes -= len(stream.messages[dropped].payload)
+            dropped += 1
+        del stream.messages[:dropped]
+
+    @staticmethod
+    def _messages_from(stream: FakeStream, start: int, max_count: Optional[int]) -> List[Message]:
+        offset = max(start - stream.oldest_sequence_number, 0)
+        return stream.messages[offset : offset + max_count if max_count else None]
+
+    @staticmethod
+    def _status_stream_name(definition: MessageStreamDefinition) -> Optional[str]:
+        exports = definition.export_definition
+        if exports is None or not exports.s3_task_executor:
+            return None
+        return exports.s3_task_executor[0].status_config.status_stream_name
+
+    def _export(self, task: S3ExportTaskDefinition, status_stream_name: str):
+        """Copies a task's file to the bucket directory and reports the outcome."""
+
+        if self.export_latency:
+            time.sleep(self.export_latency)
+        source = task.input_url.partition("file://")[2]
+        destination = os.path.join(self.bucket_dir, task.bucket, task.key)
+        try:
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            shutil.copyfile(source, destination)
+        except OSError as e:
+            status, message = Status.Failure, str(e)
+        else:
+            size = os.path.getsize(destination)
+            with self._changed:
+                self.exported.append(ExportedFile(task.key, destination, size, time.time()))
+                self.exported_bytes += size
+            status, message = Status.Success, "Exported"
+        self._append_status(status_stream_name, task, status, message)
+
+    def _append_status(self, status_stream_name: str, task: S3ExportTaskDefinition, status: Status, message: str):
+        status_message = StatusMessage(
+            event_type=EventType.S3Task,
+            status_level=StatusLevel.INFO,
+            status=status,
+            status_context=StatusContext(s3_export_task_definition=task),
+            message=message,
+            timestamp_epoch_ms=int(time.time() * 1000),
+        )
+        try:
+            self.append_message(status_stream_name, Util.validate_and_serialize_to_json_bytes(status_message))
+        except ResourceNotFoundException:
+            pass
+
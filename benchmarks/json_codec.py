@@ -0,0 +1,81 @@
+"""Microbenchmark of the JSON codecs on telemetry shaped like that of benchmarks/load_generator.py.
+
+Each message carries the load generator's default fields plus a history of recent
+samples, padded out to the target payload size.
+
+Usage:
+    python -m benchmarks.json_codec [--messages 2000]
+"""
+
+import argparse
+import json
+import random
+import timeit
+
+from datetime import datetime
+from typing import List
+
+from src.JsonCodec import CODEC_JSON, CODEC_ORJSON, CODEC_PASSTHROUGH, get_codec
+
+SIZES = (1024, 4 * 1024, 10 * 1024)
+
+
+def generate_message(device_id: str, size: int) -> bytes:
+    """Generates a telemetry message of roughly `size` bytes."""
+
+    message = {
+        "id": device_id,
+        "timestamp": datetime.now().isoformat(),
+        "speed": 50 + random.randint(-5, 5),
+        "temperature": round(25 + random.uniform(-0.5, 0.5), 2),
+        "location": {
+            "lat": -31.976056 + random.uniform(-0.0001, 0.0001),
+            "lng": 115.9113084 + random.uniform(-0.0001, 0.0001),
+        },
+        "samples": [],
+    }
+    payload = json.dumps(message).encode()
+    while len(payload) < size:
+        message["samples"].append(
+            {
+                "speed": 50 + random.randint(-5, 5),
+                "temperature": round(25 + random.uniform(-0.5, 0.5), 2),
+            }
+        )
+        payload = json.dumps(message).encode()
+    return payload
+
+
+def run(payloads: List[bytes], codec_name: str, repeat: int = 5) -> float:
+    """Returns the best-of-`repeat` throughput of a codec in messages per second."""
+
+    codec = get_codec(codec_name)
+    best = min(
+        timeit.repeat(
+            lambda: [codec.compact(payload) for payload in payloads], number=1, repeat=repeat
+        )
+    )
+    return len(payloads) / best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=2000)
+    args = parser.parse_args()
+
+    codecs = [CODEC_JSON, CODEC_PASSTHROUGH]
+    try:
+        get_codec(CODEC_ORJSON)
+        codecs.insert(1, CODEC_ORJSON)
+    except ImportError:
+        print("orjson is not installed, skipping it")
+
+    print(f"{'size':>8} " + " ".join(f"{name + ' msg/s':>18}" for name in codecs))
+    for size in SIZES:
+        payloads = [generate_message(str(i % 100), size) for i in range(args.messages)]
+        results = [run(payloads, name) for name in codecs]
+        print(f"{size:>8} " + " ".join(f"{result:>18,.0f}" for result in results))
+
+
+if __name__ == "__main__":
+    main()
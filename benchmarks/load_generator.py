@@ -0,0 +1,360 @@
+"""Load generator appending device telemetry to a stream at a target rate.
+
+Simulates `--devices` devices each sending `--device-rate` messages per second,
+spread over `--producers` producer threads that each have their own client. Messages
+follow a schema: the telemetry of the original example publisher by default, or the
+fields of a JSON file, padded out to `--size` bytes. A ratio of them can be made
+malformed, to exercise validation. A burst profile multiplies the rate for a while
+at a regular period, e.g. "60:5:10" sends ten times the rate for 5 seconds every
+minute.
+
+The achieved append rate and the latency of append_message are reported every
+`--report-interval` seconds and at the end. Messages go to StreamManager through the
+real client, or with `--stand-in` to the in-memory stand-in of
+benchmarks/fake_stream_manager.py, to measure the generator on its own.
+
+A schema file maps field names to values, or to generators of values:
+
+    {
+      "id": "device_id",
+      "timestamp": "timestamp",
+      "speed": {"type": "walk", "start": 50, "step": 5, "precision": 0},
+      "status": {"type": "choice", "values": ["ok", "degraded"]},
+      "location": {"lat": {"type": "float", "min": -32, "max": -31}}
+    }
+
+Strings "device_id", "sequence", "timestamp" (ISO 8601) and "epoch" (seconds) are
+filled in per message. Generator types are "int" and "float" (uniform between "min"
+and "max"), "walk" (a random walk per device from "start" by up to "step"),
+"choice" (one of "values") and "string" (random letters of "length"). Objects without
+a "type" are nested fields; anything else is copied as is.
+
+Usage:
+    python -m benchmarks.load_generator [--stream BatchMessageStream] [--devices 1000]
+        [--device-rate 100] [--producers 4] [--size 512] [--schema schema.json]
+        [--burst 60:5:10] [--malformed-ratio 0.01] [--duration 60] [--stand-in]
+"""
+
+import argparse
+import json
+import random
+import string
+import tempfile
+import threading
+import time
+
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from stream_manager import StreamManagerClient, StreamManagerException
+from stream_manager.data import MessageStreamDefinition, StrategyOnFull
+
+from benchmarks.fake_stream_manager import FakeStreamManagerClient
+from src.LatencyHistogram import LatencyHistogram
+
+# The fields of the original example publisher, one random walk per device.
+TELEMETRY_SCHEMA: Dict[str, Any] = {
+    "id": "device_id",
+    "timestamp": "timestamp",
+    "speed": {"type": "walk", "start": 50, "step": 5, "precision": 0},
+    "temperature": {"type": "walk", "start": 25, "step": 0.5, "precision": 2},
+    "location": {
+        "lat": {"type": "walk", "start": -31.976056, "step": 0.0001},
+        "lng": {"type": "walk", "start": 115.9113084, "step": 0.0001},
+    },
+}
+
+# Upper bounds (in seconds) of the append latency buckets.
+APPEND_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+
+# A producer further behind schedule than this skips ahead instead of catching up in
+# one burst, and the shortfall shows in the achieved rate.
+MAX_BEHIND_SECONDS = 1.0
+
+# Size of the stand-in's stream; nothing reads it, so it only needs to hold a backlog.
+STAND_IN_STREAM_BYTES = 16 * 1024 * 1024
+
+
+@dataclass
+class BurstProfile:
+    """Multiplies the rate by `multiplier` for `duration` seconds every `period` seconds.
+
+    Attributes:
+        period (float): Time (in seconds) from the start of one burst to the next.
+        duration (float): Length (in seconds) of a burst.
+        multiplier (float): Factor the rate is multiplied by during a burst.
+    """
+    period: float
+    duration: float
+    multiplier: float
+
+    @classmethod
+    def parse(cls, spec: str) -> "BurstProfile":
+        """Parses "period:duration:multiplier", e.g. "60:5:10"."""
+
+        period, duration, multiplier = (float(part) for part in spec.split(":"))
+        if period <= 0 or not 0 <= duration <= period or multiplier <= 0:
+            raise ValueError(f"Invalid burst profile {spec}")
+        return cls(period, duration, multiplier)
+
+    def __str__(self) -> str:
+        return f"{self.multiplier:g}x for {self.duration:g}s every {self.period:g}s"
+
+    def factor(self, elapsed: float) -> float:
+        """Returns the rate multiplier `elapsed` seconds into the run."""
+
+        return self.multiplier if elapsed % self.period < self.duration else 1.0
+
+
+class MessageFactory:
+    """Builds the payloads of simulated devices from a schema.
+
+    Attributes:
+        schema (Dict[str, Any]): Fields of a message, see the module documentation.
+        size (int): Size in bytes messages are padded to, if they are smaller.
+        malformed_ratio (float): Share of payloads that are not valid JSON.
+    """
+
+    def __init__(self, schema: Dict[str, Any], size: int = 0, malformed_ratio: float = 0.0):
+        self.schema = schema
+        self.size = size
+        self.malformed_ratio = malformed_ratio
+        self._walks: Dict[Tuple[str, str], float] = {}
+        self._fields = self._compile(schema, "")
+
+    def _compile(self, schema: Dict[str, Any], path: str) -> List[Tuple[str, Callable[[str, int], Any]]]:
+        """Turns a schema into one function per field, taking the device and sequence."""
+
+        fields = []
+        for name, spec in schema.items():
+            fields.append((name, self._generator(spec, f"{path}.{name}")))
+        return fields
+
+    def _generator(self, spec: Any, path: str) -> Callable[[str, int], Any]:
+        if spec == "device_id":
+            return lambda device, sequence: device
+        if spec == "sequence":
+            return lambda device, sequence: sequence
+        if spec == "timestamp":
+            return lambda device, sequence: datetime.now().isoformat()
+        if spec == "epoch":
+            return lambda device, sequence: time.time()
+        if not isinstance(spec, dict):
+            return lambda device, sequence: spec
+        kind = spec.get("type")
+        if kind is None:
+            nested = self._compile(spec, path)
+            return lambda device, sequence: {name: field(device, sequence) for name, field in nested}
+        if kind == "int":
+            return lambda device, sequence: random.randint(spec["min"], spec["max"])
+        if kind == "float":
+            precision = spec.get("precision")
+            return lambda device, sequence: self._round(random.uniform(spec["min"], spec["max"]), precision)
+        if kind == "walk":
+            return lambda device, sequence: self._walk(device, path, spec)
+        if kind == "choice":
+            return lambda device, sequence: random.choice(spec["values"])
+        if kind == "string":
+            return lambda device, sequence: "".join(random.choices(string.ascii_letters, k=spec["length"]))
+        raise ValueError(f"Unknown field type {kind} at {path.lstrip('.')}")
+
+    @staticmethod
+    def _round(value: float, precision: Optional[int]) -> float:
+        if precision is None:
+            return value
+        return round(value) if precision == 0 else round(value, precision)
+
+    def _walk(self, device: str, path: str, spec: Dict[str, Any]) -> float:
+        key = (device, path)
+        value = self._walks.get(key, spec["start"]) + random.uniform(-spec["step"], spec["step"])
+        self._walks[key] = value
+        return self._round(value, spec.get("precision"))
+
+    def payload(self, device: str, sequence: int) -> Tuple[bytes, bool]:
+        """Builds the next message of a device.
+
+        Returns:
+            Tuple[bytes, bool]: The payload, and whether it was made malformed.
+        """
+
+        payload = json.dumps({name: field(device, sequence) for name, field in self._fields}).encode()
+        if len(payload) < self.size:
+            padding = max(self.size - len(payload) - len(b',"padding":""'), 0)
+            payload = payload[:-1] + b',"padding":"' + b"x" * padding + b'"}'
+        if self.malformed_ratio and random.random() < self.malformed_ratio:
+            # Truncated, as by a device that lost its connection mid-message.
+            return payload[: len(payload) // 2], True
+        return payload, False
+
+
+class LoadStats:
+    """Append outcomes of all producers, shared between their threads.
+
+    Attributes:
+        appended (int): Messages appended.
+        malformed (int): Malformed messages among them.
+        errors (int): Appends that failed.
+        latency (LatencyHistogram): Duration of append_message calls.
+    """
+
+    def __init__(self):
+        self.appended = 0
+        self.malformed = 0
+        self.errors = 0
+        self.latency = LatencyHistogram(APPEND_BUCKETS)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float, malformed: bool):
+        with self._lock:
+            self.appended += 1
+            self.malformed += malformed
+            self.latency.observe(seconds)
+
+    def record_error(self):
+        with self._lock:
+            self.errors += 1
+
+
+def produce(
+    client: Any,
+    stream: str,
+    devices: List[str],
+    device_rate: float,
+    factory: MessageFactory,
+    stats: LoadStats,
+    started: float,
+    deadline: Optional[float],
+    burst: Optional[BurstProfile],
+    stop: threading.Event,
+):
+    """Appends messages of `devices` in turn, at their combined rate, until the deadline."""
+
+    next_send = started
+    sequence = 0
+    while not stop.is_set():
+        now = time.monotonic()
+        if deadline is not None and now >= deadline:
+            break
+        if next_send > now:
+            time.sleep(next_send - now)
+        elif now - next_send > MAX_BEHIND_SECONDS:
+            next_send = now
+        rate = len(devices) * device_rate * (burst.factor(now - started) if burst else 1.0)
+        next_send += 1 / rate
+
+        device = devices[sequence % len(devices)]
+        payload, malformed = factory.payload(device, sequence // len(devices))
+        sequence += 1
+        append_started = time.perf_counter()
+        try:
+            client.append_message(stream, payload)
+        except (StreamManagerException, ConnectionError, TimeoutError):
+            stats.record_error()
+            continue
+        stats.record(time.perf_counter() - append_started, malformed)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stream", default="BatchMessageStream")
+    parser.add_argument("--devices", type=int, default=1)
+    parser.add_argument("--device-rate", type=float, default=1, help="Messages per second per device")
+    parser.add_argument("--producers", type=int, default=1)
+    parser.add_argument("--size", type=int, default=0, help="Size in bytes messages are padded to")
+    parser.add_argument("--schema", help="JSON file describing the message fields")
+    parser.add_argument("--burst", type=BurstProfile.parse, help="period:duration:multiplier, e.g. 60:5:10")
+    parser.add_argument("--malformed-ratio", type=float, default=0.0)
+    parser.add_argument("--duration", type=float, default=0, help="Seconds to run for, 0 until interrupted")
+    parser.add_argument("--report-interval", type=float, default=10)
+    parser.add_argument("--stand-in", action="store_true", help="Append to an in-memory stand-in")
+    args = parser.parse_args()
+
+    schema = TELEMETRY_SCHEMA
+    if args.schema:
+        with open(args.schema) as f:
+            schema = json.load(f)
+    factory = MessageFactory(schema, size=args.size, malformed_ratio=args.malformed_ratio)
+
+    if args.stand_in:
+        stand_in = FakeStreamManagerClient(tempfile.mkdtemp())
+        stand_in.create_message_stream(
+            MessageStreamDefinition(
+                name=args.stream,
+                max_size=STAND_IN_STREAM_BYTES,
+                strategy_on_full=StrategyOnFull.OverwriteOldestData,
+            )
+        )
+        clients = [stand_in] * args.producers
+    else:
+        clients = [StreamManagerClient() for _ in range(args.producers)]
+
+    devices = [str(device) for device in range(args.devices)]
+    stats = LoadStats()
+    stop = threading.Event()
+    started = time.monotonic()
+    deadline = started + args.duration if args.duration else None
+    producers = [
+        threading.Thread(
+            target=produce,
+            args=(
+                clients[i],
+                args.stream,
+                devices[i :: args.producers],
+                args.device_rate,
+                factory,
+                stats,
+                started,
+                deadline,
+                args.burst,
+                stop,
+            ),
+            name=f"producer-{i}",
+            daemon=True,
+        )
+        for i in range(min(args.producers, len(devices)))
+    ]
+    target_rate = args.devices * args.device_rate
+    print(
+        f"{args.devices} devices at {args.device_rate:g} Hz = {target_rate:g} messages/s "
+        f"from {len(producers)} producers{f', bursts {args.burst}' if args.burst else ''}"
+    )
+    print(f"{'seconds':>8} {'appended':>10} {'msg/s':>9} {'errors':>7} {'malformed':>9} {'p50 ms':>7} {'p99 ms':>7}")
+
+    def report(since: float, appended_before: int):
+        now = time.monotonic()
+        rate = (stats.appended - appended_before) / (now - since) if now > since else 0.0
+        print(
+            f"{now - started:>8.0f} {stats.appended:>10} {rate:>9.0f} {stats.errors:>7} {stats.malformed:>9} "
+            f"{stats.latency.quantile(0.5) * 1e3:>7.2f} {stats.latency.quantile(0.99) * 1e3:>7.2f}"
+        )
+
+    for producer in producers:
+        producer.start()
+    try:
+        last_report, appended_before = started, 0
+        while any(producer.is_alive() for producer in producers):
+            time.sleep(0.1)
+            if time.monotonic() - last_report >= args.report_interval:
+                report(last_report, appended_before)
+                last_report, appended_before = time.monotonic(), stats.appended
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        for producer in producers:
+            producer.join()
+        for client in set(clients):
+            client.close()
+
+    elapsed = time.monotonic() - started
+    print(
+        f"Appended {stats.appended} messages in {elapsed:.1f}s: {stats.appended / elapsed:.0f} messages/s "
+        f"against a target of {target_rate:g}, {stats.errors} errors, {stats.malformed} malformed, "
+        f"append latency p50 <= {stats.latency.quantile(0.5) * 1e3:g} ms, "
+        f"p99 <= {stats.latency.quantile(0.99) * 1e3:g} ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Benchmark of the per-pass cost of finding new files in a large spool.
+
+A spool of N files is scanned for new files with the glob, stat and sort of the
+original uploader, and with SpoolIndex, both for a pass where nothing changed and
+for a pass after one new file was published.
+
+Usage:
+    python -m benchmarks.spool_scan [--files 1000 10000 100000] [--dir /tmp]
+"""
+
+import argparse
+import glob
+import os
+import shutil
+import tempfile
+import time
+
+from typing import Callable, List, Set
+
+from src.SpoolIndex import SpoolIndex
+
+
+def glob_pass(pathname: str, processed: Set[str]) -> List[str]:
+    """One scan as done before SpoolIndex; returns the new files, oldest first."""
+
+    files = sorted(filter(os.path.isfile, glob.glob(pathname)), key=os.path.getmtime)
+    new_files = [file for file in files if file not in processed]
+    processed.update(new_files)
+    return new_files
+
+
+def index_pass(index: SpoolIndex) -> List[str]:
+    """One scan with SpoolIndex; returns the new files, oldest first."""
+
+    index.refresh()
+    return index.pop_new()
+
+
+def timed(func: Callable[[], List[str]], repeat: int) -> float:
+    """Returns the best time (in seconds) of `repeat` calls."""
+
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def publish(directory: str, name: str, mtime: float):
+    """Writes a file the way the processor does, under a hidden name and then renamed."""
+
+    partial_path = os.path.join(directory, f".{name}.partial")
+    with open(partial_path, "wb") as f:
+        f.write(b"x")
+    os.utime(partial_path, (mtime, mtime))
+    os.replace(partial_path, os.path.join(directory, name))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--dir", help="Directory to create the spool in, e.g. on the target disk")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'files':>8} {'pass':>8} {'glob ms':>9} {'index ms':>9} {'speedup':>8}")
+    for count in args.files:
+        directory = tempfile.mkdtemp(dir=args.dir)
+        try:
+            # Old mtimes, so the index can trust the directory mtime between passes.
+            mtime = time.time() - 3600
+            for i in range(count):
+                publish(directory, f"{i:08d}.jsonl.gz", mtime + i / count)
+            os.utime(directory, (mtime, mtime))
+
+            pathname = os.path.join(directory, "*.jsonl.gz")
+            processed: Set[str] = set()
+            index = SpoolIndex(directory, "*.jsonl.gz")
+            assert len(glob_pass(pathname, processed)) == len(index_pass(index)) == count
+
+            idle_glob = timed(lambda: glob_pass(pathname, processed), args.repeat)
+            idle_index = timed(lambda: index_pass(index), args.repeat)
+
+            changed_glob = changed_index = float("inf")
+            for i in range(args.repeat):
+                publish(directory, f"new{i}.jsonl.gz", mtime + 1)
+                os.utime(directory, (mtime + 2 + i, mtime + 2 + i))
+                changed_glob = min(changed_glob, timed(lambda: glob_pass(pathname, processed), 1))
+                changed_index = min(changed_index, timed(lambda: index_pass(index), 1))
+
+            for name, glob_time, index_time in (
+                ("idle", idle_glob, idle_index),
+                ("1 new", changed_glob, changed_index),
+            ):
+                print(
+                    f"{count:>8} {name:>8} {glob_time * 1e3:>9.2f} {index_time * 1e3:>9.3f} "
+                    f"{glob_time / index_time:>7.0f}x"
+                )
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,41 @@
 import argparse
 import asyncio
 import logging
+import os
+
+from typing import List, Optional
+
+from stream_manager import StreamManagerClient
 
 from src.BatchMessageProcessor import BatchMessageProcessor, ProcessorConfig
 from src.DirectoryUploader import DirectoryUploader, UploaderConfig
+from src.Metrics import Metrics
+from src.MetricsExporter import MetricsExporter
+from src.MultiStreamProcessor import MultiStreamProcessor, stream_configs
+from src.Profiler import Profiler
+from src.SpoolQuota import SpoolQuota
+
+
+def optional_int(value: str) -> Optional[int]:
+    """Parses an integer argument where an empty string means "not set"."""
+
+    return int(value) if value else None
 
 
-async def process_messages(logger: logging.Logger, config: ProcessorConfig):
+async def process_messages(
+    logger: logging.Logger,
+    configs: List[ProcessorConfig],
+    published_files: "asyncio.Queue[str]",
+    quota: Optional[SpoolQuota],
+    metrics: Metrics,
+    client: Optional[StreamManagerClient] = None,
+):
     while True:
         processor = None
         try:
-            processor = BatchMessageProcessor(config, logger)
+            processor = MultiStreamProcessor(
+                configs, logger, client=client, published_files=published_files, quota=quota, metrics=metrics
+            )
             await processor.run()
         except Exception:
             logger.exception("Exception while running")
@@ -23,11 +48,20 @@ async def process_messages(logger: logging.Logger, config: ProcessorConfig):
         await asyncio.sleep(60)
 
 
-async def upload_directory(logger: logging.Logger, config: UploaderConfig):
+async def upload_directory(
+    logger: logging.Logger,
+    config: UploaderConfig,
+    published_files: "asyncio.Queue[str]",
+    quota: Optional[SpoolQuota],
+    metrics: Metrics,
+    client: Optional[StreamManagerClient] = None,
+):
     while True:
         uploader = None
         try:
-            uploader = DirectoryUploader(config, logger)
+            uploader = DirectoryUploader(
+                config, logger, client=client, published_files=published_files, quota=quota, metrics=metrics
+            )
             await uploader.run()
         except Exception:
             logger.exception("Exception while running")
@@ -42,24 +76,71 @@ async def upload_directory(logger: logging.Logger, config: UploaderConfig):
 
 async def main(
     logger: logging.Logger,
-    processor_config: ProcessorConfig,
+    processor_configs: List[ProcessorConfig],
     uploader_config: UploaderConfig,
+    quota: Optional[SpoolQuota],
+    exporter: MetricsExporter,
+    profiler: Profiler,
+    client: Optional[StreamManagerClient] = None,
 ):
-    processor_task = asyncio.create_task(process_messages(logger, processor_config))
-    uploader_task = asyncio.create_task(upload_directory(logger, uploader_config))
+    # Batches are handed to the uploader as soon as they are complete; scanning the
+    # directory only recovers files the uploader has not been told about.
+    published_files: "asyncio.Queue[str]" = asyncio.Queue()
+    processor_task = asyncio.create_task(
+        process_messages(logger, processor_configs, published_files, quota, exporter.metrics, client)
+    )
+    uploader_task = asyncio.create_task(
+        upload_directory(logger, uploader_config, published_files, quota, exporter.metrics, client)
+    )
+    exporter_task = asyncio.create_task(exporter.run())
+    profiler_task = asyncio.create_task(profiler.run())
 
-    await asyncio.gather(processor_task, uploader_task)
+    await asyncio.gather(processor_task, uploader_task, exporter_task, profiler_task)
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--path")
-    parser.add_argument("--pattern", default="*")
+    parser.add_argument("--pattern")
     parser.add_argument("--interval", type=int)
     parser.add_argument("--processor_stream_name")
     parser.add_argument("--processor_batch_size", type=int)
+    parser.add_argument("--processor_batch_max_bytes", type=int, default=16 * 1024 * 1024)
+    parser.add_argument("--processor_batch_max_age", type=int, default=300)
+    parser.add_argument("--processor_json_codec", default="auto")
+    parser.add_argument("--processor_encoder_workers", type=int, default=1)
+    parser.add_argument("--processor_encoder_mode", default="thread")
+    parser.add_argument("--processor_max_pending_batches", type=int, default=4)
+    parser.add_argument("--processor_compression", default="gzip")
+    parser.add_argument("--processor_compression_level", type=optional_int)
+    parser.add_argument("--processor_compression_threads", type=int, default=0)
+    parser.add_argument("--processor_output_format", default="jsonl")
+    parser.add_argument("--processor_parquet_schema")
+    parser.add_argument("--processor_parquet_row_group_size", type=optional_int)
+    parser.add_argument("--processor_parquet_compression", default="snappy")
+    parser.add_argument("--processor_partition_key")
+    parser.add_argument("--processor_max_open_partitions", type=int, default=100)
+    parser.add_argument("--processor_startup_mode", default="resume")
+    parser.add_argument("--processor_streams")
     parser.add_argument("--uploader_bucket_name")
     parser.add_argument("--uploader_prefix")
+    parser.add_argument("--uploader_watch_mode", default="auto")
+    parser.add_argument("--uploader_max_concurrent_submissions", type=int, default=8)
+    parser.add_argument("--uploader_max_outstanding_exports", type=int, default=500)
+    parser.add_argument("--uploader_ledger_path")
+    parser.add_argument("--uploader_retry_base_delay", type=int, default=5)
+    parser.add_argument("--uploader_retry_max_delay", type=int, default=900)
+    parser.add_argument("--uploader_circuit_breaker_threshold", type=int, default=10)
+    parser.add_argument("--uploader_circuit_breaker_reset_timeout", type=int, default=60)
+    parser.add_argument("--uploader_coalesce_target_size", type=int, default=0)
+    parser.add_argument("--uploader_coalesce_max_age", type=int, default=300)
+    parser.add_argument("--spool_max_bytes", type=int, default=0)
+    parser.add_argument("--spool_quota_policy", default="pause")
+    parser.add_argument("--metrics_port", type=int, default=0)
+    parser.add_argument("--metrics_snapshot_path")
+    parser.add_argument("--metrics_interval", type=int, default=60)
+    parser.add_argument("--profile_duration", type=int, default=60)
+    parser.add_argument("--profile_output_path")
     parser.add_argument("--log_level")
 
     args = parser.parse_args()
@@ -69,19 +150,70 @@ if __name__ == "__main__":
         batch_size=args.processor_batch_size,
         interval=args.interval,
         path=args.path,
+        batch_max_bytes=args.processor_batch_max_bytes,
+        batch_max_age=args.processor_batch_max_age,
+        json_codec=args.processor_json_codec,
+        encoder_workers=args.processor_encoder_workers,
+        encoder_mode=args.processor_encoder_mode,
+        max_pending_batches=args.processor_max_pending_batches,
+        compression=args.processor_compression,
+        compression_level=args.processor_compression_level,
+        compression_threads=args.processor_compression_threads,
+        output_format=args.processor_output_format,
+        parquet_schema=args.processor_parquet_schema or None,
+        parquet_row_group_size=args.processor_parquet_row_group_size,
+        parquet_compression=args.processor_parquet_compression,
+        partition_key=args.processor_partition_key or None,
+        max_open_partitions=args.processor_max_open_partitions,
+        startup_mode=args.processor_startup_mode,
     )
 
+    processor_configs = stream_configs(processor_config, args.processor_streams or "")
+
+    # Only upload the files the processor writes, including stream and partition
+    # sub-directories, unless a pattern is given explicitly.
+    extensions = {BatchMessageProcessor.file_extension_for(config) for config in processor_configs}
+    pattern = args.pattern or "**/*" + (extensions.pop() if len(extensions) == 1 else "")
+
     uploader_config = UploaderConfig(
         bucket_name=args.uploader_bucket_name,
         prefix=args.uploader_prefix,
         interval=args.interval,
-        path="{}/{}".format(args.path, args.pattern),
+        path="{}/{}".format(args.path, pattern),
+        watch_mode=args.uploader_watch_mode,
+        max_concurrent_submissions=args.uploader_max_concurrent_submissions,
+        max_outstanding_exports=args.uploader_max_outstanding_exports,
+        ledger_path=args.uploader_ledger_path or os.path.join(args.path, ".upload-ledger.sqlite"),
+        retry_base_delay=args.uploader_retry_base_delay,
+        retry_max_delay=args.uploader_retry_max_delay,
+        breaker_failure_threshold=args.uploader_circuit_breaker_threshold,
+        breaker_reset_timeout=args.uploader_circuit_breaker_reset_timeout,
+        coalesce_target_size=args.uploader_coalesce_target_size,
+        coalesce_max_age=args.uploader_coalesce_max_age,
+    )
+
+    # The processor and the uploader share the quota, as one fills the spool and the
+    # other empties it. Without a limit it only tracks the spool size for the metrics.
+    quota = SpoolQuota(args.path, args.spool_max_bytes, policy=args.spool_quota_policy)
+    quota.scan()
+
+    # Shared by the processor and the uploader, and kept across their restarts.
+    exporter = MetricsExporter(
+        Metrics(),
+        logging.getLogger(),
+        port=args.metrics_port,
+        snapshot_path=args.metrics_snapshot_path or None,
+        interval=args.metrics_interval,
     )
 
     logging.basicConfig(level=args.log_level)
     logger = logging.getLogger()
 
     logger.info(
-        f"Started with; processor_config={processor_config}, uploader_config={uploader_config}"
+        f"Started with; processor_configs={processor_configs}, uploader_config={uploader_config}"
+    )
+    # Profiles on SIGUSR1 or when a ".profile" file is created under the path.
+    profiler = Profiler(
+        args.path, logger, output_path=args.profile_output_path or None, duration=args.profile_duration
     )
-    asyncio.run(main(logger, processor_config, uploader_config))
+    asyncio.run(main(logger, processor_configs, uploader_config, quota, exporter, profiler))
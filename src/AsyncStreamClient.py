@@ -0,0 +1,84 @@
+import asyncio
+import functools
+
+from concurrent.futures import ThreadPoolExecutor
+
+from typing import Any, Callable, List, Optional
+
+from stream_manager import (
+    MessageStreamDefinition,
+    ReadMessagesOptions,
+    StreamManagerClient,
+)
+from stream_manager.data import Message, MessageStreamInfo
+
+
+class AsyncStreamClient:
+    """Awaitable wrapper around the blocking StreamManagerClient.
+
+    Every StreamManagerClient call blocks the calling thread until StreamManager
+    responds, which for a long-polling read_messages can be up to the read timeout.
+    This adapter runs those calls in a bounded thread pool so that coroutines sharing
+    an event loop keep making progress while a request is in flight.
+
+    Attributes:
+        client (StreamManagerClient): The wrapped client.
+        max_workers (int): Maximum number of concurrent StreamManager requests.
+    """
+
+    def __init__(self, client: StreamManagerClient = None, max_workers: int = 4):
+        """Initializes AsyncStreamClient.
+
+        Args:
+            client (StreamManagerClient, optional): Client to wrap. If not provided,
+                a default StreamManagerClient instance will be created.
+            max_workers (int, optional): Maximum number of concurrent StreamManager
+                requests. Defaults to 4.
+        """
+
+        self.client = client or StreamManagerClient()
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="StreamManagerClient"
+        )
+
+    async def _call(self, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Runs a blocking client method in the executor and awaits its result."""
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(func, *args, **kwargs)
+        )
+
+    async def read_messages(
+        self, stream_name: str, options: Optional[ReadMessagesOptions] = None
+    ) -> List[Message]:
+        """Awaitable version of StreamManagerClient.read_messages."""
+
+        return await self._call(self.client.read_messages, stream_name, options)
+
+    async def append_message(self, stream_name: str, data: bytes) -> int:
+        """Awaitable version of StreamManagerClient.append_message."""
+
+        return await self._call(self.client.append_message, stream_name, data)
+
+    async def create_message_stream(self, definition: MessageStreamDefinition) -> None:
+        """Awaitable version of StreamManagerClient.create_message_stream."""
+
+        await self._call(self.client.create_message_stream, definition=definition)
+
+    async def delete_message_stream(self, stream_name: str) -> None:
+        """Awaitable version of StreamManagerClient.delete_message_stream."""
+
+        await self._call(self.client.delete_message_stream, stream_name=stream_name)
+
+    async def describe_message_stream(self, stream_name: str) -> MessageStreamInfo:
+        """Awaitable version of StreamManagerClient.describe_message_stream."""
+
+        return await self._call(self.client.describe_message_stream, stream_name=stream_name)
+
+    def close(self):
+        """Stops the executor and closes the wrapped client."""
+
+        self._executor.shutdown(wait=False)
+        self.client.close()
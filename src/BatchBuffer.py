@@ -0,0 +1,108 @@
+import time
+
+from typing import Callable, List, Optional, Tuple
+
+
+class BatchBuffer:
+    """Accumulates validated messages across reads until a batch is ready to flush.
+
+    A batch is ready as soon as any one of its limits is reached: the number of
+    messages, the uncompressed size in bytes, or the age of the oldest message. The
+    count and size limits keep objects well sized at high message rates, while the
+    age limit bounds end-to-end latency at low rates.
+
+    Attributes:
+        max_messages (int): Number of messages that triggers a flush.
+        max_bytes (int): Uncompressed size in bytes that triggers a flush. 0 disables the limit.
+        max_age (float): Age in seconds of the oldest message that triggers a flush.
+            0 disables the limit.
+        messages (List[bytes]): Messages waiting to be flushed.
+        size_bytes (int): Uncompressed size of the buffered messages.
+        first_sequence_number (Optional[int]): Sequence number of the oldest buffered message.
+        last_sequence_number (Optional[int]): Sequence number of the newest buffered message.
+    """
+
+    def __init__(
+        self,
+        max_messages: int,
+        max_bytes: int = 0,
+        max_age: float = 0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """Initializes BatchBuffer.
+
+        Args:
+            max_messages (int): Number of messages that triggers a flush.
+            max_bytes (int, optional): Uncompressed size in bytes that triggers a flush.
+                Defaults to 0 (disabled).
+            max_age (float, optional): Age in seconds of the oldest message that triggers
+                a flush. Defaults to 0 (disabled).
+            clock (Callable[[], float], optional): Monotonic clock used to age messages.
+        """
+
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._clock = clock
+        self.messages: List[bytes] = []
+        self.size_bytes = 0
+        self.first_sequence_number: Optional[int] = None
+        self.last_sequence_number: Optional[int] = None
+        self._oldest_added_at: Optional[float] = None
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    def add(self, message: bytes, size_bytes: int, sequence_number: int) -> None:
+        """Adds a validated message to the buffer.
+
+        Args:
+            message (bytes): The validated JSON message.
+            size_bytes (int): Uncompressed size of the message.
+            sequence_number (int): Stream sequence number of the message.
+        """
+
+        if not self.messages:
+            self._oldest_added_at = self._clock()
+            self.first_sequence_number = sequence_number
+        self.messages.append(message)
+        self.size_bytes += size_bytes
+        self.last_sequence_number = sequence_number
+
+    def age(self) -> float:
+        """Returns how long, in seconds, the oldest buffered message has been waiting."""
+
+        if self._oldest_added_at is None:
+            return 0.0
+        return self._clock() - self._oldest_added_at
+
+    def should_flush(self) -> bool:
+        """Checks whether any of the flush limits has been reached.
+
+        Returns:
+            bool: True if the buffer holds messages and a limit has been reached.
+        """
+
+        if not self.messages:
+            return False
+        return (
+            len(self.messages) >= self.max_messages
+            or (self.max_bytes > 0 and self.size_bytes >= self.max_bytes)
+            or (self.max_age > 0 and self.age() >= self.max_age)
+        )
+
+    def drain(self) -> Tuple[List[bytes], Optional[int], Optional[int]]:
+        """Empties the buffer.
+
+        Returns:
+            Tuple[List[bytes], Optional[int], Optional[int]]: The buffered messages and
+                the sequence numbers of the oldest and newest one.
+        """
+
+        drained = self.messages, self.first_sequence_number, self.last_sequence_number
+        self.messages = []
+        self.size_bytes = 0
+        self.first_sequence_number = None
+        self.last_sequence_number = None
+        self._oldest_added_at = None
+        return drained
@@ -0,0 +1,126 @@
+import asyncio
+import multiprocessing
+import os
+
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+
+from typing import Any, Callable, Sequence
+
+from src.Compression import Compression
+
+ENCODER_MODE_THREAD = "thread"
+ENCODER_MODE_PROCESS = "process"
+ENCODER_MODE_SHARDED = "sharded"
+ENCODER_MODES = (ENCODER_MODE_THREAD, ENCODER_MODE_PROCESS, ENCODER_MODE_SHARDED)
+
+# Messages are handed to the compressor in chunks of about this size, so neither a
+# copy of the batch nor a tiny compressor call per message is needed.
+WRITE_CHUNK_BYTES = 64 * 1024
+
+
+def write_jsonl_batch(file_path: str, messages: Sequence[bytes], compression: Compression) -> int:
+    """Streams a batch of messages through the compressor into a JSON Lines file.
+
+    This runs inside the encoder pool, so it must stay a module level function that
+    only takes picklable arguments. The file is synced to disk before returning, so
+    it can be published and checkpointed.
+
+    Messages are compressed and written chunk by chunk, so besides the messages
+    themselves this holds at most `WRITE_CHUNK_BYTES` of input and the compressor's
+    state in memory, however large the batch.
+
+    Args:
+        file_path (str): Path of the file to write.
+        messages (Sequence[bytes]): The messages, each written as one line.
+        compression (Compression): How to compress the batch.
+
+    Returns:
+        int: Size of the written file in bytes.
+    """
+
+    with open(file_path, "wb") as f:
+        with compression.writer(f) as writer:
+            chunk = []
+            chunk_bytes = 0
+            for message in messages:
+                chunk.append(message)
+                chunk_bytes += len(message) + 1
+                if chunk_bytes >= WRITE_CHUNK_BYTES:
+                    chunk.append(b"")
+                    writer.write(b"\n".join(chunk))
+                    chunk = []
+                    chunk_bytes = 0
+            if chunk:
+                chunk.append(b"")
+                writer.write(b"\n".join(chunk))
+        f.flush()
+        os.fsync(f.fileno())
+        return f.tell()
+
+
+class BatchEncoder:
+    """Runs batch encoding and compression in a worker pool.
+
+    zlib and zstd release the GIL while compressing, so a thread pool scales across
+    cores for compression-bound loads. A process pool can be used when more of the
+    per-batch work is Python code. In "sharded" mode the processes also validate the
+    messages, so the BatchMessageProcessor hands them raw batches and only reads the
+    stream itself. At most `max_pending` batches are in flight at any time; submitting
+    more waits for a slot, which in turn holds back further reads from the stream.
+
+    Attributes:
+        mode (str): Either "thread", "process" or "sharded".
+        workers (int): Number of workers in the pool.
+        max_pending (int): Maximum number of batches submitted but not yet completed.
+    """
+
+    def __init__(self, workers: int = 1, mode: str = ENCODER_MODE_THREAD, max_pending: int = 4):
+        """Initializes BatchEncoder.
+
+        Args:
+            workers (int, optional): Number of workers in the pool. Defaults to 1.
+            mode (str, optional): Either "thread", "process" or "sharded". Defaults to "thread".
+            max_pending (int, optional): Maximum number of batches in flight. Defaults to 4.
+        """
+
+        if mode not in ENCODER_MODES:
+            raise ValueError(f"Unknown encoder mode {mode}, expected one of {ENCODER_MODES}")
+
+        self.mode = mode
+        self.workers = workers
+        self.max_pending = max(max_pending, 1)
+        self._slots = asyncio.Semaphore(self.max_pending)
+
+        self._executor: Executor
+        if mode in (ENCODER_MODE_PROCESS, ENCODER_MODE_SHARDED):
+            # Forking a process that runs the StreamManager client thread is unsafe.
+            self._executor = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="BatchEncoder")
+
+    async def submit(self, func: Callable[..., Any], *args: Any) -> "asyncio.Future[Any]":
+        """Submits work to the pool once a slot is free.
+
+        Args:
+            func (Callable[..., Any]): Module level function to run in the pool.
+            *args (Any): Picklable arguments for the function.
+
+        Returns:
+            asyncio.Future[Any]: Future that resolves to the function's result.
+        """
+
+        await self._slots.acquire()
+        try:
+            future = asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def close(self):
+        """Stops the pool, abandoning batches that have not started yet."""
+
+        self._executor.shutdown(wait=False, cancel_futures=True)
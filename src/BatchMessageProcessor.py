@@ -1,13 +1,15 @@
 import asyncio
-import gzip
+import glob
 import logging
-import json
 import os
+import time
+import urllib.parse
 
+from collections import deque
 from datetime import datetime
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
-from typing import List
+from typing import Any, Deque, Dict, List, Optional, Set
 
 from stream_manager import (
     MessageStreamDefinition,
@@ -20,6 +22,241 @@ from stream_manager import (
 )
 from stream_manager.data import Message
 
+from src.AsyncStreamClient import AsyncStreamClient
+from src.BatchBuffer import BatchBuffer
+from src.BatchEncoder import ENCODER_MODE_SHARDED, ENCODER_MODE_THREAD, BatchEncoder, write_jsonl_batch
+from src.Compression import COMPRESSION_GZIP, Compression
+from src.JsonCodec import CODEC_AUTO, get_codec
+from src.Metrics import Metrics
+from src.PartitionedBuffer import PartitionedBuffer
+from src.SharedBatch import SharedBatch
+from src.SpoolQuota import SpoolQuota
+from src.ParquetBatch import (
+    PARQUET_COMPRESSIONS,
+    ParquetConversionError,
+    infer_schema,
+    parse_schema,
+    write_parquet_batch,
+)
+from src.StreamCheckpoint import StreamCheckpoint
+
+STARTUP_MODE_RESUME = "resume"
+STARTUP_MODE_RECREATE = "recreate"
+STARTUP_MODES = (STARTUP_MODE_RESUME, STARTUP_MODE_RECREATE)
+
+OUTPUT_FORMAT_JSONL = "jsonl"
+OUTPUT_FORMAT_PARQUET = "parquet"
+OUTPUT_FORMATS = (OUTPUT_FORMAT_JSONL, OUTPUT_FORMAT_PARQUET)
+
+# Batches are written under a hidden name and renamed once complete.
+PARTIAL_SUFFIX = ".partial"
+
+# Hidden, so never uploaded: batches that could not be converted to Parquet.
+DEAD_LETTER_DIR = ".dead-letter"
+
+# Hive's name for the partition of rows without a usable partition key.
+DEFAULT_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+
+# How long a read waits for the first message while a backlog is being drained.
+READ_TIMEOUT_MILLIS = 1000
+# Upper bound of an idle long poll, well below the client's 60 second request timeout.
+LONG_POLL_MAX_SECONDS = 30
+# Minimum time between two lag measurements, each of which costs a request.
+LAG_UPDATE_SECONDS = 10
+# Upper bounds (in seconds) of the batch encode latency buckets.
+ENCODE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _fsync_directory(directory: str):
+    """Persists the renames in a directory, where the platform allows opening directories."""
+
+    if hasattr(os, "O_DIRECTORY"):
+        dir_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+def partition_directory(partition_key: str, key: Any) -> str:
+    """Returns the sub-directory, e.g. "id=1", that messages with a partition key value go to.
+
+    Args:
+        partition_key (str): Dot separated path of the partition key field.
+        key (Any): Value of the partition key field.
+
+    Returns:
+        str: The Hive style sub-directory name, with the value percent-encoded so it
+            is always a single path segment.
+    """
+
+    if key is None or isinstance(key, (dict, list)) or key == "":
+        value = DEFAULT_PARTITION
+    elif isinstance(key, bool):
+        value = "true" if key else "false"
+    else:
+        value = urllib.parse.quote(str(key), safe="")
+    return f"{partition_key}={value}"
+
+
+class BatchWriteError(Exception):
+    """Raised when a batch could not be written, so the processor restarts from its checkpoint."""
+
+
+@dataclass
+class PendingBatch:
+    """A batch handed to the encoder pool that has not been published yet.
+
+    Attributes:
+        batch_id (int): Counter of the batch.
+        file_path (str): Final path of the batch file.
+        partial_path (str): Path the batch is written to before it is published.
+        first_sequence_number (int): Sequence number of the oldest message in the batch.
+        future (asyncio.Future): Resolves once the encoder pool has written the batch.
+        size_bytes (int): Uncompressed size of the batch.
+        message_count (int): Number of messages in the batch.
+    """
+    batch_id: int
+    file_path: str
+    partial_path: str
+    first_sequence_number: int
+    future: "asyncio.Future[int]"
+    size_bytes: int = 0
+    message_count: int = 0
+    shared_batch: Optional[SharedBatch] = None
+
+
+@dataclass
+class ShardJob:
+    """A raw batch handed to a worker process in "sharded" mode.
+
+    Attributes:
+        shared_batch_name (str): Name of the SharedBatch holding the raw payloads.
+        folder (str): Directory the batch files are written to, per partition.
+        file_name (str): Name of the batch file in each partition directory.
+        dead_letter_name (str): Name of the file a batch that cannot be converted to
+            Parquet is kept in.
+        json_codec (str): Codec used to validate and compact messages.
+        compression (Compression): How JSON Lines files are compressed.
+        partition_key (str, optional): JSON field messages are partitioned by, if any.
+        parquet (bool): Whether to write Parquet rather than JSON Lines.
+        parquet_schema (pyarrow.Schema, optional): Schema of Parquet files.
+        parquet_row_group_size (int, optional): Maximum rows per Parquet row group.
+        parquet_compression (str): Parquet column compression.
+        parquet_infer_on_mismatch (bool): Whether a partition that does not fit
+            `parquet_schema` is written with its own inferred schema.
+    """
+    shared_batch_name: str
+    folder: str
+    file_name: str
+    dead_letter_name: str
+    json_codec: str
+    compression: Compression
+    partition_key: Optional[str] = None
+    parquet: bool = False
+    parquet_schema: Any = None
+    parquet_row_group_size: Optional[int] = None
+    parquet_compression: str = "snappy"
+    parquet_infer_on_mismatch: bool = False
+
+
+@dataclass
+class ShardFile:
+    """A batch file a worker process wrote under its partial name.
+
+    Attributes:
+        file_path (str): Final path of the file.
+        partial_path (str): Path the file was written to.
+        size (int): Size of the file in bytes.
+        size_bytes (int): Uncompressed size of its messages.
+        message_count (int): Number of messages in the file.
+    """
+    file_path: str
+    partial_path: str
+    size: int
+    size_bytes: int
+    message_count: int
+
+
+@dataclass
+class ShardResult:
+    """Outcome of a ShardJob.
+
+    Attributes:
+        files (List[ShardFile]): Files written, one per partition.
+        valid_count (int): Messages that were valid.
+        invalid_count (int): Messages skipped as invalid.
+        errors (List[str]): Partitions that could not be converted to Parquet, and why.
+    """
+    files: List[ShardFile] = field(default_factory=list)
+    valid_count: int = 0
+    invalid_count: int = 0
+    errors: List[str] = field(default_factory=list)
+
+
+def write_shard(job: ShardJob) -> ShardResult:
+    """Validates a raw batch and writes it into one file per partition.
+
+    This runs inside the encoder pool in "sharded" mode, so all the per-message work
+    happens in the worker process. Files are written under their partial names and
+    synced; the processor renames them when it publishes the batch.
+
+    Args:
+        job (ShardJob): The batch and how to write it.
+
+    Returns:
+        ShardResult: The files written and the number of valid and invalid messages.
+    """
+
+    shared_batch = SharedBatch.attach(job.shared_batch_name)
+    try:
+        payloads = shared_batch.payloads()
+    finally:
+        shared_batch.close()
+
+    codec = get_codec(job.json_codec)
+    key_path = tuple(job.partition_key.split(".")) if job.partition_key else ()
+    partitions: Dict[Optional[str], List[bytes]] = {}
+    result = ShardResult()
+    for payload in payloads:
+        if key_path:
+            compact_payload, key = codec.compact_with_key(payload, key_path)
+            partition = partition_directory(job.partition_key, key)
+        else:
+            compact_payload, partition = codec.compact(payload), None
+        if compact_payload is None or (job.parquet and not compact_payload.startswith(b"{")):
+            result.invalid_count += 1
+            continue
+        partitions.setdefault(partition, []).append(compact_payload)
+        result.valid_count += 1
+    del payloads
+
+    for partition, messages in partitions.items():
+        folder = os.path.join(job.folder, partition) if partition else job.folder
+        os.makedirs(folder, exist_ok=True)
+        partial_path = os.path.join(folder, f".{job.file_name}{PARTIAL_SUFFIX}")
+        size_bytes = sum(len(message) + 1 for message in messages)
+        try:
+            if job.parquet:
+                size = write_parquet_batch(
+                    partial_path,
+                    b"\n".join(messages) + b"\n",
+                    job.parquet_schema,
+                    job.parquet_row_group_size,
+                    job.parquet_compression,
+                    os.path.join(folder, DEAD_LETTER_DIR, job.dead_letter_name),
+                    job.parquet_infer_on_mismatch,
+                )
+            else:
+                size = write_jsonl_batch(partial_path, messages, job.compression)
+        except ParquetConversionError as e:
+            result.errors.append(f"{partition or folder}: {e}")
+            continue
+        result.files.append(
+            ShardFile(os.path.join(folder, job.file_name), partial_path, size, size_bytes, len(messages))
+        )
+    return result
+
 
 @dataclass
 class ProcessorConfig:
@@ -27,28 +264,96 @@ class ProcessorConfig:
 
     Attributes:
         stream_name (str): Name of the message stream to be processed.
-        batch_size (int): The size of each batch of messages to be written to a file.
+        batch_size (int): The number of messages that triggers writing a batch to a file.
         interval (int): Time interval (in seconds) to wait between reading messages.
-        path (str): Path to the directory where the gzip files will be saved.
+        path (str): Path to the directory where the batch files will be saved.
+        batch_max_bytes (int): Uncompressed size (in bytes) that triggers writing a batch
+            to a file. 0 disables the limit.
+        batch_max_age (int): Time (in seconds) the oldest buffered message may wait before
+            the batch is written to a file. 0 disables the limit.
+        json_codec (str): Codec used to validate and compact messages; "auto", "json",
+            "orjson" or "passthrough".
+        encoder_workers (int): Number of workers compressing batches in parallel.
+        encoder_mode (str): Either "thread" or "process" for the encoder pool, or
+            "sharded" for a process pool that also validates the messages.
+        max_pending_batches (int): Maximum number of batches being compressed at once.
+        compression (str): Codec for batch files; "gzip", "zstd" or "none".
+        compression_level (int, optional): Compression level, or None for the codec's default.
+        compression_threads (int): Number of zstd worker threads per batch; -1 uses all cores.
+        output_format (str): Either "jsonl" for compressed JSON Lines or "parquet".
+        parquet_schema (str, optional): JSON object mapping field names to Arrow types. If
+            not set, the schema is inferred from the first batch.
+        parquet_row_group_size (int, optional): Maximum rows per Parquet row group, or None
+            for one row group per file.
+        parquet_compression (str): Parquet column compression, e.g. "snappy" or "zstd".
+        partition_key (str, optional): Dot separated path of a JSON field, e.g. "id" or
+            "location.country". When set, messages are batched per value of the field and
+            written to `<path>/<partition_key>=<value>/` sub-directories.
+        max_open_partitions (int): Maximum number of partitions buffered at once. The least
+            recently used partition is flushed to make room for a new one.
+        startup_mode (str): Either "resume" to reuse the existing stream and continue from
+            the last checkpoint, or "recreate" to delete the stream and start from scratch.
+        checkpoint_path (str, optional): Location of the checkpoint file. Defaults to a
+            hidden file named after the stream inside `path`.
     """
     stream_name: str
     batch_size: int
     interval: int
     path: str
+    batch_max_bytes: int = 16 * 1024 * 1024
+    batch_max_age: int = 300
+    json_codec: str = CODEC_AUTO
+    encoder_workers: int = 1
+    encoder_mode: str = ENCODER_MODE_THREAD
+    max_pending_batches: int = 4
+    compression: str = COMPRESSION_GZIP
+    compression_level: Optional[int] = None
+    compression_threads: int = 0
+    output_format: str = OUTPUT_FORMAT_JSONL
+    parquet_schema: Optional[str] = None
+    parquet_row_group_size: Optional[int] = None
+    parquet_compression: str = "snappy"
+    partition_key: Optional[str] = None
+    max_open_partitions: int = 100
+    startup_mode: str = STARTUP_MODE_RESUME
+    checkpoint_path: Optional[str] = None
 
 
 class BatchMessageProcessor:
-    """Reads JSON messages from a stream and writes batches of them into a gzip file.
+    """Reads JSON messages from a stream and writes batches of them into compressed files.
 
     Attributes:
         client (StreamManagerClient): Client to manage the message stream. If not provided, 
             a default StreamManagerClient instance will be created.
+        async_client (AsyncStreamClient): Wrapper that runs blocking client calls off the event loop.
         logger (logging.Logger): Logger instance for logging messages and exceptions.
         interval (int): Time interval (in seconds) to wait between reading messages.
-        batch_size (int): The size of each batch of messages to be written to a file.
-        output_folder (str): Path to the directory where the gzip files will be saved.
+        batch_size (int): The number of messages that triggers writing a batch to a file.
+        partitions (PartitionedBuffer): Messages carried across reads, per partition, until
+            a batch is flushed.
+        partition_key (Optional[str]): JSON field messages are partitioned by, if any.
+        last_read_sequence_number (Optional[int]): Sequence number of the newest message read.
+        codec (JsonCodec): Validates and compacts each message payload in a single pass.
+        compression (Compression): How batch files are compressed.
+        output_format (str): Either "jsonl" or "parquet".
+        parquet_schema (pyarrow.Schema, optional): Schema of Parquet batches, once known.
+        file_extension (str): Extension of batch files, e.g. ".jsonl.gz".
+        encoder (BatchEncoder): Pool that compresses batches off the event loop.
+        sharded (bool): Whether the encoder pool is in "sharded" mode. Messages are
+            then buffered as read and validated by the worker writing their batch.
+        pending_batches (Deque[PendingBatch]): Submitted batches, in batch_id order.
+        published_files (Optional[asyncio.Queue[str]]): Receives the path of each batch
+            file once it is complete.
+        quota (Optional[SpoolQuota]): Size limit of the spool, told about every batch file.
+        metrics (Metrics): Registry the processor's metrics are kept in, labelled with
+            the stream name.
+        output_folder (str): Path to the directory where the batch files will be saved.
         stream_name (str): Name of the message stream to be processed.
         batch_id (int): Counter for the batches processed.
+        checkpoint (StreamCheckpoint): Last sequence number flushed to disk.
+        start_sequence_number (int): Sequence number the first read starts from.
+        lag (Optional[int]): Number of messages in the stream that have not been read
+            yet, as last measured, or None before the first measurement.
     """
 
     def __init__(
@@ -56,6 +361,11 @@ class BatchMessageProcessor:
         config: ProcessorConfig,
         logger: logging.Logger,
         client: StreamManagerClient = None,
+        async_client: AsyncStreamClient = None,
+        encoder: BatchEncoder = None,
+        published_files: "asyncio.Queue[str]" = None,
+        quota: SpoolQuota = None,
+        metrics: Metrics = None,
     ):
         """Initializes BatchMessageProcessor with the given configuration, logger, and client.
 
@@ -64,104 +374,298 @@ class BatchMessageProcessor:
             logger (logging.Logger): Logger instance for logging messages and exceptions.
             client (StreamManagerClient, optional): Client to manage the message stream. 
                 If not provided, a default StreamManagerClient instance will be created.
+            async_client (AsyncStreamClient, optional): Shared client wrapper to use instead
+                of creating one. It is not closed by `close`.
+            encoder (BatchEncoder, optional): Shared encoder pool to use instead of creating
+                one from the configuration. It is not closed by `close`.
+            published_files (asyncio.Queue[str], optional): Queue the path of every batch
+                file is put on once it is complete, e.g. for the DirectoryUploader.
+            quota (SpoolQuota, optional): Size limit of the spool. Reads pause or files
+                are dropped once it is reached, depending on its policy.
+            metrics (Metrics, optional): Shared metrics registry. Defaults to a new one.
         """
 
-        self.client = client or StreamManagerClient()
+        self._owns_client = async_client is None
+        if async_client is None:
+            async_client = AsyncStreamClient(client or StreamManagerClient(), max_workers=1)
+        self.async_client = async_client
+        self.client = async_client.client
         self.logger = logger
         self.interval = config.interval
         self.batch_size = config.batch_size
+        self.partitions = PartitionedBuffer(
+            lambda: BatchBuffer(
+                max_messages=config.batch_size,
+                max_bytes=config.batch_max_bytes,
+                max_age=config.batch_max_age,
+            ),
+            max_partitions=config.max_open_partitions,
+        )
+        self.partition_key = config.partition_key
+        self._partition_key_path = tuple(config.partition_key.split(".")) if config.partition_key else ()
+        self.last_read_sequence_number: Optional[int] = None
+        self.codec = get_codec(config.json_codec)
+        self.compression = Compression(
+            codec=config.compression,
+            level=config.compression_level,
+            threads=config.compression_threads,
+        )
+        self.output_format = config.output_format
+        self.parquet_schema = None
+        self._parquet_schema_configured = bool(config.parquet_schema)
+        self.parquet_row_group_size = config.parquet_row_group_size
+        self.parquet_compression = config.parquet_compression
+        self.file_extension = self.file_extension_for(config)
+        self._owns_encoder = encoder is None
+        self.encoder = encoder or BatchEncoder(
+            workers=config.encoder_workers,
+            mode=config.encoder_mode,
+            max_pending=config.max_pending_batches,
+        )
+        self.sharded = self.encoder.mode == ENCODER_MODE_SHARDED
+        self.json_codec = config.json_codec
+        self.pending_batches: Deque[PendingBatch] = deque()
+        self.published_files = published_files
+        self.quota = quota
         self.output_folder = config.path
         self.stream_name = config.stream_name
         self.batch_id = 0
+        self.startup_mode = config.startup_mode
+        self.checkpoint = StreamCheckpoint(
+            config.checkpoint_path
+            or os.path.join(config.path, f".{config.stream_name}.checkpoint")
+        )
+        self.start_sequence_number = 0
+        self._checkpointed_sequence_number = -1
+        self.lag: Optional[int] = None
+        self._lag_updated_at: Optional[float] = None
+        self._started = False
+        self.metrics = metrics or Metrics()
+        self._register_metrics()
+
+        if self.startup_mode not in STARTUP_MODES:
+            raise ValueError(
+                f"Unknown startup mode {self.startup_mode}, expected one of {STARTUP_MODES}"
+            )
+        if self.output_format == OUTPUT_FORMAT_PARQUET:
+            if self.parquet_compression not in PARQUET_COMPRESSIONS:
+                raise ValueError(
+                    f"Unknown Parquet compression {self.parquet_compression}, "
+                    f"expected one of {PARQUET_COMPRESSIONS}"
+                )
+            if config.parquet_schema:
+                self.parquet_schema = parse_schema(config.parquet_schema)
 
         self.logger.debug(f"BatchMessageProcessor initialized with {config}")
 
-        self._prepare_stream()
+        self._remove_partial_batches()
 
-    def _prepare_stream(self):
+    def _register_metrics(self):
+        """Creates the processor's metrics, or picks them up again after a restart."""
+
+        stream = self.stream_name
+        self._messages_read = self.metrics.counter("messages_read", "Messages read from the stream.", stream=stream)
+        self._messages_valid = self.metrics.counter("messages_valid", "Messages added to a batch.", stream=stream)
+        self._messages_invalid = self.metrics.counter(
+            "messages_invalid", "Messages skipped as invalid.", stream=stream
+        )
+        self._batches_written = self.metrics.counter("batches_written", "Batch files published.", stream=stream)
+        self._messages_written = self.metrics.counter(
+            "messages_written", "Messages in the published batch files.", stream=stream
+        )
+        self._uncompressed_bytes = self.metrics.counter(
+            "batch_uncompressed_bytes", "Size of the published batches before compression.", stream=stream
+        )
+        self._compressed_bytes = self.metrics.counter(
+            "batch_compressed_bytes", "Size of the published batch files.", stream=stream
+        )
+        self.metrics.gauge(
+            "compression_ratio", "Uncompressed over compressed size of the published batches.", stream=stream
+        ).set_function(
+            lambda: self._uncompressed_bytes.total / self._compressed_bytes.total if self._compressed_bytes.total else 0
+        )
+        self._encode_latency = self.metrics.histogram(
+            "batch_encode_seconds",
+            "Time from submitting a batch to the encoder pool until it is written.",
+            buckets=ENCODE_BUCKETS,
+            stream=stream,
+        )
+        self._lag_gauge = self.metrics.gauge(
+            "stream_lag_messages", "Messages in the stream that have not been read yet.", stream=stream
+        )
+
+    @staticmethod
+    def file_extension_for(config: ProcessorConfig) -> str:
+        """Returns the extension of the batch files written with the given configuration.
+
+        Args:
+            config (ProcessorConfig): Configuration for the processor.
+
+        Returns:
+            str: The file extension, e.g. ".jsonl.gz".
+        """
+
+        if config.output_format == OUTPUT_FORMAT_PARQUET:
+            return ".parquet"
+        if config.output_format != OUTPUT_FORMAT_JSONL:
+            raise ValueError(
+                f"Unknown output format {config.output_format}, expected one of {OUTPUT_FORMATS}"
+            )
+        return ".jsonl" + Compression(codec=config.compression, level=config.compression_level).extension
+
+    def _remove_partial_batches(self):
+        """Removes batches left half-written by a previous run.
+
+        Their messages were never checkpointed, so they are read from the stream again.
+        """
+
+        partial_pattern = os.path.join(glob.escape(self.output_folder), "**", f".*{PARTIAL_SUFFIX}")
+        for partial_path in glob.glob(partial_pattern, recursive=True):
+            self.logger.info(f"Removing incomplete batch {partial_path}")
+            os.remove(partial_path)
+
+    async def start(self):
+        """Prepares the message stream, once. `run` calls this if it has not been called yet."""
+
+        if not self._started:
+            await self._prepare_stream()
+            self._started = True
+
+    async def _prepare_stream(self):
         """Prepares the message stream for use by the BatchMessageProcessor.
 
-        This method checks if the message stream exists and deletes it if it does.
+        In "resume" mode an existing stream is reused and reading continues after the
+        last checkpointed sequence number. In "recreate" mode, or when the stream does
+        not exist yet, the stream is (re)created and reading starts from the beginning.
         """
 
-        try:
-            self.client.delete_message_stream(stream_name=self.stream_name)
-        except ResourceNotFoundException:
-            pass
-        
+        if self.startup_mode == STARTUP_MODE_RESUME:
+            try:
+                stream_info = await self.async_client.describe_message_stream(self.stream_name)
+            except ResourceNotFoundException:
+                pass
+            else:
+                self._resume_from_checkpoint(stream_info.storage_status.newest_sequence_number)
+                return
+        else:
+            try:
+                await self.async_client.delete_message_stream(self.stream_name)
+            except ResourceNotFoundException:
+                pass
+
+        # Sequence numbers restart at zero on a new stream, so any checkpoint is stale.
+        self.checkpoint.clear()
+
         self.logger.info(f"Creating stream {self.stream_name}...")
-        self.client.create_message_stream(
-            definition=MessageStreamDefinition(
+        await self.async_client.create_message_stream(
+            MessageStreamDefinition(
                 name=self.stream_name,
                 strategy_on_full=StrategyOnFull.OverwriteOldestData,
             )
         )
 
-    @staticmethod
-    def _is_valid_json(message: str) -> bool:
-        """Checks if a given string is a valid JSON.
+    def _resume_from_checkpoint(self, newest_sequence_number: Optional[int]):
+        """Sets the starting sequence number from the checkpoint of an existing stream.
 
         Args:
-            message (str): Message string to be validated.
-
-        Returns:
-            bool: True if the message is a valid JSON, False otherwise.
+            newest_sequence_number (Optional[int]): Sequence number of the last message
+                appended to the stream, or None if the stream is empty.
         """
 
-        try:
-            json.loads(message)
-            return True
-        except ValueError:
-            return False
+        last_flushed = self.checkpoint.load()
+        if last_flushed is None:
+            self.logger.info(f"Resuming stream {self.stream_name} from the oldest message")
+            return
+
+        if newest_sequence_number is None or newest_sequence_number < last_flushed:
+            # The stream was recreated behind our back; its numbering restarted.
+            self.logger.warning(
+                f"Checkpoint {last_flushed} is ahead of stream {self.stream_name}, "
+                "resuming from the oldest message"
+            )
+            self.checkpoint.clear()
+            return
+
+        self.start_sequence_number = last_flushed + 1
+        self._checkpointed_sequence_number = last_flushed
+        self.logger.info(
+            f"Resuming stream {self.stream_name} from sequence number {self.start_sequence_number}"
+        )
 
     async def _read_messages(self, under_test: bool=False):
-        """Reads messages from the stream and writes them into gzip files in batches.
+        """Reads messages from the stream and writes them into batch files.
+
+        This method reads messages from the stream, validates them, and buffers
+        them across reads, per partition. A partition's buffer is written to a batch
+        file as soon as its message count, size or age limit is reached.
 
-        This method reads messages from the stream, validates them, and writes 
-        them to a gzip file if the batch size is reached.
+        How long to wait before the next read depends on the last one. A full read
+        means a backlog is waiting, so the stream is read again right away. A read
+        that found nothing turns into a long poll, which returns as soon as a message
+        arrives. Otherwise the loop sleeps for `interval` to let messages accumulate.
+        While the spool is over a quota that pauses reads, messages are left waiting in
+        the stream until uploads make room.
 
         Args:
             under_test (bool, optional): Flag to determine if the function is 
                 being executed under a test environment. Defaults to False.
         """
 
-        next_seq = 0
+        next_seq = self.start_sequence_number
+        max_message_count = self.batch_size * 10
+        long_poll_millis = min(self.interval, LONG_POLL_MAX_SECONDS) * 1000
+        read_timeout_millis = READ_TIMEOUT_MILLIS
         keep_looping = True
         while keep_looping:
+            full = idle = False
+            if self.quota is not None and self.quota.paused:
+                self.logger.warning(
+                    f"Spool is over its quota of {self.quota.max_bytes} bytes, "
+                    f"pausing reads of stream {self.stream_name}"
+                )
+                await self.quota.wait_for_space()
+                self.logger.info(f"Spool has room again, resuming reads of stream {self.stream_name}")
             try:
                 self.logger.debug("Reading messages from stream")
 
                 # Read messages from the stream.
-                messages_list: List[Message] = self.client.read_messages(
+                messages_list: List[Message] = await self.async_client.read_messages(
                     self.stream_name,
                     ReadMessagesOptions(
                         desired_start_sequence_number=next_seq,
-                        min_message_count=self.batch_size,
-                        max_message_count=self.batch_size * 10,
-                        read_timeout_millis=1000,
+                        min_message_count=1,
+                        max_message_count=max_message_count,
+                        read_timeout_millis=read_timeout_millis,
                     ),
                 )
 
-                # Extract and validate messages.
-                valid_messages: List[str] = []
+                # Extract and validate messages, flushing whenever a buffer fills up.
+                # Only the buffers keep the compact messages.
+                valid_count = 0
                 for message in messages_list:
-                    decoded_payload = message.payload.decode()
-                    if self._is_valid_json(decoded_payload):
-                        valid_messages.append(decoded_payload)
-
-                self.logger.info(f"Read {len(valid_messages)} messages from stream")
-                self.logger.debug(f"Messages: {valid_messages}")
-
-                # Write valid messages into a gzip file if the batch size is reached.
-                if len(valid_messages) >= self.batch_size:
-                    await self._write_to_gzip(valid_messages)
+                    if await self._process_message(message) is not None:
+                        valid_count += 1
+                self._messages_read.inc(len(messages_list))
+                if self.sharded:
+                    # Validated by the workers, and counted as their batches are published.
+                    self.logger.info(f"Read {len(messages_list)} messages from stream")
+                else:
+                    self._messages_valid.inc(valid_count)
+                    self._messages_invalid.inc(len(messages_list) - valid_count)
+                    self.logger.info(f"Read {valid_count} messages from stream")
 
                 # Update the sequence number for the next batch.
                 if messages_list:
                     next_seq = messages_list[-1].sequence_number + 1
+                full = len(messages_list) >= max_message_count
+                idle = not messages_list
+                # Released before the next read, so two reads are never held at once.
+                del messages_list
 
             except NotEnoughMessagesException:
-                pass
+                idle = True
+            except BatchWriteError:
+                raise
             except StreamManagerException as e:
                 self.logger.error(f"StreamManagerException occurred: {e}")
                 # Maybe add some retries or specific handling based on the exception details.
@@ -175,29 +679,348 @@ class BatchMessageProcessor:
                 self.logger.exception(f"Unexpected error: {e}")
                 await asyncio.sleep(5)  # Wait for 5 seconds before retrying in case of any other unexpected error.
 
-            await asyncio.sleep(self.interval)
+            # Flush partial batches once their oldest message is old enough.
+            for partition, buffer in self.partitions.ready():
+                await self._flush_buffer(partition, buffer)
+
+            if full:
+                # Keep reading while batches are encoded; the encoder's slots hold reads
+                # back if it falls behind.
+                await self._publish_batches()
+            else:
+                # Reads pause here anyway, so let in-flight batches finish and publish them.
+                await self._publish_batches(wait=True)
+
+            if idle:
+                # Nothing at next_seq means everything has been read.
+                self._set_lag(0)
+            else:
+                await self._update_lag(next_seq)
+
+            if full:
+                read_timeout_millis = READ_TIMEOUT_MILLIS
+            elif idle:
+                read_timeout_millis = long_poll_millis
+            else:
+                read_timeout_millis = READ_TIMEOUT_MILLIS
+                await asyncio.sleep(self.interval)
             keep_looping = not under_test
 
-    async def _write_to_gzip(self, valid_messages: List[str]) -> None:
-        """Writes valid messages into a gzip file.
+        if under_test and self.pending_batches:
+            # Tests look at the output right away, so no write may still be running.
+            await asyncio.wait([batch.future for batch in self.pending_batches])
+
+    async def _update_lag(self, next_seq: int):
+        """Measures how far reading is behind the tail of the stream.
+
+        The measurement needs a request to StreamManager, so it is taken at most once
+        every `LAG_UPDATE_SECONDS`. It is informational only, so failures are logged
+        and otherwise ignored.
 
         Args:
-            valid_messages (List[str]): List of valid JSON messages to be written to the gzip file.
+            next_seq (int): Sequence number of the next message to read.
         """
 
-        os.makedirs(self.output_folder, exist_ok=True)
-        date_str = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        file_path = os.path.join(self.output_folder, f"{date_str}_{self.batch_id}.jsonl.gz")
+        now = time.monotonic()
+        if self._lag_updated_at is not None and now - self._lag_updated_at < LAG_UPDATE_SECONDS:
+            return
+
+        try:
+            stream_info = await self.async_client.describe_message_stream(self.stream_name)
+            newest_sequence_number = stream_info.storage_status.newest_sequence_number
+            self._set_lag(
+                0 if newest_sequence_number is None else max(newest_sequence_number + 1 - next_seq, 0)
+            )
+        except Exception as e:
+            self.logger.warning(f"Could not measure the lag of stream {self.stream_name}: {e}")
+        self._lag_updated_at = now
+
+    def _set_lag(self, lag: int):
+        if lag != self.lag:
+            self.logger.info(f"Stream {self.stream_name} lag is {lag} messages")
+        self.lag = lag
+        self._lag_gauge.set(lag)
+
+    async def _process_message(self, message: Message) -> Optional[bytes]:
+        """Validates a message and adds it to the buffer of its partition.
+
+        Args:
+            message (Message): The message read from the stream.
+
+        In "sharded" mode the raw payload is buffered instead, and a batch holds a
+        range of sequence numbers that the worker writing it validates and partitions.
+
+        Returns:
+            Optional[bytes]: The compact message, or None if it is not valid JSON, or
+                not a JSON object when writing Parquet. The raw payload in "sharded" mode.
+        """
+
+        self.last_read_sequence_number = message.sequence_number
+
+        if self.sharded:
+            buffer, _ = self.partitions.get(None)
+            buffer.add(message.payload, len(message.payload) + 1, message.sequence_number)
+            if buffer.should_flush():
+                await self._flush_buffer(None, buffer)
+            return message.payload
+
+        if self._partition_key_path:
+            compact_payload, key = self.codec.compact_with_key(message.payload, self._partition_key_path)
+            partition = self._partition_for(key)
+        else:
+            compact_payload, partition = self.codec.compact(message.payload), None
+        if compact_payload is None:
+            return None
+        if self.output_format == OUTPUT_FORMAT_PARQUET and not compact_payload.startswith(b"{"):
+            # Only JSON objects map to Parquet rows.
+            self.logger.warning(
+                f"Skipping message {message.sequence_number}, it is not a JSON object"
+            )
+            return None
+
+        buffer, evicted = self.partitions.get(partition)
+        if evicted is not None and len(evicted[1]):
+            self.logger.debug(f"Flushing least recently used partition {evicted[0]}")
+            await self._flush_buffer(*evicted)
+
+        buffer.add(compact_payload, len(compact_payload) + 1, message.sequence_number)
+        if buffer.should_flush():
+            await self._flush_buffer(partition, buffer)
+        return compact_payload
+
+    def _partition_for(self, key: Any) -> str:
+        """Returns the sub-directory, e.g. "id=1", that messages with a partition key value go to."""
+
+        return partition_directory(self.partition_key, key)
+
+    async def _flush_buffer(self, partition: Optional[str], buffer: BatchBuffer) -> None:
+        """Hands a partition's buffered messages to the encoder pool as the next batch.
+
+        Waits for a free slot if `max_pending_batches` batches are already in flight.
+        The buffer is only emptied once the batch is queued, so until then its messages
+        hold the checkpoint back.
 
-        with gzip.open(file_path, "wt") as f:
-            for message in valid_messages:
-                json_obj = json.loads(message)
-                json_str = json.dumps(json_obj, separators=(",", ":"))
-                f.write(json_str + "\n")
+        Args:
+            partition (Optional[str]): The partition sub-directory, or None when
+                partitioning is disabled.
+            buffer (BatchBuffer): The partition's buffer.
+
+        Raises:
+            BatchWriteError: If the batch could not be queued.
+        """
+
+        try:
+            await self._write_batch(buffer.messages, buffer.first_sequence_number, partition, buffer.size_bytes)
+        except Exception as e:
+            raise BatchWriteError(f"Failed to queue a batch of {len(buffer)} messages") from e
+        buffer.drain()
+        await self._publish_batches()
+
+    async def _write_batch(
+        self,
+        valid_messages: List[bytes],
+        first_sequence_number: int,
+        partition: Optional[str] = None,
+        size_bytes: int = 0,
+    ) -> None:
+        """Submits valid messages to be written into a compressed JSON Lines or Parquet file.
+
+        The batch is numbered and named on submission, so file names follow the
+        order of the stream no matter which worker finishes first. Without an explicit
+        Parquet schema, the first batch's schema is inferred here and reused for every
+        later batch, so all files share one schema. A batch that cannot be converted to
+        Parquet is kept in a hidden `.dead-letter` sub-directory instead.
+
+        Args:
+            valid_messages (List[bytes]): List of compact JSON messages to be written to the file.
+            first_sequence_number (int): Sequence number of the oldest message in the batch.
+            partition (Optional[str], optional): Partition sub-directory to write to.
+            size_bytes (int, optional): Uncompressed size of the batch, for the metrics.
+        """
 
-        self.logger.info(f"Successfully wrote batch {self.batch_id} to {file_path}")
+        folder = os.path.join(self.output_folder, partition) if partition else self.output_folder
+        os.makedirs(folder, exist_ok=True)
+        date_str = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        file_name = f"{date_str}_{self.batch_id}{self.file_extension}"
+        file_path = os.path.join(folder, file_name)
+        partial_path = os.path.join(folder, f".{file_name}{PARTIAL_SUFFIX}")
+
+        submitted_at = time.monotonic()
+        shared_batch = None
+        if self.sharded:
+            if self.output_format == OUTPUT_FORMAT_PARQUET and self.parquet_schema is None:
+                # Once, so every worker converts to the same schema.
+                compact_messages = [self.codec.compact(message) for message in valid_messages]
+                self._infer_parquet_schema(
+                    b"".join(message + b"\n" for message in compact_messages if message and message.startswith(b"{"))
+                )
+            shared_batch = SharedBatch.create(valid_messages)
+            try:
+                future = await self.encoder.submit(
+                    write_shard,
+                    ShardJob(
+                        shared_batch_name=shared_batch.name,
+                        folder=folder,
+                        file_name=file_name,
+                        dead_letter_name=f"{date_str}_{self.batch_id}.jsonl",
+                        json_codec=self.json_codec,
+                        compression=self.compression,
+                        partition_key=self.partition_key,
+                        parquet=self.output_format == OUTPUT_FORMAT_PARQUET,
+                        parquet_schema=self.parquet_schema,
+                        parquet_row_group_size=self.parquet_row_group_size,
+                        parquet_compression=self.parquet_compression,
+                        parquet_infer_on_mismatch=not self._parquet_schema_configured,
+                    ),
+                )
+            except BaseException:
+                shared_batch.close()
+                raise
+            # The worker has copied the payloads out by the time it completes.
+            future.add_done_callback(lambda _: shared_batch.close())
+        elif self.output_format == OUTPUT_FORMAT_PARQUET:
+            # Arrow's JSON reader takes one buffer, so Parquet batches are joined.
+            data = b"\n".join(valid_messages) + b"\n"
+            if self.parquet_schema is None:
+                self._infer_parquet_schema(data)
+            future = await self.encoder.submit(
+                write_parquet_batch,
+                partial_path,
+                data,
+                self.parquet_schema,
+                self.parquet_row_group_size,
+                self.parquet_compression,
+                os.path.join(folder, DEAD_LETTER_DIR, f"{date_str}_{self.batch_id}.jsonl"),
+                # A configured schema is kept to; an inferred one may not fit every batch.
+                not self._parquet_schema_configured,
+            )
+        else:
+            # Streamed into the compressor by the worker, without joining the batch first.
+            future = await self.encoder.submit(write_jsonl_batch, partial_path, valid_messages, self.compression)
+        future.add_done_callback(lambda _: self._encode_latency.observe(time.monotonic() - submitted_at))
+        self.pending_batches.append(
+            PendingBatch(
+                self.batch_id,
+                file_path,
+                partial_path,
+                first_sequence_number,
+                future,
+                size_bytes,
+                len(valid_messages),
+                shared_batch,
+            )
+        )
         self.batch_id += 1
 
+    def _infer_parquet_schema(self, data: bytes):
+        """Infers the schema of all Parquet batches from the first one."""
+
+        try:
+            self.parquet_schema = infer_schema(data)
+            self.logger.info(f"Inferred Parquet schema from the first batch: {self.parquet_schema}")
+        except ParquetConversionError as e:
+            # The worker fails the same way and sets the batch aside.
+            self.logger.warning(f"Could not infer a Parquet schema from batch {self.batch_id}: {e}")
+
+    async def _publish_batches(self, wait: bool = False) -> None:
+        """Publishes completed batches in order and advances the checkpoint.
+
+        A batch is only published once every batch submitted before it has been. The
+        checkpoint only moves up to just before the oldest message that is still
+        buffered or being written, so with partitioning a restart can rewrite messages
+        of partitions that were already flushed, but never loses any. A batch that
+        could not be converted to Parquet was set aside by the worker and is skipped,
+        as reading it again would fail the same way. In "sharded" mode a batch is a
+        file per partition, all published together. Workers sync each file to disk,
+        and the renames are synced before the checkpoint moves past their messages.
+
+        Args:
+            wait (bool, optional): Wait for all in-flight batches to complete first.
+                Defaults to False.
+
+        Raises:
+            BatchWriteError: If a batch could not be written.
+        """
+
+        if wait and self.pending_batches:
+            await asyncio.wait([batch.future for batch in self.pending_batches])
+
+        published_dirs = set()
+        try:
+            while self.pending_batches and self.pending_batches[0].future.done():
+                batch = self.pending_batches[0]
+                try:
+                    result = batch.future.result()
+                except ParquetConversionError as e:
+                    self.pending_batches.popleft()
+                    self.logger.error(f"Could not convert batch {batch.batch_id} to Parquet: {e}")
+                    continue
+                except Exception as e:
+                    raise BatchWriteError(f"Failed to write batch {batch.batch_id} to {batch.file_path}") from e
+                if isinstance(result, ShardResult):
+                    self._publish_shard(batch, result, published_dirs)
+                    continue
+                size = result
+                os.replace(batch.partial_path, batch.file_path)
+                published_dirs.add(os.path.dirname(batch.file_path))
+                self.pending_batches.popleft()
+                self.logger.info(f"Successfully wrote batch {batch.batch_id} to {batch.file_path}")
+                self._publish_file(batch.file_path, size, batch.size_bytes, batch.message_count)
+        finally:
+            for directory in published_dirs:
+                _fsync_directory(directory)
+            self._save_checkpoint()
+
+    def _publish_shard(self, batch: PendingBatch, result: ShardResult, published_dirs: Set[str]) -> None:
+        """Publishes the files a worker wrote for a batch in "sharded" mode, one per partition."""
+
+        for shard_file in result.files:
+            os.replace(shard_file.partial_path, shard_file.file_path)
+            published_dirs.add(os.path.dirname(shard_file.file_path))
+        self.pending_batches.popleft()
+        for error in result.errors:
+            self.logger.error(f"Could not convert part of batch {batch.batch_id} to Parquet: {error}")
+        self._messages_valid.inc(result.valid_count)
+        self._messages_invalid.inc(result.invalid_count)
+        for shard_file in result.files:
+            self.logger.info(f"Successfully wrote batch {batch.batch_id} to {shard_file.file_path}")
+            self._publish_file(shard_file.file_path, shard_file.size, shard_file.size_bytes, shard_file.message_count)
+
+    def _publish_file(self, file_path: str, size: int, size_bytes: int, message_count: int) -> None:
+        """Accounts for a published batch file and hands it to the uploader."""
+
+        self._batches_written.inc()
+        self._messages_written.inc(message_count)
+        self._uncompressed_bytes.inc(size_bytes)
+        self._compressed_bytes.inc(size)
+        evicted = self.quota.add(file_path, size) if self.quota is not None else []
+        if evicted:
+            self.logger.warning(
+                f"Spool is over its quota of {self.quota.max_bytes} bytes, "
+                f"dropped {len(evicted)} files: {evicted}"
+            )
+        if self.published_files is not None and file_path not in evicted:
+            self.published_files.put_nowait(file_path)
+
+    def _save_checkpoint(self) -> None:
+        """Checkpoints the newest sequence number below which everything has been written."""
+
+        unwritten = [batch.first_sequence_number for batch in self.pending_batches]
+        oldest_buffered = self.partitions.oldest_sequence_number()
+        if oldest_buffered is not None:
+            unwritten.append(oldest_buffered)
+
+        if unwritten:
+            sequence_number = min(unwritten) - 1
+        elif self.last_read_sequence_number is not None:
+            sequence_number = self.last_read_sequence_number
+        else:
+            return
+
+        if sequence_number > self._checkpointed_sequence_number:
+            self.checkpoint.save(sequence_number)
+            self._checkpointed_sequence_number = sequence_number
+
     async def run(self, under_test: bool=False):
         """Starts the message reading process.
 
@@ -206,9 +1029,21 @@ class BatchMessageProcessor:
                 being executed under a test environment. Defaults to False.
         """
 
+        await self.start()
         await self._read_messages(under_test=under_test)
 
     def close(self):
-        """Closes the client connection to the message stream."""
-        
-        self.client.close()
+        """Closes the client connection to the message stream and stops the encoder pool.
+
+        A shared client or encoder pool is left open for its owner to close. The shared
+        memory of batches still in flight is freed.
+        """
+
+        for batch in self.pending_batches:
+            if batch.shared_batch is not None:
+                batch.shared_batch.close()
+
+        if self._owns_encoder:
+            self.encoder.close()
+        if self._owns_client:
+            self.async_client.close()
@@ -0,0 +1,89 @@
+import time
+
+from typing import Callable, Optional
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Pauses submissions after a run of consecutive failures.
+
+    While closed, everything is allowed. After `failure_threshold` consecutive
+    failures the breaker opens and allows nothing for `reset_timeout` seconds. It then
+    turns half-open and allows a single probe: a success closes it again, a failure
+    opens it for another `reset_timeout`. A probe that reports neither within
+    `reset_timeout` is replaced by a new one.
+
+    Attributes:
+        failure_threshold (int): Consecutive failures that open the breaker. 0 disables it.
+        reset_timeout (float): Seconds the breaker stays open before probing.
+        state (str): One of "closed", "open" or "half_open".
+        consecutive_failures (int): Failures since the last success.
+        trips (int): Number of times the breaker opened.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = 10,
+        reset_timeout: float = 60,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """Initializes CircuitBreaker.
+
+        Args:
+            failure_threshold (int, optional): Consecutive failures that open the breaker.
+                0 disables it. Defaults to 10.
+            reset_timeout (float, optional): Seconds to stay open before probing. Defaults to 60.
+            clock (Callable[[], float], optional): Monotonic clock. Defaults to time.monotonic.
+        """
+
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = STATE_CLOSED
+        self.consecutive_failures = 0
+        self.trips = 0
+        self._clock = clock
+        self._changed_at = clock()
+
+    def allow(self) -> bool:
+        """Returns whether a submission may go ahead now, taking the probe if half-open."""
+
+        if self.state == STATE_CLOSED:
+            return True
+        if self._clock() - self._changed_at < self.reset_timeout:
+            return False
+        # Open long enough, or the last probe never reported back: probe again.
+        self._set_state(STATE_HALF_OPEN)
+        return True
+
+    def retry_after(self) -> Optional[float]:
+        """Returns the seconds until a probe is allowed, or None if the breaker is closed."""
+
+        if self.state == STATE_CLOSED:
+            return None
+        return max(self.reset_timeout - (self._clock() - self._changed_at), 0.0)
+
+    def record_success(self):
+        """Records a successful export, closing the breaker."""
+
+        self.consecutive_failures = 0
+        if self.state != STATE_CLOSED:
+            self._set_state(STATE_CLOSED)
+
+    def record_failure(self):
+        """Records a failed export, opening the breaker if the threshold is reached."""
+
+        self.consecutive_failures += 1
+        if self.state == STATE_HALF_OPEN or (
+            self.state == STATE_CLOSED
+            and self.failure_threshold > 0
+            and self.consecutive_failures >= self.failure_threshold
+        ):
+            self.trips += 1
+            self._set_state(STATE_OPEN)
+
+    def _set_state(self, state: str):
+        self.state = state
+        self._changed_at = self._clock()
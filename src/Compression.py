@@ -0,0 +1,123 @@
+import contextlib
+import gzip
+
+from dataclasses import dataclass
+
+from typing import BinaryIO, ContextManager, Optional
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - exercised when zstandard is not installed
+    zstandard = None
+
+
+COMPRESSION_GZIP = "gzip"
+COMPRESSION_ZSTD = "zstd"
+COMPRESSION_NONE = "none"
+COMPRESSIONS = (COMPRESSION_GZIP, COMPRESSION_ZSTD, COMPRESSION_NONE)
+
+EXTENSIONS = {
+    COMPRESSION_GZIP: ".gz",
+    COMPRESSION_ZSTD: ".zst",
+    COMPRESSION_NONE: "",
+}
+
+DEFAULT_LEVELS = {
+    COMPRESSION_GZIP: 9,
+    COMPRESSION_ZSTD: 3,
+    COMPRESSION_NONE: None,
+}
+
+LEVEL_RANGES = {
+    COMPRESSION_GZIP: range(0, 10),
+    COMPRESSION_ZSTD: range(1, 23),
+}
+
+
+@dataclass(frozen=True)
+class Compression:
+    """Data class describing how batch files are compressed.
+
+    Instances are immutable and picklable, so they can be handed to the encoder pool.
+
+    Attributes:
+        codec (str): One of "gzip", "zstd" or "none".
+        level (int, optional): Compression level. Defaults to 9 for gzip and 3 for zstd.
+        threads (int): Number of zstd worker threads; 0 compresses on the calling thread
+            and -1 uses one thread per core. Ignored by the other codecs.
+    """
+    codec: str = COMPRESSION_GZIP
+    level: Optional[int] = None
+    threads: int = 0
+
+    def __post_init__(self):
+        if self.codec not in COMPRESSIONS:
+            raise ValueError(f"Unknown compression {self.codec}, expected one of {COMPRESSIONS}")
+        if self.codec == COMPRESSION_ZSTD and zstandard is None:
+            raise ImportError("zstd compression requires the zstandard package to be installed")
+        if self.level is None:
+            object.__setattr__(self, "level", DEFAULT_LEVELS[self.codec])
+        elif self.codec in LEVEL_RANGES and self.level not in LEVEL_RANGES[self.codec]:
+            levels = LEVEL_RANGES[self.codec]
+            raise ValueError(
+                f"{self.codec} compression level must be between {levels.start} and {levels.stop - 1}"
+            )
+
+    @property
+    def extension(self) -> str:
+        """File extension appended for this codec, e.g. ".gz"."""
+
+        return EXTENSIONS[self.codec]
+
+    def compress(self, data: bytes) -> bytes:
+        """Compresses data in memory.
+
+        Args:
+            data (bytes): Data to compress.
+
+        Returns:
+            bytes: The compressed data.
+        """
+
+        if self.codec == COMPRESSION_GZIP:
+            return gzip.compress(data, compresslevel=self.level)
+        if self.codec == COMPRESSION_ZSTD:
+            return zstandard.ZstdCompressor(level=self.level, threads=self.threads).compress(data)
+        return data
+
+    def writer(self, fileobj: BinaryIO) -> ContextManager[BinaryIO]:
+        """Wraps a binary file so that data written to it is compressed on the way.
+
+        Data is compressed as it is written, so only the compressor's window is held in
+        memory rather than the whole input or output. Leaving the context finishes the
+        compressed stream; the file itself stays open.
+
+        Args:
+            fileobj (BinaryIO): File to write the compressed data to.
+
+        Returns:
+            ContextManager[BinaryIO]: Context manager yielding the writer.
+        """
+
+        if self.codec == COMPRESSION_GZIP:
+            return gzip.GzipFile(fileobj=fileobj, mode="wb", compresslevel=self.level)
+        if self.codec == COMPRESSION_ZSTD:
+            compressor = zstandard.ZstdCompressor(level=self.level, threads=self.threads)
+            return compressor.stream_writer(fileobj, closefd=False)
+        return contextlib.nullcontext(fileobj)
+
+    def decompress(self, data: bytes) -> bytes:
+        """Reverses `compress`.
+
+        Args:
+            data (bytes): Compressed data.
+
+        Returns:
+            bytes: The original data.
+        """
+
+        if self.codec == COMPRESSION_GZIP:
+            return gzip.decompress(data)
+        if self.codec == COMPRESSION_ZSTD:
+            return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+        return data
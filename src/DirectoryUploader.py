@@ -1,10 +1,13 @@
 import asyncio
+import fnmatch
 import glob
 import os
 import ntpath
 import logging
+import time
 
 from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
 from urllib.parse import urlparse
 
 from stream_manager import (
@@ -26,6 +29,30 @@ from stream_manager import (
 )
 from stream_manager.util import Util
 
+from src.AsyncStreamClient import AsyncStreamClient
+from src.CircuitBreaker import STATE_CLOSED, STATE_HALF_OPEN, STATE_OPEN, CircuitBreaker
+from src.InotifyWatcher import InotifyWatcher, inotify_available
+from src.Metrics import Metrics
+from src.PendingUploads import PendingUploads
+from src.RateMeter import RateMeter
+from src.RetryScheduler import RetryScheduler
+from src.SpoolCoalescer import SpoolCoalescer
+from src.SpoolIndex import SpoolIndex
+from src.SpoolQuota import SpoolQuota
+from src.UploadLedger import IN_MEMORY, STATE_FAILED, STATE_SUBMITTED, STATE_SUCCEEDED, UploadLedger
+
+WATCH_MODE_AUTO = "auto"
+WATCH_MODE_INOTIFY = "inotify"
+WATCH_MODE_POLL = "poll"
+WATCH_MODES = (WATCH_MODE_AUTO, WATCH_MODE_INOTIFY, WATCH_MODE_POLL)
+
+# Status messages read at once. A full read is followed by another one right away, so
+# confirmations, and with them local deletes, keep up with a backlog of exports.
+STATUS_READ_MAX_MESSAGES = 1000
+
+# Circuit breaker states in the order of their numeric metric value.
+CIRCUIT_BREAKER_STATES = (STATE_CLOSED, STATE_OPEN, STATE_HALF_OPEN)
+
 
 @dataclass
 class UploaderConfig:
@@ -35,22 +62,64 @@ class UploaderConfig:
         bucket_name (str): The name of the S3 bucket where files will be uploaded.
         prefix (str): The prefix for the S3 keys.
         interval (int): The time interval (in seconds) to wait between scanning the directory for new files.
-        path (str): The directory path to monitor for new files.
+        path (str): The directory path to monitor for new files. A `**` directory component
+            (e.g. `/data/**/*.jsonl.gz`) also matches files in sub-directories, which are
+            uploaded under the same sub-directories in S3.
+        watch_mode (str): How new files are found. "poll" scans the directory every
+            `interval`, "inotify" queues files as soon as they are closed or renamed into
+            place, and "auto" uses inotify where it is available and polls otherwise.
+        max_concurrent_submissions (int): Maximum number of S3 export tasks being appended
+            to the export stream at once.
+        max_outstanding_exports (int): Maximum number of S3 export tasks submitted but not
+            yet confirmed by a status message. 0 disables the limit.
+        ledger_path (str, optional): Location of the SQLite ledger recording the state of
+            every file being exported, so a restart resumes the exports in flight instead
+            of submitting them again. None keeps the ledger in memory.
+        retry_base_delay (int): Delay (in seconds) before a failed export is first retried.
+            Each further failure of the file doubles the delay.
+        retry_max_delay (int): Upper bound (in seconds) of the retry delay.
+        breaker_failure_threshold (int): Consecutive failed exports after which submissions
+            are paused. 0 never pauses them.
+        breaker_reset_timeout (int): Time (in seconds) submissions are paused for before a
+            single export is submitted to probe whether exports work again.
+        coalesce_target_size (int): Size (in bytes) up to which small JSON Lines files of
+            the same sub-directory are merged into one file before they are exported, so
+            they take one S3 PUT. 0 exports every file on its own.
+        coalesce_max_age (int): Age (in seconds) of its oldest file at which a group of
+            small files is merged, even if it has not reached the target size.
     """
     bucket_name: str
     prefix: str
     interval: int
     path: str
+    watch_mode: str = WATCH_MODE_POLL
+    max_concurrent_submissions: int = 8
+    max_outstanding_exports: int = 500
+    ledger_path: Optional[str] = None
+    retry_base_delay: int = 5
+    retry_max_delay: int = 900
+    breaker_failure_threshold: int = 10
+    breaker_reset_timeout: int = 60
+    coalesce_target_size: int = 0
+    coalesce_max_age: int = 300
 
 
 class DirectoryUploader:
-    """Monitors a folder for new files and uploads those new files to S3 via stream manager."""
+    """Monitors a folder for new files and uploads those new files to S3 via stream manager.
+
+    Files can also be handed over directly through a queue, so they are uploaded as
+    soon as they are complete. The folder is still scanned, to recover files left by
+    an earlier run or whose upload failed.
+    """
 
     def __init__(
         self,
         config: UploaderConfig,
         logger: logging.Logger,
         client: StreamManagerClient = None,
+        published_files: "asyncio.Queue[str]" = None,
+        quota: SpoolQuota = None,
+        metrics: Metrics = None,
     ):
         """Initializes DirectoryUploader.
 
@@ -59,10 +128,16 @@ class DirectoryUploader:
             logger (logging.Logger): Logger instance for logging messages and exceptions.
             client (StreamManagerClient, optional): Client to manage the message stream. 
                 If not provided, a default StreamManagerClient instance will be created.
+            published_files (asyncio.Queue[str], optional): Queue of paths of complete files
+                to upload right away, e.g. from the BatchMessageProcessor.
+            quota (SpoolQuota, optional): Size limit of the spool, told about every file
+                removed once exported. Files being exported are protected from eviction.
+            metrics (Metrics, optional): Shared metrics registry. Defaults to a new one.
         """
 
         # Configuration parameters
         self.pathname = config.path
+        self.base_dir = self._base_dir(config.path)
         self.bucket_name = config.bucket_name
         self.stream_name = config.bucket_name + "Stream"
         self.status_stream_name = self.stream_name + "Status"
@@ -74,35 +149,121 @@ class DirectoryUploader:
         self.status_interval = min(config.interval, 1)
         self.interval = config.interval
         self.files_processed: set[str] = set()
+        self.watch_mode = self._resolve_watch_mode(config.watch_mode)
+        self.file_pattern = os.path.basename(config.path)
+        self.recursive = os.path.basename(os.path.dirname(config.path)) == "**"
+        self._rescan_needed = True
+        self.published_files = published_files
+        self.quota = quota
+        if quota is not None:
+            quota.protected = lambda file: file in self.files_processed
+        # The index needs a literal directory; other patterns are globbed on every scan.
+        self.index = (
+            None
+            if glob.has_magic(self.base_dir)
+            else SpoolIndex(self.base_dir, self.file_pattern, recursive=self.recursive)
+        )
 
         if not self.client:
             self.client = StreamManagerClient()
 
+        # Status processing has one request in flight at most, submissions up to their limit.
+        self.max_concurrent_submissions = max(config.max_concurrent_submissions, 1)
+        self.async_client = AsyncStreamClient(
+            self.client, max_workers=1 + self.max_concurrent_submissions
+        )
+        self._submission_slots = asyncio.Semaphore(self.max_concurrent_submissions)
+        self.max_outstanding_exports = config.max_outstanding_exports
+        self._export_slots = (
+            asyncio.Semaphore(self.max_outstanding_exports) if self.max_outstanding_exports > 0 else None
+        )
+        # Restored exports beyond the limit hold no slot, so they must not free one.
+        self._unslotted_exports = 0
+        self.pending_uploads = PendingUploads()
+        self.submission_rate = RateMeter()
+        self.ledger = UploadLedger(config.ledger_path or IN_MEMORY)
+        self.retries = RetryScheduler(base_delay=config.retry_base_delay, max_delay=config.retry_max_delay)
+        self.breaker = CircuitBreaker(
+            failure_threshold=config.breaker_failure_threshold,
+            reset_timeout=config.breaker_reset_timeout,
+        )
+        self.coalescer = None
+        if config.coalesce_target_size > 0:
+            if self.index is None:
+                logger.warning(f"Not merging small files, {config.path} does not name a single directory")
+            else:
+                self.coalescer = SpoolCoalescer(
+                    self.base_dir, config.coalesce_target_size, max_age=config.coalesce_max_age
+                )
+        # Files that went into each merged file, by merged file.
+        self.merges: Dict[str, List[str]] = {}
+        self._unsubmitted_merges: List[str] = []
+        self._status_sequence_number = 0
+        self.metrics = metrics or Metrics()
+        self._register_metrics()
+
+        self._started = False
+
         logger.debug(f"DirectoryUploader initialized with {config}")
 
-        # Delete existing streams (if any) for a fresh start.
-        self._delete_existing_streams()
+    async def start(self):
+        """Prepares the export streams and resumes from the ledger, once.
 
-        # Create new streams for this session.
-        self._create_streams()
+        `run` calls this if it has not been called yet. Existing streams are kept, so
+        exports submitted before a restart still report their status.
+        """
 
-    def _delete_existing_streams(self):
-        """Deletes the existing streams if they exist."""
+        if self._started:
+            return
 
-        for stream in [self.status_stream_name, self.stream_name]:
-            try:
-                self.client.delete_message_stream(stream_name=stream)
-            except ResourceNotFoundException:
-                pass
-            except StreamManagerException as e:
-                self.logger.error(f"Error deleting stream {stream}: {e}")
-            except ConnectionError:
-                self.logger.error(f"Connection error when trying to delete {stream}. Retrying later.")
-            except asyncio.TimeoutError:
-                self.logger.warning(f"Request to delete {stream} timed out. Retrying later.")
+        export_stream_created, status_stream_created = await self._create_streams()
+        await self._restore_from_ledger(export_stream_created, status_stream_created)
+        self._started = True
 
-    def _create_streams(self):
-        """Creates new streams for the current session."""
+    @staticmethod
+    def _base_dir(pathname: str) -> str:
+        """Returns the directory being monitored, i.e. the path without its file pattern
+        and any trailing `**` components.
+
+        Args:
+            pathname (str): The glob pattern of files to upload.
+
+        Returns:
+            str: The monitored directory.
+        """
+
+        base_dir = os.path.dirname(pathname)
+        while os.path.basename(base_dir) == "**":
+            base_dir = os.path.dirname(base_dir)
+        return base_dir
+
+    def _resolve_watch_mode(self, watch_mode: str) -> str:
+        """Returns the watch mode to use, either "inotify" or "poll".
+
+        Args:
+            watch_mode (str): The configured watch mode.
+
+        Returns:
+            str: "inotify" if it was requested, or if "auto" was and it can be used.
+        """
+
+        if watch_mode not in WATCH_MODES:
+            raise ValueError(f"Unknown watch mode {watch_mode}, expected one of {WATCH_MODES}")
+        if watch_mode == WATCH_MODE_POLL:
+            return WATCH_MODE_POLL
+
+        # inotify watches directories, so the directory part of the path must be literal.
+        usable = inotify_available() and not glob.has_magic(self.base_dir)
+        if watch_mode == WATCH_MODE_INOTIFY and not usable:
+            raise ValueError(f"inotify cannot be used to watch {self.pathname} on this platform")
+        return WATCH_MODE_INOTIFY if usable else WATCH_MODE_POLL
+
+    async def _create_streams(self) -> Tuple[bool, bool]:
+        """Creates the export and status streams, unless they exist already.
+
+        Returns:
+            Tuple[bool, bool]: Whether the export stream and the status stream were created.
+        """
 
         # Prepare an export definition.
         exports = ExportDefinition(
@@ -118,7 +279,7 @@ class DirectoryUploader:
         )
 
         # Create the Status Stream.
-        self.client.create_message_stream(
+        status_stream_created = await self._create_stream(
             MessageStreamDefinition(
                 name=self.status_stream_name,
                 strategy_on_full=StrategyOnFull.OverwriteOldestData,
@@ -126,83 +287,554 @@ class DirectoryUploader:
         )
 
         # Create the message stream with the S3 Export definition.
-        self.client.create_message_stream(
+        export_stream_created = await self._create_stream(
             MessageStreamDefinition(
                 name=self.stream_name,
                 strategy_on_full=StrategyOnFull.OverwriteOldestData,
                 export_definition=exports,
             )
         )
+        return export_stream_created, status_stream_created
+
+    async def _create_stream(self, definition: MessageStreamDefinition) -> bool:
+        """Creates a stream unless it exists already.
+
+        Args:
+            definition (MessageStreamDefinition): Definition of the stream.
+
+        Returns:
+            bool: Whether the stream was created.
+        """
+
+        try:
+            await self.async_client.describe_message_stream(definition.name)
+            return False
+        except ResourceNotFoundException:
+            pass
+        self.logger.info(f"Creating stream {definition.name}...")
+        await self.async_client.create_message_stream(definition)
+        return True
+
+    async def _restore_from_ledger(self, export_stream_created: bool, status_stream_created: bool):
+        """Resumes the exports recorded in the ledger by an earlier run.
+
+        Files whose export succeeded but that were not removed yet are removed, along
+        with the files merged into them, and retries of failed exports are scheduled
+        again. Merged files that were not submitted yet are submitted with the next scan. Files submitted to a stream that
+        still exists are tracked as pending again, so they are not submitted twice and
+        their statuses are awaited; if the export stream is new, their tasks were lost
+        with the old one and they are submitted again right away. Status messages are
+        read from where the earlier run stopped.
+
+        Args:
+            export_stream_created (bool): Whether the export stream was just created.
+            status_stream_created (bool): Whether the status stream was just created.
+        """
+
+        with self.ledger.transaction():
+            states = {entry.file: entry.state for entry in self.ledger.entries()}
+            for merged, inputs in self.ledger.merges().items():
+                if states.get(merged) == STATE_SUCCEEDED or not os.path.exists(merged):
+                    # Exported: the inputs are removed before the merged file.
+                    for file in inputs:
+                        self._remove_file(file)
+                    self.ledger.forget_merge(merged)
+                    continue
+                self.merges[merged] = inputs
+                self.files_processed.update(inputs)
+                if states.get(merged) not in (STATE_SUBMITTED, STATE_FAILED):
+                    self._unsubmitted_merges.append(merged)
+            if self.coalescer is not None:
+                self.coalescer.remove_orphans(list(self.merges))
+
+            for entry in self.ledger.entries(STATE_SUCCEEDED):
+                self._remove_file(entry.file)
+            self.ledger.forget_succeeded()
+
+            for entry in self.ledger.entries(STATE_FAILED):
+                if not os.path.exists(entry.file):
+                    self.ledger.forget([entry.file])
+                    continue
+                self.files_processed.add(entry.file)
+                self.retries.schedule(entry.file, entry.attempts)
+
+            resumed = 0
+            for entry in self.ledger.entries(STATE_SUBMITTED):
+                if not os.path.exists(entry.file):
+                    self.ledger.forget([entry.file])
+                    continue
+                if export_stream_created:
+                    self.ledger.fail(entry.file)
+                    if entry.file in self.merges:
+                        # Scans do not see merged files.
+                        self._unsubmitted_merges.append(entry.file)
+                    continue
+                self.files_processed.add(entry.file)
+                self.pending_uploads.submit(f"file://{entry.file}", entry.file, entry.size, attempts=entry.attempts)
+                if self._export_slots is not None and not self._export_slots.locked():
+                    await self._export_slots.acquire()
+                else:
+                    self._unslotted_exports += 1
+                resumed += 1
+
+            sequence_number = self.ledger.status_sequence_number
+            if sequence_number is not None and not status_stream_created:
+                stream_info = await self.async_client.describe_message_stream(self.status_stream_name)
+                newest_sequence_number = stream_info.storage_status.newest_sequence_number
+                if newest_sequence_number is None or sequence_number > newest_sequence_number + 1:
+                    # The status stream was recreated behind our back; its numbering restarted.
+                    sequence_number = None
+            self._status_sequence_number = sequence_number or 0
+            self.ledger.status_sequence_number = self._status_sequence_number
+
+        if resumed:
+            self.logger.info(f"Resuming {resumed} exports submitted before the restart")
 
     async def _scan(self, under_test: bool=False):
         """Scans the directory for new files and uploads them.
 
+        In "poll" mode the whole directory is listed every interval. In "inotify" mode
+        it is listed once when watching starts, and again only if events were lost;
+        otherwise files are queued as soon as they are complete.
+
         Args:
             under_test (bool, optional): Flag to determine if the function is 
                 being executed under a test environment. Defaults to False.
         """
 
+        watcher = None
         keep_looping = True
-        while keep_looping:
+        try:
+            while keep_looping:
+                try:
+                    # Check if the directory exists and has appropriate permissions.
+                    base_dir = self.base_dir
+                    if ntpath.isdir(base_dir) and os.access(
+                        base_dir, os.R_OK | os.W_OK | os.X_OK
+                    ):
+                        if self.watch_mode == WATCH_MODE_INOTIFY:
+                            if watcher is None or not watcher.active:
+                                if watcher is not None:
+                                    watcher.close()
+                                watcher = InotifyWatcher(base_dir, recursive=self.recursive)
+                                self._rescan_needed = True
+                            await self._watch(watcher)
+                        else:
+                            await self._poll()
+                            await asyncio.sleep(self.interval)
+                    else:
+                        self.logger.error(
+                            f"The path {base_dir} is not a directory, does not exist or doesn't have sufficient (rwx) access."
+                        )
+                        if not under_test:
+                            await asyncio.sleep(60)
+                except StreamManagerException as e:
+                    self.logger.error(f"StreamManagerException occurred while scanning: {e}")
+                except ConnectionError:
+                    self.logger.error("Connection error while scanning. Retrying in a few seconds...")
+                    await asyncio.sleep(5)
+                except asyncio.TimeoutError:
+                    self.logger.warning("Scanning request to StreamManager timed out. Retrying...")
+                    await asyncio.sleep(1)
+                except Exception as e:
+                    self.logger.exception(f"Unexpected error while scanning: {e}")
+                    await asyncio.sleep(5)
+                keep_looping = not under_test
+        finally:
+            if watcher is not None:
+                watcher.close()
+
+    async def _poll(self):
+        """Finds the files that are new since the last scan and uploads them."""
+
+        self.logger.debug(
+            f"Scanning directory {self.pathname} for changes."
+        )
+
+        if self.index is None:
+            await self._poll_glob()
+            return
+
+        # Only changed directories are listed, and new files come out oldest first.
+        self.index.refresh()
+        new_files = self.index.pop_new()
+
+        if not new_files:
+            self.logger.debug("No new files to transfer.")
+
+        try:
+            await self._upload_new_files(new_files)
+        except BaseException:
+            for file in new_files:
+                if file not in self.files_processed:
+                    self.index.requeue(file)
+            raise
+
+    async def _poll_glob(self):
+        """Lists the directory and uploads the files that are new since the last listing.
+
+        Files are written under a hidden name and renamed once complete, so every file
+        listed can be uploaded.
+        """
+
+        # Get all files sorted by modified time.
+        files: list[str] = sorted(
+            filter(os.path.isfile, glob.glob(self.pathname, recursive=True)),
+            key=os.path.getmtime,
+        )
+
+        # Identify new files.
+        new_files = [file for file in files if file not in self.files_processed]
+
+        if not new_files:
+            self.logger.debug("No new files to transfer.")
+
+        await self._upload_new_files(new_files)
+
+    async def _watch(self, watcher: InotifyWatcher):
+        """Uploads files reported by the watcher, waiting up to an interval for them.
+
+        Files are only reported once they are closed or renamed into place, so no file
+        is held back as possibly incomplete. Batch files are published by renaming, so
+        the files found by a rescan are complete too.
+
+        Args:
+            watcher (InotifyWatcher): Watcher of the monitored directory.
+        """
+
+        if self._rescan_needed:
+            self.logger.debug(f"Scanning directory {self.pathname} for files not seen by the watcher.")
+            self._rescan_needed = False
+            files = sorted(
+                filter(os.path.isfile, glob.glob(self.pathname, recursive=True)),
+                key=os.path.getmtime,
+            )
+            await self._upload_new_files(files)
+
+        files, overflow = await watcher.read(timeout=self.interval)
+        if overflow:
+            self.logger.warning("Directory events were lost, rescanning the directory.")
+            self._rescan_needed = True
+        await self._upload_new_files([file for file in files if self._matches(file)])
+
+    async def _upload_new_files(self, files: list[str], coalesce: bool = True):
+        """Submits S3 export tasks for the given files, skipping those already submitted.
+
+        Submissions start in the order given, oldest first, with up to
+        `max_concurrent_submissions` appends in flight. While `max_outstanding_exports`
+        tasks await confirmation, further submissions wait for a status message.
+
+        Args:
+            files (list[str]): Paths of complete files, oldest first.
+            coalesce (bool, optional): Whether small files may be held back to be merged.
+                Defaults to True.
+        """
+
+        if coalesce and self.coalescer is not None:
+            files = await self._coalesce(files)
+
+        # Workers take files from one iterator, so submissions start in order.
+        remaining = iter(files)
+        submitted = []
+
+        async def submit_remaining():
+            for file in remaining:
+                if file in self.files_processed:
+                    continue
+                if await self._submit(file):
+                    submitted.append(file)
+
+        workers = [
+            asyncio.ensure_future(submit_remaining())
+            for _ in range(min(self.max_concurrent_submissions, len(files)))
+        ]
+        try:
+            results = await asyncio.gather(*workers, return_exceptions=True)
+        except BaseException:
+            for worker in workers:
+                worker.cancel()
+            self._rescan_needed = True
+            raise
+
+        if submitted:
+            self.logger.info(
+                f"Submitted {len(submitted)} files for export "
+                f"({self.submission_rate.rate():.1f} files/s, {len(self.pending_uploads)} outstanding)"
+            )
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            # The files that were not submitted would only be found again by a rescan.
+            self._rescan_needed = True
+            raise errors[0]
+
+    async def _coalesce(self, files: list[str]) -> list[str]:
+        """Holds back small files to merge them, and merges the groups that are ready.
+
+        Held back files are claimed, so scans skip them while they wait.
+
+        Args:
+            files (list[str]): Paths of complete files, oldest first.
+
+        Returns:
+            list[str]: The files to submit as they are, followed by the merged files.
+        """
+
+        direct = []
+        for file in files:
+            if file in self.files_processed:
+                continue
             try:
-                # Check if the directory exists and has appropriate permissions.
-                base_dir = os.path.dirname(self.pathname)
-                if ntpath.isdir(base_dir) and os.access(
-                    base_dir, os.R_OK | os.W_OK | os.X_OK
-                ):
-                    self.logger.debug(
-                        f"Scanning directory {self.pathname} for changes."
-                    )
+                stat = os.stat(file)
+            except FileNotFoundError:
+                continue
+            if self.coalescer.add(file, stat.st_size, stat.st_mtime):
+                self.files_processed.add(file)
+            else:
+                direct.append(file)
+        direct.extend(self._unsubmitted_merges)
+        self._unsubmitted_merges = []
 
-                    # Get all files sorted by modified time.
-                    files: list[str] = sorted(glob.glob(self.pathname), key=os.path.getmtime)
-                    if files:
-                        # Remove most recent file as it is considered the active file
-                        self.logger.debug(f"The current active file is: {files.pop()}")
+        loop = asyncio.get_running_loop()
+        for group in self.coalescer.pop_ready():
+            if len(group) == 1:
+                self.files_processed.difference_update(group)
+                direct.extend(group)
+                continue
+            try:
+                merged, inputs = await loop.run_in_executor(None, self.coalescer.merge, group)
+            except BaseException:
+                # Released, so they are found again and merged with the next group.
+                self.files_processed.difference_update(group)
+                if self.index is not None:
+                    for file in group:
+                        self.index.requeue(file)
+                raise
+            self.files_processed.difference_update(set(group) - set(inputs))
+            if not inputs:
+                os.remove(merged)
+                continue
+            # Recorded before it is submitted, so a restart neither exports the inputs
+            # on their own nor loses track of the merged file.
+            with self.ledger.transaction():
+                self.ledger.record_merge(merged, inputs)
+            self.merges[merged] = inputs
+            self.logger.debug(f"Merged {len(inputs)} files into {merged}")
+            direct.append(merged)
+        return direct
 
-                    # Identify new files.
-                    new_files = set(files) - self.files_processed
+    async def _submit(self, file: str) -> bool:
+        """Claims a file and appends its export task, once slots for it are free.
 
-                    if not new_files:
-                        self.logger.debug("No new files to transfer.")
+        Args:
+            file (str): Path of the file.
 
-                    # Process each new file.
-                    for file in new_files:
-                        await self._append_s3_task(file)
+        Returns:
+            bool: Whether the task was appended; False if the file was claimed by someone
+                else or removed in the meantime, or failed validation.
+        """
 
-                    # Update the list of processed files.
-                    self.files_processed = set(files)
+        await self._wait_for_breaker()
+        if self._export_slots is not None:
+            if self._export_slots.locked():
+                self.logger.debug(
+                    f"{len(self.pending_uploads)} exports outstanding, waiting for confirmations"
+                )
+            await self._export_slots.acquire()
+        submitted = False
+        try:
+            async with self._submission_slots:
+                # Scans and handed over files run concurrently, so check again. A file
+                # listed by a scan may also have been exported and removed since.
+                if file in self.files_processed:
+                    return False
+                try:
+                    size = os.stat(file).st_size
+                except FileNotFoundError:
+                    return False
+                self.files_processed.add(file)
+                self.ledger.queue(file, self._s3_key(file), size)
+                try:
+                    submitted = await self._append_s3_task(file) is not False
+                except BaseException:
+                    self.files_processed.discard(file)
+                    raise
+                if not submitted:
+                    # It is tried again after a restart.
+                    self.ledger.forget([file])
+        finally:
+            if not submitted:
+                self._release_export_slot()
+        if not submitted:
+            return False
 
-                    await asyncio.sleep(self.interval)
-                else:
-                    self.logger.error(
-                        f"The path {base_dir} is not a directory, does not exist or doesn't have sufficient (rwx) access."
-                    )
-                    if not under_test:
-                        await asyncio.sleep(60)
+        attempts = self.ledger.submit(file)
+        self.pending_uploads.submit(f"file://{file}", file, size, attempts=attempts)
+        self.submission_rate.add()
+        self._exports_submitted.inc()
+        return True
+
+    def _register_metrics(self):
+        """Creates the uploader's metrics, or picks them up again after a restart.
+
+        Counters live in the registry, so they keep counting across restarts. The rest
+        is read from the uploader's current state when the metrics are exported.
+        """
+
+        metrics = self.metrics
+        self._exports_submitted = metrics.counter("exports_submitted", "Export tasks submitted.")
+        self._exports_succeeded = metrics.counter("exports_succeeded", "Exports confirmed as uploaded.")
+        self._exports_failed = metrics.counter("exports_failed", "Exports that failed or were canceled.")
+        self._breaker_trips = metrics.counter("circuit_breaker_trips", "Times failing exports paused submissions.")
+        # Kept by the registry, so latencies observed before a restart stay counted.
+        self.pending_uploads.latency = metrics.histogram(
+            "upload_latency_seconds", "Time from submitting an export until it is confirmed."
+        )
+        metrics.gauge("exports_pending", "Exports awaiting confirmation.").set_function(
+            lambda: len(self.pending_uploads)
+        )
+        metrics.gauge("exports_pending_bytes", "Size of the files awaiting confirmation.").set_function(
+            lambda: self.pending_uploads.size_bytes
+        )
+        metrics.gauge("export_submission_rate", "Exports submitted per second, over the last minute.").set_function(
+            lambda: self.submission_rate.rate()
+        )
+        metrics.gauge("retries_scheduled", "Failed exports waiting for their retry.").set_function(
+            lambda: len(self.retries)
+        )
+        metrics.gauge(
+            "circuit_breaker_state", "State of the circuit breaker; 0 closed, 1 open, 2 half-open."
+        ).set_function(lambda: CIRCUIT_BREAKER_STATES.index(self.breaker.state))
+        if self.quota is not None:
+            quota = self.quota
+            metrics.gauge("spool_files", "Batch files in the spool.").set_function(lambda: len(quota.files))
+            metrics.gauge("spool_bytes", "Size of the batch files in the spool.").set_function(
+                lambda: quota.used_bytes
+            )
+            metrics.counter("spool_evicted_files", "Files dropped to keep the spool within its quota.").set_function(
+                lambda: quota.evicted_files
+            )
+            metrics.counter("spool_evicted_bytes", "Size of the files dropped from the spool.").set_function(
+                lambda: quota.evicted_bytes
+            )
+
+    async def _wait_for_breaker(self):
+        """Waits while the circuit breaker pauses submissions."""
+
+        while not self.breaker.allow():
+            await asyncio.sleep(self.breaker.retry_after())
+        if self.breaker.state != STATE_CLOSED:
+            self.logger.info("Submitting an export to probe whether exports work again")
+
+    async def _retry_failed_exports(self, under_test: bool=False):
+        """Submits failed exports again once their backoff has passed.
+
+        Args:
+            under_test (bool, optional): Flag to determine if the function is
+                being executed under a test environment. Defaults to False.
+        """
+
+        keep_looping = True
+        while keep_looping:
+            # Wake up at least every interval to notice retries scheduled meanwhile.
+            delay = self.retries.next_due_in()
+            await asyncio.sleep(self.interval if delay is None else min(delay, self.interval))
+            files = self.retries.pop_due()
+            if files:
+                self.logger.info(f"Retrying the export of {len(files)} files")
+                self.files_processed.difference_update(files)
+                try:
+                    await self._upload_new_files(files, coalesce=False)
+                except StreamManagerException as e:
+                    self.logger.error(f"StreamManagerException occurred while retrying exports: {e}")
+                except ConnectionError:
+                    self.logger.error("Connection error while retrying exports. They will be picked up by the next scan.")
+                except asyncio.TimeoutError:
+                    self.logger.warning("Request to retry exports timed out. They will be picked up by the next scan.")
+                except Exception as e:
+                    self.logger.exception(f"Unexpected error while retrying exports: {e}")
+                finally:
+                    if self.index is not None:
+                        for file in files:
+                            if file not in self.files_processed:
+                                self.index.requeue(file)
+            keep_looping = not under_test
+
+    def _remove_file(self, file: str) -> bool:
+        """Removes an exported file from the spool.
+
+        Args:
+            file (str): Path of the file.
+
+        Returns:
+            bool: Whether the file was removed; False if it was already gone.
+        """
+
+        if self.quota is not None:
+            self.quota.remove(file)
+        try:
+            os.remove(file)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def _release_export_slot(self):
+        if self._unslotted_exports:
+            self._unslotted_exports -= 1
+        elif self._export_slots is not None:
+            self._export_slots.release()
+
+    async def _upload_published_files(self):
+        """Uploads files handed over through `published_files` as soon as they arrive."""
+
+        while True:
+            file = await self.published_files.get()
+            if not self._matches(file):
+                self.logger.debug(f"Not uploading {file}, it does not match {self.pathname}")
+                continue
+            try:
+                await self._upload_new_files([file])
             except StreamManagerException as e:
-                self.logger.error(f"StreamManagerException occurred while scanning: {e}")
+                self.logger.error(f"StreamManagerException occurred while uploading {file}: {e}")
             except ConnectionError:
-                self.logger.error("Connection error while scanning. Retrying in a few seconds...")
-                await asyncio.sleep(5)
+                self.logger.error(f"Connection error while uploading {file}. It will be picked up by the next scan.")
             except asyncio.TimeoutError:
-                self.logger.warning("Scanning request to StreamManager timed out. Retrying...")
-                await asyncio.sleep(1)
+                self.logger.warning(f"Request to upload {file} timed out. It will be picked up by the next scan.")
             except Exception as e:
-                self.logger.exception(f"Unexpected error while scanning: {e}")
-                await asyncio.sleep(5)
-            keep_looping = not under_test
+                self.logger.exception(f"Unexpected error while uploading {file}: {e}")
+
+    def _matches(self, file: str) -> bool:
+        """Returns whether a file reported by the watcher or handed over matches the monitored pattern.
+
+        Like `glob`, hidden files and directories are not matched.
+
+        Args:
+            file (str): Path of the file.
+
+        Returns:
+            bool: Whether the file should be uploaded.
+        """
+
+        if glob.has_magic(self.base_dir):
+            return fnmatch.fnmatch(file, self.pathname)
+        relative = os.path.relpath(file, self.base_dir).split(os.sep)
+        if any(part.startswith(".") for part in relative):
+            return False
+        if len(relative) > 1 and not self.recursive:
+            return False
+        return fnmatch.fnmatch(relative[-1], self.file_pattern)
 
-    async def _append_s3_task(self, file: str):
+    async def _append_s3_task(self, file: str) -> bool:
         """Appends an S3 Task definition to the stream and logs the sequence number.
 
         Args:
             file (str): The path of the file to be appended.
+
+        Returns:
+            bool: Whether the task was appended; False if it failed validation.
         """
 
         # Prepare the S3 Task definition.
-        _, tail = ntpath.split(file)
-        key_with_partition = f"{self.prefix}year=!{{timestamp:YYYY}}/month=!{{timestamp:MM}}/day=!{{timestamp:dd}}/hour=!{{timestamp:HH}}/{tail}"
+        key_with_partition = self._s3_key(file)
         s3_export_task_definition = S3ExportTaskDefinition(
             input_url=f"file://{file}",
             bucket=self.bucket_name,
@@ -218,47 +850,104 @@ class DirectoryUploader:
             self.logger.warning(
                 f"Validation failed for file: {file}, bucket: {self.bucket_name}, key: {key_with_partition}. File not sent to S3."
             )
-            return
+            return False
 
         # Append the S3 Task definition to the stream.
-        sequence_number = self.client.append_message(self.stream_name, payload)
+        sequence_number = await self.async_client.append_message(self.stream_name, payload)
         self.logger.info(
             f"Successfully appended S3 Task Definition to stream with sequence number {sequence_number}."
         )
+        return True
+
+    def _s3_key(self, file: str) -> str:
+        """Returns the S3 key a file is exported to, partitioned by sub-directory and time.
+
+        A merged file is exported under the key of the first file merged into it.
+
+        Args:
+            file (str): Path of the file.
+
+        Returns:
+            str: The key, with StreamManager's timestamp placeholders.
+        """
+
+        if file in self.merges:
+            file = self.merges[file][0]
+        head, tail = ntpath.split(file)
+        return f"{self.prefix}{self._key_segments(head)}year=!{{timestamp:YYYY}}/month=!{{timestamp:MM}}/day=!{{timestamp:dd}}/hour=!{{timestamp:HH}}/{tail}"
+
+    def _key_segments(self, directory: str) -> str:
+        """Maps the sub-directories a file is in, relative to the monitored directory, to S3 key segments.
+
+        Args:
+            directory (str): Directory of the file.
+
+        Returns:
+            str: The key segments with a trailing "/", e.g. "id=1/", or "" for files
+                directly in the monitored directory.
+        """
+
+        relative = os.path.relpath(directory, self.base_dir)
+        if relative == os.curdir:
+            return ""
+        return relative.replace(os.sep, "/") + "/"
 
     async def _process_status(self, under_test: bool=False):
         """Reads the statuses from the export status stream.
 
+        Statuses are read in batches of up to `STATUS_READ_MAX_MESSAGES`. After a full
+        batch the stream is read again right away, so a backlog of confirmations is
+        drained without waiting `status_interval` between reads.
+
         Args:
             under_test (bool, optional): Flag to determine if the function is 
                 being executed under a test environment. Defaults to False.
         """
 
-        next_seq = 0
+        next_seq = self._status_sequence_number
         keep_looping = True
         while keep_looping:
+            full = False
             try:
                 self.logger.debug("Reading messages from status stream.")
 
                 # Read messages from the status stream.
-                messages_list = self.client.read_messages(
+                messages_list = await self.async_client.read_messages(
                     self.status_stream_name,
                     ReadMessagesOptions(
                         desired_start_sequence_number=next_seq,
                         min_message_count=1,
-                        max_message_count=5,
+                        max_message_count=STATUS_READ_MAX_MESSAGES,
                         read_timeout_millis=1000,
                     )
                 )
+                full = len(messages_list) >= STATUS_READ_MAX_MESSAGES
 
                 # Process each message.
-                for message in messages_list:
-                    if message.sequence_number is not None:
-                        next_seq = message.sequence_number + 1
-                    status_message: StatusMessage = Util.deserialize_json_bytes_to_obj(
-                        message.payload, StatusMessage
+                # The outcomes and the position in the stream are committed together.
+                confirmed = self.pending_uploads.latency.count
+                with self.ledger.transaction():
+                    for message in messages_list:
+                        if message.sequence_number is not None:
+                            next_seq = message.sequence_number + 1
+                        try:
+                            status_message: StatusMessage = Util.deserialize_json_bytes_to_obj(
+                                message.payload, StatusMessage
+                            )
+                        except Exception as e:
+                            self.logger.error(f"Skipping unreadable status message {message.sequence_number}: {e}")
+                            continue
+                        self._handle_status_message(status_message)
+                    self.ledger.forget_succeeded()
+                    self.ledger.status_sequence_number = next_seq
+                self._status_sequence_number = next_seq
+
+                latency = self.pending_uploads.latency
+                if latency.count > confirmed:
+                    self.logger.info(
+                        f"Confirmed {latency.count - confirmed} exports, {len(self.pending_uploads)} pending "
+                        f"(upload latency p50 <= {latency.quantile(0.5)}s, p99 <= {latency.quantile(0.99)}s)"
                     )
-                    self._handle_status_message(status_message)
 
             except NotEnoughMessagesException:
                 # Ignore this exception, as it doesn't indicate an error.
@@ -274,13 +963,17 @@ class DirectoryUploader:
             except Exception as e:
                 self.logger.exception(f"Unexpected error while processing status: {e}")
                 await asyncio.sleep(5)
-            self.logger.debug(f"Sleeping for {self.status_interval} seconds")
-            await asyncio.sleep(self.status_interval)
+            if not full:
+                self.logger.debug(f"Sleeping for {self.status_interval} seconds")
+                await asyncio.sleep(self.status_interval)
             keep_looping = not under_test
 
     def _handle_status_message(self, status_message: StatusMessage):
         """Handles a status message based on its contents.
 
+        The task is looked up in `pending_uploads`, which records the file and when and
+        how often it was submitted. A finished task frees its outstanding export slot.
+
         Args:
             status_message (StatusMessage): The status message to be processed.
         """
@@ -291,29 +984,83 @@ class DirectoryUploader:
 
         # Check the status of the status message.
         if status_message.status == Status.Success:
-            self.logger.info(f"Successfully uploaded file at path {file_url} to s3://{bucket}/{key}")
-            final_path = os.path.abspath(
-                os.path.join(urlparse(file_url).netloc, urlparse(file_url).path)
-            )
-            os.remove(final_path)
+            upload = self.pending_uploads.succeed(file_url)
+            if upload is not None:
+                file = upload.file
+                self._release_export_slot()
+                self.logger.info(
+                    f"Successfully uploaded file at path {file_url} to s3://{bucket}/{key} "
+                    f"in {time.monotonic() - upload.submitted_at:.1f}s"
+                )
+            else:
+                file = os.path.abspath(os.path.join(urlparse(file_url).netloc, urlparse(file_url).path))
+                self.logger.info(f"Successfully uploaded file at path {file_url} to s3://{bucket}/{key}")
+            # Recorded first, so a crash before the removal does not export the file again.
+            self.ledger.succeed(file)
+            self._exports_succeeded.inc()
+            self.retries.cancel(file)
+            if self.breaker.state != STATE_CLOSED:
+                self.logger.info("Exports work again, resuming submissions")
+            self.breaker.record_success()
+            # The inputs of a merged file go first, so the merged file outlives them.
+            inputs = self.merges.pop(file, [])
+            for input_file in inputs:
+                self._remove_file(input_file)
+                self.files_processed.discard(input_file)
+            if not self._remove_file(file):
+                self.logger.debug(f"Uploaded file {file} was already removed")
+            self.files_processed.discard(file)
+            if inputs:
+                self.ledger.forget_merge(file)
         elif status_message.status == Status.InProgress:
-            self.logger.info("File upload is in progress.")
+            self.logger.debug(f"Upload of file at path {file_url} is in progress.")
         elif status_message.status in [Status.Failure, Status.Canceled]:
+            upload = self.pending_uploads.fail(file_url)
+            if upload is not None:
+                file = upload.file
+                self._release_export_slot()
+            else:
+                file = file_url.partition("file://")[2]
+            attempts = upload.attempts if upload is not None else 1
+            self.ledger.fail(file)
+            self._exports_failed.inc()
+            # Scans skip the file until its retry is due.
+            self.files_processed.add(file)
+            delay = self.retries.schedule(file, attempts)
             self.logger.error(
-                f"Unable to upload file at path {file_url} to S3. Message: {status_message.message}"
+                f"Unable to upload file at path {file_url} to S3 (attempt {attempts}), "
+                f"retrying in {delay:.0f}s. Message: {status_message.message}"
             )
-            self.files_processed.remove(file_url.partition("file://")[2])
+            was_open = self.breaker.state == STATE_OPEN
+            self.breaker.record_failure()
+            if self.breaker.state == STATE_OPEN and not was_open:
+                self._breaker_trips.inc()
+                self.logger.warning(
+                    f"{self.breaker.consecutive_failures} exports failed in a row, pausing "
+                    f"submissions for {self.breaker.reset_timeout}s"
+                )
 
     async def run(self):
         """Starts the DirectoryUploader to monitor and upload files."""
 
+        await self.start()
         tasks = [
             asyncio.create_task(self._scan()),
             asyncio.create_task(self._process_status()),
         ]
-        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        tasks.append(asyncio.create_task(self._retry_failed_exports()))
+        if self.published_files is not None:
+            tasks.append(asyncio.create_task(self._upload_published_files()))
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            # A restarted uploader must not compete with these for handed over files.
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
 
     def close(self):
         """Closes the DirectoryUploader and any associated resources."""
 
-        self.client.close()
+        self.async_client.close()
+        self.ledger.close()
@@ -0,0 +1,206 @@
+import asyncio
+import ctypes
+import ctypes.util
+import errno
+import os
+import struct
+
+from typing import Dict, List, Optional, Tuple
+
+# Event masks from <sys/inotify.h>.
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_ONLYDIR
+
+# struct inotify_event without its variable length name.
+_EVENT_HEADER = struct.Struct("iIII")
+_READ_SIZE = 64 * 1024
+
+_libc = None
+
+
+def _load_libc() -> Optional[ctypes.CDLL]:
+    """Returns the C library if it provides inotify, or None otherwise."""
+
+    global _libc
+    if _libc is None:
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        except OSError:
+            libc = False
+        else:
+            if not hasattr(libc, "inotify_init1"):
+                libc = False
+        _libc = libc
+    return _libc or None
+
+
+def inotify_available() -> bool:
+    """Returns whether the platform supports inotify."""
+
+    return _load_libc() is not None
+
+
+class InotifyWatcher:
+    """Reports files completed in a directory tree, using Linux inotify.
+
+    A file is reported when a writer closes it or when it is renamed into a watched
+    directory, so files that are written under a temporary name and then renamed are
+    reported exactly once, and only when complete. Sub-directories created while
+    watching are watched too when `recursive` is set, and the files already in them
+    are reported, as they may have been written before the watch was in place.
+
+    If the kernel's event queue overflows, events are lost. `read` then reports it, and
+    the caller has to rescan the directory.
+
+    Attributes:
+        base_dir (str): Directory being watched.
+        recursive (bool): Whether sub-directories are watched too.
+    """
+
+    def __init__(self, base_dir: str, recursive: bool = False):
+        """Initializes InotifyWatcher and starts watching.
+
+        Args:
+            base_dir (str): Directory to watch.
+            recursive (bool, optional): Whether to watch sub-directories too. Defaults to False.
+
+        Raises:
+            OSError: If inotify is not available or the directory cannot be watched.
+        """
+
+        self._libc = _load_libc()
+        if self._libc is None:
+            raise OSError(errno.ENOSYS, "inotify is not available on this platform")
+
+        self.base_dir = base_dir
+        self.recursive = recursive
+        self._watches: Dict[int, str] = {}
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+
+        try:
+            self._add_tree(base_dir)
+        except BaseException:
+            self.close()
+            raise
+        self._base_wd = next(iter(self._watches))
+
+    def _add_watch(self, directory: str):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), directory)
+        self._watches[wd] = directory
+
+    def _add_tree(self, directory: str) -> List[str]:
+        """Watches a directory, and its sub-directories if recursive.
+
+        Returns:
+            List[str]: Files already in the watched directories.
+        """
+
+        self._add_watch(directory)
+        files = []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if self.recursive:
+                        try:
+                            files.extend(self._add_tree(entry.path))
+                        except FileNotFoundError:
+                            pass
+                else:
+                    files.append(entry.path)
+        return files
+
+    @property
+    def active(self) -> bool:
+        """Whether `base_dir` is still watched; it stops being watched once it is deleted."""
+
+        return self._base_wd in self._watches
+
+    def fileno(self) -> int:
+        """Returns the inotify file descriptor, which is readable while events are pending."""
+
+        return self._fd
+
+    def read_events(self) -> Tuple[List[str], bool]:
+        """Reads all pending events without blocking.
+
+        Returns:
+            Tuple[List[str], bool]: Paths of completed files, in event order, and whether
+                the event queue overflowed so that events may have been lost.
+        """
+
+        files: List[str] = []
+        overflow = False
+        while True:
+            try:
+                data = os.read(self._fd, _READ_SIZE)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+                offset += length
+
+                if mask & IN_Q_OVERFLOW:
+                    overflow = True
+                    continue
+                if mask & IN_IGNORED:
+                    self._watches.pop(wd, None)
+                    continue
+                directory = self._watches.get(wd)
+                if directory is None:
+                    continue
+                path = os.path.join(directory, name)
+                if mask & IN_ISDIR:
+                    if self.recursive and mask & (IN_CREATE | IN_MOVED_TO):
+                        try:
+                            files.extend(self._add_tree(path))
+                        except FileNotFoundError:
+                            pass
+                elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                    files.append(path)
+        return files, overflow
+
+    async def read(self, timeout: Optional[float] = None) -> Tuple[List[str], bool]:
+        """Waits for events and reads them.
+
+        Args:
+            timeout (Optional[float], optional): Maximum time (in seconds) to wait for the
+                first event, or None to wait indefinitely. Defaults to None.
+
+        Returns:
+            Tuple[List[str], bool]: As for `read_events`; empty if the timeout expired.
+        """
+
+        loop = asyncio.get_running_loop()
+        readable = loop.create_future()
+        loop.add_reader(self._fd, lambda: readable.done() or readable.set_result(None))
+        try:
+            await asyncio.wait([readable], timeout=timeout)
+        finally:
+            loop.remove_reader(self._fd)
+            readable.cancel()
+        return self.read_events()
+
+    def close(self):
+        """Stops watching and releases the inotify file descriptor."""
+
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
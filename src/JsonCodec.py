@@ -0,0 +1,183 @@
+import json
+
+from abc import ABC, abstractmethod
+from typing import Any, Optional, Sequence, Tuple
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - exercised when orjson is not installed
+    orjson = None
+
+
+CODEC_AUTO = "auto"
+CODEC_JSON = "json"
+CODEC_ORJSON = "orjson"
+CODEC_PASSTHROUGH = "passthrough"
+CODECS = (CODEC_AUTO, CODEC_JSON, CODEC_ORJSON, CODEC_PASSTHROUGH)
+
+
+class JsonCodec(ABC):
+    """Validates a raw message payload and returns it as a single compact JSON line.
+
+    Subclasses do validation and compaction in one pass over the payload bytes, so a
+    message is never decoded to `str` and parsed more than once.
+
+    Attributes:
+        name (str): Name of the codec as used in the configuration.
+    """
+
+    name = ""
+
+    @abstractmethod
+    def loads(self, payload: bytes) -> Any:
+        """Parses a payload, raising ValueError if it is not valid JSON."""
+
+    @abstractmethod
+    def dumps(self, obj: Any) -> bytes:
+        """Serializes an object as compact JSON."""
+
+    def compact(self, payload: bytes) -> Optional[bytes]:
+        """Validates and compacts a payload.
+
+        Args:
+            payload (bytes): The raw message payload.
+
+        Returns:
+            Optional[bytes]: The compact JSON without a trailing newline, or None if the
+                payload is not valid JSON.
+        """
+
+        try:
+            return self.dumps(self.loads(payload))
+        except ValueError:
+            return None
+
+    def compact_with_key(self, payload: bytes, key_path: Sequence[str]) -> Tuple[Optional[bytes], Any]:
+        """Validates and compacts a payload, extracting a field in the same pass.
+
+        Args:
+            payload (bytes): The raw message payload.
+            key_path (Sequence[str]): Path of the field to extract, e.g. ("location", "country").
+
+        Returns:
+            Tuple[Optional[bytes], Any]: The compact JSON, or None if the payload is not
+                valid JSON, and the value of the field, or None if it is missing.
+        """
+
+        try:
+            obj = self.loads(payload)
+        except ValueError:
+            return None, None
+        return self.dumps(obj), extract_key(obj, key_path)
+
+
+class StdlibJsonCodec(JsonCodec):
+    """Codec backed by the standard library `json` module."""
+
+    name = CODEC_JSON
+
+    def loads(self, payload: bytes) -> Any:
+        return json.loads(payload)
+
+    def dumps(self, obj: Any) -> bytes:
+        return json.dumps(obj, separators=(",", ":")).encode()
+
+
+class OrjsonCodec(JsonCodec):
+    """Codec backed by `orjson`, which parses and serializes bytes natively.
+
+    Unlike the standard library, `orjson` writes non-ASCII characters as UTF-8 rather
+    than `\\u` escapes, and rejects `NaN`/`Infinity` and integers wider than 64 bits.
+    """
+
+    name = CODEC_ORJSON
+
+    def __init__(self):
+        if orjson is None:
+            raise ImportError("The orjson codec requires the orjson package to be installed")
+
+    def loads(self, payload: bytes) -> Any:
+        return orjson.loads(payload)
+
+    def dumps(self, obj: Any) -> bytes:
+        return orjson.dumps(obj)
+
+
+class PassthroughCodec(JsonCodec):
+    """Trusts producers to send compact JSON and writes the payload bytes as-is.
+
+    Only a cheap structural check is done: the payload must look like a JSON object or
+    array. Payloads spanning several lines would corrupt the JSON Lines output, so they
+    are handed to a full codec for compaction instead. Extracting a partition key
+    needs a full parse, which is also done by that codec.
+    """
+
+    name = CODEC_PASSTHROUGH
+
+    def __init__(self, fallback: JsonCodec = None):
+        self.fallback = fallback or StdlibJsonCodec()
+
+    def loads(self, payload: bytes) -> Any:
+        return self.fallback.loads(payload)
+
+    def dumps(self, obj: Any) -> bytes:
+        return self.fallback.dumps(obj)
+
+    def compact(self, payload: bytes) -> Optional[bytes]:
+        payload = payload.strip()
+        if not payload or (payload[:1], payload[-1:]) not in ((b"{", b"}"), (b"[", b"]")):
+            return None
+        if b"\n" in payload or b"\r" in payload:
+            return self.fallback.compact(payload)
+        return payload
+
+    def compact_with_key(self, payload: bytes, key_path: Sequence[str]) -> Tuple[Optional[bytes], Any]:
+        compact_payload = self.compact(payload)
+        if compact_payload is None:
+            return None, None
+        try:
+            obj = self.fallback.loads(compact_payload)
+        except ValueError:
+            return None, None
+        return compact_payload, extract_key(obj, key_path)
+
+
+def extract_key(obj: Any, key_path: Sequence[str]) -> Any:
+    """Returns the value at a path of nested object fields, or None if it is missing.
+
+    Args:
+        obj (Any): A parsed JSON document.
+        key_path (Sequence[str]): Field names to follow, outermost first.
+
+    Returns:
+        Any: The value, or None if any field along the path is missing.
+    """
+
+    for key in key_path:
+        if not isinstance(obj, dict):
+            return None
+        obj = obj.get(key)
+    return obj
+
+
+def get_codec(name: str = CODEC_AUTO) -> JsonCodec:
+    """Creates the codec with the given name.
+
+    Args:
+        name (str, optional): One of "auto", "json", "orjson" or "passthrough". "auto"
+            uses orjson when it is installed and the standard library otherwise.
+            Defaults to "auto".
+
+    Returns:
+        JsonCodec: The codec.
+    """
+
+    if name == CODEC_AUTO:
+        return OrjsonCodec() if orjson is not None else StdlibJsonCodec()
+    if name == CODEC_JSON:
+        return StdlibJsonCodec()
+    if name == CODEC_ORJSON:
+        return OrjsonCodec()
+    if name == CODEC_PASSTHROUGH:
+        return PassthroughCodec(get_codec(CODEC_AUTO))
+    raise ValueError(f"Unknown JSON codec {name}, expected one of {CODECS}")
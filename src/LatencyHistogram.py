@@ -0,0 +1,63 @@
+import bisect
+
+from typing import List, Sequence
+
+# Upper bounds (in seconds) of the buckets, from sub-second exports up to ten minutes.
+DEFAULT_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+class LatencyHistogram:
+    """Counts observed latencies in buckets with fixed upper bounds.
+
+    Attributes:
+        buckets (List[float]): Upper bound (in seconds) of each bucket, ascending. A
+            last, unbounded bucket counts everything above them.
+        counts (List[int]): Number of observations in each bucket, one more than `buckets`.
+        count (int): Number of observations.
+        sum (float): Sum of all observations, in seconds.
+    """
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        """Initializes LatencyHistogram.
+
+        Args:
+            buckets (Sequence[float], optional): Upper bounds of the buckets, in seconds.
+                Defaults to DEFAULT_BUCKETS.
+        """
+
+        self.buckets: List[float] = sorted(buckets)
+        self.counts: List[int] = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float):
+        """Counts one latency.
+
+        Args:
+            seconds (float): The latency.
+        """
+
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def quantile(self, q: float) -> float:
+        """Estimates a quantile as the upper bound of the bucket it falls in.
+
+        Args:
+            q (float): The quantile, between 0 and 1, e.g. 0.99.
+
+        Returns:
+            float: The estimate in seconds, 0 without observations, or infinity if it
+                falls above the last bound.
+        """
+
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
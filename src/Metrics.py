@@ -0,0 +1,261 @@
+import math
+import time
+
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from src.LatencyHistogram import DEFAULT_BUCKETS, LatencyHistogram
+from src.RateMeter import RateMeter
+
+METRIC_COUNTER = "counter"
+METRIC_GAUGE = "gauge"
+METRIC_HISTOGRAM = "histogram"
+
+# Every metric name starts with this, so they are easy to tell apart on a shared scraper.
+PREFIX = "s3ingestor_"
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Counter:
+    """A count that only goes up, with its rate over the last minute.
+
+    Attributes:
+        total (float): Sum of all increments.
+        meter (RateMeter): Rate of the increments.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self.meter = RateMeter(clock=clock)
+        self._collect: Optional[Callable[[], float]] = None
+
+    @property
+    def total(self) -> float:
+        return self._collect() if self._collect is not None else self.meter.total
+
+    def rate(self) -> Optional[float]:
+        """Returns the increments per second over the last minute, or None if the count
+        is read from a function."""
+
+        return None if self._collect is not None else self.meter.rate()
+
+    def inc(self, amount: float = 1):
+        """Adds to the count.
+
+        Args:
+            amount (float, optional): Amount to add. Defaults to 1.
+        """
+
+        self.meter.add(amount)
+
+    def set_function(self, collect: Callable[[], float]):
+        """Reads the count from `collect` when exported, e.g. from a component's attribute."""
+
+        self._collect = collect
+
+
+class Gauge:
+    """A value that goes up and down.
+
+    Attributes:
+        value (float): The current value.
+    """
+
+    def __init__(self):
+        self._value = 0.0
+        self._collect: Optional[Callable[[], float]] = None
+
+    @property
+    def value(self) -> float:
+        return self._collect() if self._collect is not None else self._value
+
+    def set(self, value: float):
+        """Sets the value."""
+
+        self._value = value
+
+    def set_function(self, collect: Callable[[], float]):
+        """Reads the value from `collect` when exported, e.g. from a component's attribute."""
+
+        self._collect = collect
+
+
+@dataclass
+class MetricFamily:
+    """A metric and its instances, one per set of label values.
+
+    Attributes:
+        name (str): Name of the metric.
+        kind (str): One of "counter", "gauge" or "histogram".
+        help (str): Description of the metric.
+        children (Dict[Labels, Any]): Instance of the metric for each set of labels.
+    """
+    name: str
+    kind: str
+    help: str
+    children: Dict[Labels, Any] = field(default_factory=dict)
+
+
+class Metrics:
+    """Registry of the metrics shared by the processor and the uploader.
+
+    Metrics are created on first use and kept across restarts of the components, so
+    counters keep counting. Values that a component already tracks, like the number
+    of pending exports, are read from it when the metrics are exported rather than
+    copied on every change, so keeping them costs nothing on the hot paths.
+
+    The registry renders the Prometheus text format, and a JSON snapshot that also
+    holds the per-second rate of each counter and the quantiles of each histogram.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        """Initializes Metrics.
+
+        Args:
+            clock (Callable[[], float], optional): Monotonic clock used for counter
+                rates. Defaults to time.monotonic.
+        """
+
+        self._families: Dict[str, MetricFamily] = {}
+        self._clock = clock
+
+    def _child(self, name: str, kind: str, help: str, labels: Dict[str, str], factory: Callable[[], Any]) -> Any:
+        family = self._families.get(name)
+        if family is None:
+            family = self._families[name] = MetricFamily(PREFIX + name, kind, help)
+        elif family.kind != kind:
+            raise ValueError(f"Metric {name} is a {family.kind}, not a {kind}")
+        key = _key(labels)
+        child = family.children.get(key)
+        if child is None:
+            child = family.children[key] = factory()
+        return child
+
+    def counter(self, name: str, help: str, **labels: str) -> Counter:
+        """Returns a counter, creating it on first use.
+
+        Args:
+            name (str): Name of the metric, without the common prefix or "_total".
+            help (str): Description of the metric.
+            **labels (str): Label values of this instance, e.g. stream="Telemetry".
+
+        Returns:
+            Counter: The counter.
+        """
+
+        return self._child(name, METRIC_COUNTER, help, labels, lambda: Counter(self._clock))
+
+    def gauge(self, name: str, help: str, **labels: str) -> Gauge:
+        """Returns a gauge, creating it on first use.
+
+        Args:
+            name (str): Name of the metric, without the common prefix.
+            help (str): Description of the metric.
+            **labels (str): Label values of this instance.
+
+        Returns:
+            Gauge: The gauge.
+        """
+
+        return self._child(name, METRIC_GAUGE, help, labels, Gauge)
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+        histogram: Optional[LatencyHistogram] = None,
+        **labels: str,
+    ) -> LatencyHistogram:
+        """Returns a histogram of latencies, creating it on first use.
+
+        Args:
+            name (str): Name of the metric, without the common prefix.
+            help (str): Description of the metric.
+            buckets (Sequence[float], optional): Upper bounds of the buckets, in seconds.
+                Defaults to DEFAULT_BUCKETS.
+            histogram (LatencyHistogram, optional): Histogram kept by a component to
+                export instead, replacing any earlier one.
+            **labels (str): Label values of this instance.
+
+        Returns:
+            LatencyHistogram: The histogram.
+        """
+
+        child = self._child(name, METRIC_HISTOGRAM, help, labels, lambda: histogram or LatencyHistogram(buckets))
+        if histogram is not None and child is not histogram:
+            self._families[name].children[_key(labels)] = child = histogram
+        return child
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Returns the current value of every metric, ready to be dumped as JSON."""
+
+        metrics = {}
+        for family in self._families.values():
+            samples = []
+            for labels, child in family.children.items():
+                sample: Dict[str, Any] = {"labels": dict(labels)}
+                if family.kind == METRIC_COUNTER:
+                    sample["total"] = child.total
+                    sample["rate"] = child.rate()
+                elif family.kind == METRIC_GAUGE:
+                    sample["value"] = _finite(child.value)
+                else:
+                    sample["count"] = child.count
+                    sample["sum"] = child.sum
+                    sample["p50"] = _finite(child.quantile(0.5))
+                    sample["p99"] = _finite(child.quantile(0.99))
+                samples.append(sample)
+            metrics[family.name] = {"type": family.kind, "help": family.help, "samples": samples}
+        return metrics
+
+    def render(self) -> str:
+        """Returns every metric in the Prometheus text exposition format."""
+
+        lines: List[str] = []
+        for family in self._families.values():
+            name = family.name + ("_total" if family.kind == METRIC_COUNTER else "")
+            lines.append(f"# HELP {name} {family.help}")
+            lines.append(f"# TYPE {name} {family.kind}")
+            for labels, child in family.children.items():
+                if family.kind == METRIC_COUNTER:
+                    lines.append(f"{name}{_labels(labels)} {_number(child.total)}")
+                elif family.kind == METRIC_GAUGE:
+                    lines.append(f"{name}{_labels(labels)} {_number(child.value)}")
+                else:
+                    cumulative = 0
+                    for bound, count in zip(child.buckets + [math.inf], child.counts):
+                        cumulative += count
+                        le = labels + (("le", "+Inf" if bound == math.inf else _number(bound)),)
+                        lines.append(f"{name}_bucket{_labels(le)} {cumulative}")
+                    lines.append(f"{name}_sum{_labels(labels)} {_number(child.sum)}")
+                    lines.append(f"{name}_count{_labels(labels)} {child.count}")
+        return "\n".join(lines) + "\n"
+
+
+def _key(labels: Dict[str, str]) -> Labels:
+    return tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+
+def _labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        label + '="' + value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for label, value in labels
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def _finite(value: float) -> Optional[float]:
+    """JSON has no infinity, so unbounded values are reported as null."""
+
+    return None if value is None or math.isinf(value) else value
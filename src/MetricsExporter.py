@@ -0,0 +1,110 @@
+import asyncio
+import json
+import logging
+import os
+import time
+
+from typing import Optional
+
+from src.Metrics import Metrics
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class MetricsExporter:
+    """Exposes the metrics over HTTP in the Prometheus format, and/or as a JSON file.
+
+    The HTTP endpoint answers every GET request, e.g. `/metrics`, with the current
+    metrics. It binds to localhost unless told otherwise, so metrics stay on the device
+    unless they are collected there. The JSON snapshot is rewritten every `interval`
+    seconds by renaming a complete file into place, so readers never see half of one.
+
+    Attributes:
+        metrics (Metrics): The metrics to export.
+        port (int): Port of the HTTP endpoint. 0 disables it.
+        host (str): Address the HTTP endpoint binds to.
+        snapshot_path (Optional[str]): Location of the JSON snapshot, or None to not write one.
+        interval (float): Time (in seconds) between two JSON snapshots.
+    """
+
+    def __init__(
+        self,
+        metrics: Metrics,
+        logger: logging.Logger,
+        port: int = 0,
+        host: str = "127.0.0.1",
+        snapshot_path: Optional[str] = None,
+        interval: float = 60,
+    ):
+        """Initializes MetricsExporter.
+
+        Args:
+            metrics (Metrics): The metrics to export.
+            logger (logging.Logger): Logger instance for logging messages and exceptions.
+            port (int, optional): Port of the HTTP endpoint. Defaults to 0 (disabled).
+            host (str, optional): Address to bind to. Defaults to "127.0.0.1".
+            snapshot_path (Optional[str], optional): Location of the JSON snapshot.
+                Defaults to None (disabled).
+            interval (float, optional): Time between two snapshots. Defaults to 60.
+        """
+
+        self.metrics = metrics
+        self.logger = logger
+        self.port = port
+        self.host = host
+        self.snapshot_path = snapshot_path
+        self.interval = interval
+
+    async def run(self):
+        """Serves the endpoint and writes snapshots until cancelled."""
+
+        server = None
+        if self.port:
+            server = await asyncio.start_server(self._handle, self.host, self.port)
+            self.logger.info(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+        try:
+            while True:
+                await asyncio.sleep(self.interval)
+                if self.snapshot_path:
+                    try:
+                        self.write_snapshot()
+                    except OSError as e:
+                        self.logger.warning(f"Could not write metrics to {self.snapshot_path}: {e}")
+        finally:
+            if server is not None:
+                server.close()
+                await server.wait_closed()
+
+    def write_snapshot(self):
+        """Writes the current metrics to `snapshot_path` as JSON."""
+
+        snapshot = {"timestamp": time.time(), "metrics": self.metrics.snapshot()}
+        directory = os.path.dirname(self.snapshot_path) or "."
+        os.makedirs(directory, exist_ok=True)
+        partial_path = os.path.join(directory, f".{os.path.basename(self.snapshot_path)}.partial")
+        with open(partial_path, "w") as f:
+            json.dump(snapshot, f)
+        os.replace(partial_path, self.snapshot_path)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Answers one HTTP request with the metrics."""
+
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            # The headers are not needed, but are read so the client sees a clean close.
+            while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+                pass
+            if request_line.split(b" ", 1)[0] not in (b"GET", b"HEAD"):
+                status, body = "405 Method Not Allowed", b""
+            else:
+                status, body = "200 OK", self.metrics.render().encode()
+            head = (
+                f"HTTP/1.1 {status}\r\nContent-Type: {CONTENT_TYPE}\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n"
+            ).encode()
+            writer.write(head if request_line.startswith(b"HEAD") else head + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError) as e:
+            self.logger.debug(f"Metrics request failed: {e}")
+        finally:
+            writer.close()
@@ -0,0 +1,187 @@
+import asyncio
+import dataclasses
+import json
+import logging
+import os
+import re
+
+from typing import Any, Dict, List, Optional
+
+from stream_manager import StreamManagerClient
+
+from src.AsyncStreamClient import AsyncStreamClient
+from src.BatchEncoder import BatchEncoder
+from src.BatchMessageProcessor import BatchMessageProcessor, ProcessorConfig
+from src.Metrics import Metrics
+from src.SpoolQuota import SpoolQuota
+
+# The encoder pool is shared by all streams, so it can only be sized once.
+SHARED_FIELDS = ("encoder_workers", "encoder_mode", "max_pending_batches")
+
+
+def _field_name(key: str) -> str:
+    """Converts a recipe style key such as "BatchMaxAge" into "batch_max_age"."""
+
+    return re.sub(r"(?<!^)(?=[A-Z])", "_", key).lower()
+
+
+def _coerce(field: dataclasses.Field, value: Any) -> Any:
+    """Converts a setting given as a string, as in the recipe, to the type of its field."""
+
+    if not isinstance(value, str):
+        return value
+    if field.type in (int, Optional[int]):
+        if value == "" and field.type == Optional[int]:
+            return None
+        return int(value)
+    if field.type == Optional[str] and value == "":
+        return None
+    return value
+
+
+def stream_configs(base: ProcessorConfig, streams: str) -> List[ProcessorConfig]:
+    """Expands a list of stream overrides into one configuration per stream.
+
+    Args:
+        base (ProcessorConfig): Configuration every stream starts from.
+        streams (str): JSON list of objects, each with a "StreamName" and any other
+            processor settings to override for that stream, e.g.
+            '[{"StreamName": "Telemetry"}, {"StreamName": "Events", "BatchMaxAge": 60}]'.
+            An empty string means only the stream of `base` is processed.
+
+    Returns:
+        List[ProcessorConfig]: Configuration of each stream. Unless overridden, each
+            stream writes to a sub-directory of `base.path` named after the stream, so
+            its files are uploaded under that prefix.
+    """
+
+    if not streams:
+        return [base]
+
+    overrides_list = json.loads(streams)
+    if not isinstance(overrides_list, list) or not overrides_list:
+        raise ValueError("Streams must be a non-empty JSON list of objects")
+
+    fields = {field.name: field for field in dataclasses.fields(ProcessorConfig)}
+    configs = []
+    for entry in overrides_list:
+        overrides: Dict[str, Any] = {_field_name(key): value for key, value in entry.items()}
+        unknown = set(overrides) - set(fields)
+        if unknown:
+            raise ValueError(f"Unknown stream settings {sorted(unknown)}")
+        overrides = {name: _coerce(fields[name], value) for name, value in overrides.items()}
+        shared = set(overrides) & set(SHARED_FIELDS)
+        if shared:
+            raise ValueError(f"Stream settings {sorted(shared)} are shared by all streams")
+        if not overrides.get("stream_name"):
+            raise ValueError("Every stream needs a StreamName")
+        overrides.setdefault("path", os.path.join(base.path, overrides["stream_name"]))
+        configs.append(dataclasses.replace(base, **overrides))
+
+    names = [config.stream_name for config in configs]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Stream names must be unique, got {names}")
+    paths = [os.path.normpath(config.path) for config in configs]
+    if len(set(paths)) != len(paths):
+        raise ValueError(f"Stream paths must be unique, got {paths}")
+    return configs
+
+
+class MultiStreamProcessor:
+    """Runs one BatchMessageProcessor per stream in a single process.
+
+    All streams share one StreamManager connection and one encoder pool, while each
+    keeps its own output directory, batch limits and checkpoint.
+
+    Attributes:
+        client (StreamManagerClient): Client shared by all streams.
+        async_client (AsyncStreamClient): Wrapper running blocking client calls off the event
+            loop, with one worker per stream so a long poll on one stream does not hold up
+            the others.
+        encoder (BatchEncoder): Pool compressing the batches of all streams.
+        processors (List[BatchMessageProcessor]): Processor of each stream.
+    """
+
+    def __init__(
+        self,
+        configs: List[ProcessorConfig],
+        logger: logging.Logger,
+        client: StreamManagerClient = None,
+        published_files: "asyncio.Queue[str]" = None,
+        quota: SpoolQuota = None,
+        metrics: Metrics = None,
+    ):
+        """Initializes MultiStreamProcessor.
+
+        Args:
+            configs (List[ProcessorConfig]): Configuration of each stream. The encoder pool
+                is sized from the first one.
+            logger (logging.Logger): Logger instance for logging messages and exceptions.
+            client (StreamManagerClient, optional): Client to manage the message streams.
+                If not provided, a default StreamManagerClient instance will be created.
+            published_files (asyncio.Queue[str], optional): Queue the path of every batch
+                file of every stream is put on once it is complete.
+            quota (SpoolQuota, optional): Size limit of the spool shared by all streams.
+            metrics (Metrics, optional): Metrics registry shared by all streams.
+        """
+
+        if not configs:
+            raise ValueError("At least one stream must be configured")
+
+        self.logger = logger
+        self.client = client or StreamManagerClient()
+        self.async_client = AsyncStreamClient(self.client, max_workers=len(configs))
+        self.encoder = BatchEncoder(
+            workers=configs[0].encoder_workers,
+            mode=configs[0].encoder_mode,
+            max_pending=configs[0].max_pending_batches,
+        )
+        self.processors: List[BatchMessageProcessor] = []
+        try:
+            for config in configs:
+                self.processors.append(
+                    BatchMessageProcessor(
+                        config,
+                        logger,
+                        async_client=self.async_client,
+                        encoder=self.encoder,
+                        published_files=published_files,
+                        quota=quota,
+                        metrics=metrics,
+                    )
+                )
+        except BaseException:
+            self.close()
+            raise
+
+    async def run(self, under_test: bool=False):
+        """Reads all streams concurrently until one of them fails.
+
+        Args:
+            under_test (bool, optional): Flag to determine if the function is
+                being executed under a test environment. Defaults to False.
+        """
+
+        tasks = [
+            asyncio.create_task(processor.run(under_test=under_test))
+            for processor in self.processors
+        ]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        # A failing stream restarts them all, each from its own checkpoint.
+        for task in done:
+            if not task.cancelled() and task.exception() is not None:
+                raise task.exception()
+
+    def close(self):
+        """Closes the processors, the shared encoder pool and the client connection."""
+
+        for processor in self.processors:
+            processor.close()
+        self.encoder.close()
+        self.async_client.close()
@@ -0,0 +1,167 @@
+import io
+import json
+import os
+
+from typing import Any, Optional
+
+try:
+    import pyarrow
+    import pyarrow.json
+    import pyarrow.parquet
+except ImportError:  # pragma: no cover - exercised when pyarrow is not installed
+    pyarrow = None
+
+
+PARQUET_COMPRESSIONS = ("snappy", "gzip", "zstd", "brotli", "lz4", "none")
+
+
+class ParquetConversionError(ValueError):
+    """Raised when a batch cannot be converted into an Arrow table."""
+
+
+def _require_pyarrow():
+    if pyarrow is None:
+        raise ImportError("Parquet output requires the pyarrow package to be installed")
+
+
+def _parse_type(spec: Any) -> "pyarrow.DataType":
+    """Converts a schema type specification into an Arrow type.
+
+    Args:
+        spec (Any): An Arrow type alias such as "string", "int64" or "timestamp[ms]",
+            a dict of field names to specifications for a struct, or a single
+            element list for a list type.
+
+    Returns:
+        pyarrow.DataType: The Arrow type.
+    """
+
+    if isinstance(spec, dict):
+        return pyarrow.struct([(name, _parse_type(child)) for name, child in spec.items()])
+    if isinstance(spec, list) and len(spec) == 1:
+        return pyarrow.list_(_parse_type(spec[0]))
+    if isinstance(spec, str):
+        return pyarrow.type_for_alias(spec)
+    raise ValueError(f"Unsupported Parquet schema type {spec!r}")
+
+
+def parse_schema(schema: str) -> "pyarrow.Schema":
+    """Parses an explicit Parquet schema from its JSON configuration.
+
+    Args:
+        schema (str): JSON object mapping field names to types, e.g.
+            '{"id": "string", "speed": "int64", "location": {"lat": "double", "lng": "double"}}'.
+
+    Returns:
+        pyarrow.Schema: The Arrow schema.
+    """
+
+    _require_pyarrow()
+    fields = json.loads(schema)
+    if not isinstance(fields, dict) or not fields:
+        raise ValueError("A Parquet schema must be a non-empty JSON object")
+    return pyarrow.schema([(name, _parse_type(spec)) for name, spec in fields.items()])
+
+
+def infer_schema(data: bytes) -> "pyarrow.Schema":
+    """Infers a Parquet schema from a JSON Lines batch.
+
+    Args:
+        data (bytes): The newline delimited batch.
+
+    Returns:
+        pyarrow.Schema: The inferred Arrow schema.
+
+    Raises:
+        ParquetConversionError: If no schema fits the batch, e.g. because a field
+            holds values of different types.
+    """
+
+    _require_pyarrow()
+    try:
+        return pyarrow.json.read_json(io.BytesIO(data)).schema
+    except pyarrow.ArrowException as e:
+        raise ParquetConversionError(str(e)) from e
+
+
+def _dead_letter(data: bytes, dead_letter_path: Optional[str], message: str, cause: Exception):
+    """Keeps a batch that could not be converted, if a location is given, and raises."""
+
+    if dead_letter_path is not None:
+        os.makedirs(os.path.dirname(dead_letter_path), exist_ok=True)
+        with open(dead_letter_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        raise ParquetConversionError(f"{message}; batch kept in {dead_letter_path}") from cause
+    raise ParquetConversionError(message) from cause
+
+
+def write_parquet_batch(
+    file_path: str,
+    data: bytes,
+    schema: Optional["pyarrow.Schema"],
+    row_group_size: Optional[int],
+    compression: str,
+    dead_letter_path: Optional[str] = None,
+    infer_on_mismatch: bool = False,
+) -> int:
+    """Converts a JSON Lines batch into a Parquet file.
+
+    This runs inside the encoder pool, so it must stay a module level function that
+    only takes picklable arguments. Fields missing from the schema are dropped. A batch
+    that does not fit the schema at all is not converted, so that every file under a
+    prefix keeps the one schema tables are defined with. With `infer_on_mismatch`, as
+    for a schema inferred from an earlier batch, its schema is inferred instead so the
+    data is still written. A batch that cannot be converted is written as is to
+    `dead_letter_path`, so it is kept for inspection without blocking later batches.
+    The file is synced to disk before returning, so it can be published and checkpointed.
+
+    Args:
+        file_path (str): Path of the file to write.
+        data (bytes): The newline delimited batch.
+        schema (Optional[pyarrow.Schema]): Schema to convert to, or None to infer it.
+        row_group_size (Optional[int]): Maximum number of rows per row group, or None
+            for a single row group per file.
+        compression (str): Parquet column compression, e.g. "snappy" or "zstd".
+        dead_letter_path (Optional[str], optional): Where to keep a batch that cannot
+            be converted.
+        infer_on_mismatch (bool, optional): Write a batch that does not fit `schema`
+            with its own inferred schema. Defaults to False.
+
+    Returns:
+        int: Size of the written file in bytes.
+
+    Raises:
+        ParquetConversionError: If the batch could not be converted. Nothing is
+            written to `file_path` then.
+    """
+
+    _require_pyarrow()
+    table = None
+    if schema is not None:
+        try:
+            table = pyarrow.json.read_json(
+                io.BytesIO(data),
+                parse_options=pyarrow.json.ParseOptions(
+                    explicit_schema=schema, unexpected_field_behavior="ignore"
+                ),
+            )
+        except pyarrow.ArrowException as e:
+            if not infer_on_mismatch:
+                _dead_letter(data, dead_letter_path, f"Batch does not fit the Parquet schema: {e}", e)
+    if table is None:
+        try:
+            table = pyarrow.json.read_json(io.BytesIO(data))
+        except pyarrow.ArrowException as e:
+            _dead_letter(data, dead_letter_path, str(e), e)
+
+    pyarrow.parquet.write_table(
+        table, file_path, row_group_size=row_group_size, compression=compression
+    )
+    fd = os.open(file_path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+        return os.fstat(fd).st_size
+    finally:
+        os.close(fd)
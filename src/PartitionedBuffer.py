@@ -0,0 +1,77 @@
+from collections import OrderedDict
+
+from typing import Callable, Iterator, List, Optional, Tuple
+
+from src.BatchBuffer import BatchBuffer
+
+
+class PartitionedBuffer:
+    """Routes messages to one BatchBuffer per partition.
+
+    Each partition has its own buffer, so it reaches its message count, size and age
+    limits independently of the others. At most `max_partitions` buffers are open; when
+    a new partition arrives at the cap, the least recently used one is evicted so that
+    the caller can flush it.
+
+    Attributes:
+        max_partitions (int): Maximum number of open partition buffers.
+        buffers (OrderedDict[Optional[str], BatchBuffer]): Open buffers, least recently
+            used first. The partition None is used when partitioning is disabled.
+    """
+
+    def __init__(self, buffer_factory: Callable[[], BatchBuffer], max_partitions: int = 100):
+        """Initializes PartitionedBuffer.
+
+        Args:
+            buffer_factory (Callable[[], BatchBuffer]): Creates the buffer of a new partition.
+            max_partitions (int, optional): Maximum number of open partition buffers.
+                Defaults to 100.
+        """
+
+        self._buffer_factory = buffer_factory
+        self.max_partitions = max(max_partitions, 1)
+        self.buffers: "OrderedDict[Optional[str], BatchBuffer]" = OrderedDict()
+
+    def __len__(self) -> int:
+        """Returns the number of buffered messages across all partitions."""
+
+        return sum(len(buffer) for buffer in self.buffers.values())
+
+    def get(self, partition: Optional[str]) -> Tuple[BatchBuffer, Optional[Tuple[Optional[str], BatchBuffer]]]:
+        """Returns the buffer of a partition, opening it if needed.
+
+        Args:
+            partition (Optional[str]): The partition.
+
+        Returns:
+            Tuple[BatchBuffer, Optional[Tuple[Optional[str], BatchBuffer]]]: The buffer,
+                and the partition and buffer evicted to make room for it, if any. The
+                caller must flush the evicted buffer.
+        """
+
+        buffer = self.buffers.get(partition)
+        if buffer is not None:
+            self.buffers.move_to_end(partition)
+            return buffer, None
+
+        evicted = None
+        if len(self.buffers) >= self.max_partitions:
+            evicted = self.buffers.popitem(last=False)
+        buffer = self.buffers[partition] = self._buffer_factory()
+        return buffer, evicted
+
+    def ready(self) -> List[Tuple[Optional[str], BatchBuffer]]:
+        """Returns the partitions whose buffers have reached a flush limit."""
+
+        return [(partition, buffer) for partition, buffer in self.buffers.items() if buffer.should_flush()]
+
+    def oldest_sequence_number(self) -> Optional[int]:
+        """Returns the lowest sequence number held in any buffer, or None if all are empty."""
+
+        return min(
+            (buffer.first_sequence_number for buffer in self._non_empty()),
+            default=None,
+        )
+
+    def _non_empty(self) -> Iterator[BatchBuffer]:
+        return (buffer for buffer in self.buffers.values() if len(buffer))
@@ -0,0 +1,115 @@
+import time
+
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional
+
+from src.LatencyHistogram import LatencyHistogram
+
+
+@dataclass
+class PendingUpload:
+    """An S3 export task submitted to StreamManager and not yet confirmed.
+
+    Attributes:
+        input_url (str): The task's input URL, e.g. "file:///data/batch.jsonl.gz".
+        file (str): Path of the file being exported.
+        size (int): Size of the file in bytes when it was submitted.
+        submitted_at (float): Monotonic time the task was submitted.
+        attempts (int): Number of times the file has been submitted, including this one.
+    """
+    input_url: str
+    file: str
+    size: int
+    submitted_at: float
+    attempts: int = 1
+
+
+class PendingUploads:
+    """Table of the export tasks awaiting a status message, keyed by input URL.
+
+    Status messages are matched against the table, so a confirmation knows when and
+    how often its file was submitted. Attempt counts of failed exports are kept until
+    the file is exported, so a retry continues counting.
+
+    Attributes:
+        uploads (Dict[str, PendingUpload]): Tasks awaiting confirmation, by input URL.
+        latency (LatencyHistogram): Time from submission to a successful export.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        """Initializes PendingUploads.
+
+        Args:
+            clock (Callable[[], float], optional): Monotonic clock used to time exports.
+                Defaults to time.monotonic.
+        """
+
+        self.uploads: Dict[str, PendingUpload] = {}
+        self.latency = LatencyHistogram()
+        self._clock = clock
+        self._failed_attempts: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.uploads)
+
+    def __contains__(self, input_url: str) -> bool:
+        return input_url in self.uploads
+
+    @property
+    def size_bytes(self) -> int:
+        """Total size of the files awaiting confirmation."""
+
+        return sum(upload.size for upload in self.uploads.values())
+
+    def submit(self, input_url: str, file: str, size: int, attempts: Optional[int] = None) -> PendingUpload:
+        """Records that an export task was submitted.
+
+        Args:
+            input_url (str): The task's input URL.
+            file (str): Path of the file.
+            size (int): Size of the file in bytes.
+            attempts (Optional[int], optional): Number of submissions including this one,
+                if known from elsewhere, e.g. a ledger kept across restarts. Defaults to
+                counting the failures seen by this table.
+
+        Returns:
+            PendingUpload: The table entry.
+        """
+
+        failed_attempts = self._failed_attempts.pop(input_url, 0)
+        if attempts is None:
+            attempts = failed_attempts + 1
+        upload = PendingUpload(input_url, file, size, self._clock(), attempts)
+        self.uploads[input_url] = upload
+        return upload
+
+    def succeed(self, input_url: str) -> Optional[PendingUpload]:
+        """Removes a task whose export succeeded and records its latency.
+
+        Args:
+            input_url (str): The task's input URL.
+
+        Returns:
+            Optional[PendingUpload]: The entry, or None if the task is not pending.
+        """
+
+        self._failed_attempts.pop(input_url, None)
+        upload = self.uploads.pop(input_url, None)
+        if upload is not None:
+            self.latency.observe(self._clock() - upload.submitted_at)
+        return upload
+
+    def fail(self, input_url: str) -> Optional[PendingUpload]:
+        """Removes a task whose export failed, remembering its attempts for a retry.
+
+        Args:
+            input_url (str): The task's input URL.
+
+        Returns:
+            Optional[PendingUpload]: The entry, or None if the task is not pending.
+        """
+
+        upload = self.uploads.pop(input_url, None)
+        if upload is not None:
+            self._failed_attempts[input_url] = upload.attempts
+        return upload
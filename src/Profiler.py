@@ -0,0 +1,273 @@
+import asyncio
+import collections
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+
+from datetime import datetime
+from typing import Counter, Optional
+
+from src.LatencyHistogram import LatencyHistogram
+
+# Hidden, so neither the uploader nor the spool quota pick up the results.
+PROFILES_DIR = ".profiles"
+# Creating this file under the spool directory starts a profile. It may hold the
+# duration in seconds.
+CONTROL_FILE = ".profile"
+# How often the control file is looked for while no profile runs.
+CONTROL_POLL_SECONDS = 5
+
+# How often the event loop is asked to wake up while a profile runs; any delay
+# beyond this is time the loop was blocked.
+LOOP_LAG_SAMPLE_SECONDS = 0.05
+LOOP_LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+
+# Entries kept in the text reports.
+REPORT_LIMIT = 50
+TRACEMALLOC_FRAMES = 10
+
+
+class Profiler:
+    """Profiles the running component on demand, without a restart.
+
+    A profile starts on SIGUSR1, or when `CONTROL_FILE` appears in the spool
+    directory; the file is removed once seen. For `duration` seconds it records:
+
+    * a cProfile of the event loop thread, which reads the streams and scans the spool;
+    * samples of the stacks of every thread every `sample_interval` seconds, which
+      also covers the encoder threads writing batches;
+    * the growth of memory allocations, with tracemalloc;
+    * how late the event loop wakes up, i.e. how long it is blocked.
+
+    The results are written to a timestamped directory under `output_path`. While no
+    profile runs, the only cost is a stat of the control file every few seconds.
+
+    Attributes:
+        path (str): Spool directory the control file is looked for in.
+        output_path (str): Directory the results are written to.
+        duration (float): Default length (in seconds) of a profile.
+        sample_interval (float): Time (in seconds) between two stack samples.
+        profiling (bool): Whether a profile is running.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        logger: logging.Logger,
+        output_path: Optional[str] = None,
+        duration: float = 60,
+        sample_interval: float = 0.01,
+    ):
+        """Initializes Profiler.
+
+        Args:
+            path (str): Spool directory the control file is looked for in.
+            logger (logging.Logger): Logger instance for logging messages and exceptions.
+            output_path (Optional[str], optional): Directory the results are written to.
+                Defaults to a hidden directory in `path`.
+            duration (float, optional): Default length of a profile. Defaults to 60.
+            sample_interval (float, optional): Time between two stack samples.
+                Defaults to 0.01.
+        """
+
+        self.path = path
+        self.logger = logger
+        self.output_path = output_path or os.path.join(path, PROFILES_DIR)
+        self.duration = duration
+        self.sample_interval = sample_interval
+        self.control_file = os.path.join(path, CONTROL_FILE)
+        self.profiling = False
+        self._requested = asyncio.Event()
+        self._requested_duration: Optional[float] = None
+        self._loop_lag = LatencyHistogram(LOOP_LAG_BUCKETS)
+        self._max_loop_lag = 0.0
+
+    def request(self, duration: Optional[float] = None):
+        """Starts a profile as soon as possible, unless one is running.
+
+        Args:
+            duration (Optional[float], optional): Length of the profile. Defaults to
+                `duration`.
+        """
+
+        if self.profiling:
+            self.logger.info("A profile is already running")
+            return
+        self._requested_duration = duration
+        self._requested.set()
+
+    async def run(self):
+        """Waits for profile requests and runs them, until cancelled."""
+
+        loop = asyncio.get_running_loop()
+        on_signal = False
+        if hasattr(signal, "SIGUSR1"):
+            try:
+                loop.add_signal_handler(signal.SIGUSR1, self.request)
+                on_signal = True
+            except (NotImplementedError, RuntimeError, ValueError) as e:
+                self.logger.debug(f"Profiling on SIGUSR1 is not available: {e}")
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self._requested.wait(), timeout=CONTROL_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    self._check_control_file()
+                    continue
+                self._requested.clear()
+                await self.profile(self._requested_duration or self.duration)
+        finally:
+            if on_signal:
+                loop.remove_signal_handler(signal.SIGUSR1)
+
+    def _check_control_file(self):
+        """Requests a profile if the control file exists, and removes it."""
+
+        try:
+            with open(self.control_file) as f:
+                content = f.read().strip()
+            os.remove(self.control_file)
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            self.logger.warning(f"Could not read profile control file {self.control_file}: {e}")
+            return
+        try:
+            duration = float(content) if content else None
+        except ValueError:
+            self.logger.warning(f"Ignoring invalid profile duration {content!r} in {self.control_file}")
+            duration = None
+        self.request(duration)
+
+    async def profile(self, duration: float) -> str:
+        """Profiles the component for a while and writes the results.
+
+        Args:
+            duration (float): Length of the profile, in seconds.
+
+        Returns:
+            str: Directory holding the results.
+        """
+
+        self.profiling = True
+        output_dir = os.path.join(self.output_path, datetime.now().strftime("%Y-%m-%d_%H-%M-%S"))
+        self.logger.info(f"Profiling for {duration:g}s into {output_dir}")
+
+        started_tracemalloc = not tracemalloc.is_tracing()
+        if started_tracemalloc:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        memory_before = tracemalloc.take_snapshot()
+
+        stacks: Counter[str] = collections.Counter()
+        stop_sampling = threading.Event()
+        sampler = threading.Thread(
+            target=self._sample_stacks, args=(stacks, stop_sampling), name="profiler-sampler", daemon=True
+        )
+        self._loop_lag = LatencyHistogram(LOOP_LAG_BUCKETS)
+        self._max_loop_lag = 0.0
+        lag_task = asyncio.create_task(self._measure_loop_lag())
+
+        profile = cProfile.Profile()
+        sampler.start()
+        profile.enable()
+        try:
+            await asyncio.sleep(duration)
+        finally:
+            profile.disable()
+            stop_sampling.set()
+            lag_task.cancel()
+            await asyncio.gather(lag_task, return_exceptions=True)
+            memory_after = tracemalloc.take_snapshot()
+            traced_current, traced_peak = tracemalloc.get_traced_memory()
+            if started_tracemalloc:
+                tracemalloc.stop()
+            sampler.join()
+            self.profiling = False
+
+        summary = {
+            "duration_seconds": duration,
+            "loop_lag_seconds": {
+                "samples": self._loop_lag.count,
+                "p50": self._loop_lag.quantile(0.5),
+                "p99": self._loop_lag.quantile(0.99),
+                "max": self._max_loop_lag,
+            },
+            "traced_memory_bytes": {"current": traced_current, "peak": traced_peak},
+            "stack_samples": sum(stacks.values()),
+        }
+        # Sorting and formatting the results takes a moment, so it happens off the loop.
+        await asyncio.get_running_loop().run_in_executor(
+            None, self._write_results, output_dir, profile, memory_before, memory_after, stacks, summary
+        )
+        self.logger.info(
+            f"Profile written to {output_dir} (event loop lag p99 <= {summary['loop_lag_seconds']['p99']}s, "
+            f"max {self._max_loop_lag:.3f}s)"
+        )
+        return output_dir
+
+    async def _measure_loop_lag(self):
+        """Records how much later than asked the event loop wakes up."""
+
+        while True:
+            asked_at = time.monotonic()
+            await asyncio.sleep(LOOP_LAG_SAMPLE_SECONDS)
+            lag = max(time.monotonic() - asked_at - LOOP_LAG_SAMPLE_SECONDS, 0.0)
+            self._loop_lag.observe(lag)
+            self._max_loop_lag = max(self._max_loop_lag, lag)
+
+    def _sample_stacks(self, stacks: "Counter[str]", stop: threading.Event):
+        """Counts the stacks of all other threads until stopped, in collapsed form."""
+
+        own_id = threading.get_ident()
+        names = {}
+        while not stop.wait(self.sample_interval):
+            if len(names) != threading.active_count():
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                calls = []
+                while frame is not None:
+                    code = frame.f_code
+                    calls.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                calls.append(names.get(thread_id, str(thread_id)))
+                stacks[";".join(reversed(calls))] += 1
+
+    def _write_results(
+        self,
+        output_dir: str,
+        profile: cProfile.Profile,
+        memory_before: tracemalloc.Snapshot,
+        memory_after: tracemalloc.Snapshot,
+        stacks: "Counter[str]",
+        summary: dict,
+    ):
+        os.makedirs(output_dir, exist_ok=True)
+
+        # Loadable with pstats or snakeviz, and readable as is.
+        profile.dump_stats(os.path.join(output_dir, "cprofile.prof"))
+        report = io.StringIO()
+        pstats.Stats(profile, stream=report).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(REPORT_LIMIT)
+        with open(os.path.join(output_dir, "cprofile.txt"), "w") as f:
+            f.write(report.getvalue())
+
+        # One "thread;outer;...;inner count" line per stack, as flame graph tools expect.
+        with open(os.path.join(output_dir, "stacks.txt"), "w") as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+        with open(os.path.join(output_dir, "tracemalloc.txt"), "w") as f:
+            for stat in memory_after.compare_to(memory_before, "lineno")[:REPORT_LIMIT]:
+                f.write(f"{stat}\n")
+
+        with open(os.path.join(output_dir, "summary.json"), "w") as f:
+            json.dump(summary, f, indent=2)
@@ -0,0 +1,59 @@
+import time
+
+from collections import deque
+
+from typing import Callable, Deque, Tuple
+
+
+class RateMeter:
+    """Measures the rate of events over a sliding time window.
+
+    Attributes:
+        window (float): Length (in seconds) of the window the rate is averaged over.
+        total (int): Number of events counted since the meter was created.
+    """
+
+    def __init__(self, window: float = 60, clock: Callable[[], float] = time.monotonic):
+        """Initializes RateMeter.
+
+        Args:
+            window (float, optional): Length (in seconds) of the averaging window. Defaults to 60.
+            clock (Callable[[], float], optional): Source of the current time. Defaults to
+                time.monotonic.
+        """
+
+        self.window = window
+        self.total = 0
+        self._clock = clock
+        self._started = clock()
+        self._events: Deque[Tuple[float, int]] = deque()
+        self._in_window = 0
+
+    def add(self, count: int = 1):
+        """Counts events that happened now.
+
+        Args:
+            count (int, optional): Number of events. Defaults to 1.
+        """
+
+        now = self._clock()
+        self.total += count
+        if self._events and self._events[-1][0] == now:
+            self._events[-1] = (now, self._events[-1][1] + count)
+        else:
+            self._events.append((now, count))
+        self._in_window += count
+        self._expire(now)
+
+    def rate(self) -> float:
+        """Returns the number of events per second over the window."""
+
+        now = self._clock()
+        self._expire(now)
+        # Until a full window has passed, average over the time since the meter started.
+        elapsed = min(now - self._started, self.window)
+        return self._in_window / elapsed if elapsed > 0 else 0.0
+
+    def _expire(self, now: float):
+        while self._events and self._events[0][0] <= now - self.window:
+            self._in_window -= self._events.popleft()[1]
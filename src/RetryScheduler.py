@@ -0,0 +1,108 @@
+import heapq
+import random
+import time
+
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+class RetryScheduler:
+    """Schedules failed exports to be retried with exponential backoff and jitter.
+
+    The n-th retry of a file waits `base_delay * 2 ** (n - 1)` seconds, capped at
+    `max_delay`, of which a random share of up to `jitter` is taken off, so files that
+    failed together are not all retried at the same moment.
+
+    Attributes:
+        base_delay (float): Delay (in seconds) before the first retry.
+        max_delay (float): Upper bound of the delay (in seconds).
+        jitter (float): Share of the delay, between 0 and 1, that is randomized.
+        retries_scheduled (int): Number of retries scheduled since creation.
+    """
+
+    def __init__(
+        self,
+        base_delay: float = 5,
+        max_delay: float = 900,
+        jitter: float = 0.5,
+        clock: Callable[[], float] = time.monotonic,
+        rng: Callable[[], float] = random.random,
+    ):
+        """Initializes RetryScheduler.
+
+        Args:
+            base_delay (float, optional): Delay before the first retry. Defaults to 5.
+            max_delay (float, optional): Upper bound of the delay. Defaults to 900.
+            jitter (float, optional): Share of the delay that is randomized. Defaults to 0.5.
+            clock (Callable[[], float], optional): Monotonic clock. Defaults to time.monotonic.
+            rng (Callable[[], float], optional): Source of random numbers in [0, 1).
+                Defaults to random.random.
+        """
+
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.retries_scheduled = 0
+        self._clock = clock
+        self._rng = rng
+        self._due: Dict[str, float] = {}
+        self._heap: List[Tuple[float, str]] = []
+
+    def __len__(self) -> int:
+        return len(self._due)
+
+    def __contains__(self, file: str) -> bool:
+        return file in self._due
+
+    def delay(self, attempts: int) -> float:
+        """Returns the delay before retrying a file that failed `attempts` times."""
+
+        backoff = min(self.base_delay * 2 ** max(attempts - 1, 0), self.max_delay)
+        return backoff * (1 - self.jitter * self._rng())
+
+    def schedule(self, file: str, attempts: int) -> float:
+        """Schedules a retry of a file.
+
+        Args:
+            file (str): Path of the file.
+            attempts (int): Number of times its export failed so far.
+
+        Returns:
+            float: Seconds until the retry is due.
+        """
+
+        delay = self.delay(attempts)
+        due = self._clock() + delay
+        self._due[file] = due
+        heapq.heappush(self._heap, (due, file))
+        self.retries_scheduled += 1
+        return delay
+
+    def cancel(self, file: str):
+        """Forgets a scheduled retry, e.g. because the file was exported after all."""
+
+        self._due.pop(file, None)
+
+    def pop_due(self) -> List[str]:
+        """Takes the files whose retry is due.
+
+        Returns:
+            List[str]: Paths of the files, longest due first.
+        """
+
+        now = self._clock()
+        files = []
+        while self._heap and self._heap[0][0] <= now:
+            due, file = heapq.heappop(self._heap)
+            if self._due.get(file) == due:
+                del self._due[file]
+                files.append(file)
+        return files
+
+    def next_due_in(self) -> Optional[float]:
+        """Returns the seconds until the next retry is due, or None if none is scheduled."""
+
+        while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        if not self._heap:
+            return None
+        return max(self._heap[0][0] - self._clock(), 0.0)
@@ -0,0 +1,118 @@
+import itertools
+import struct
+
+from array import array
+from multiprocessing import shared_memory
+from typing import List, Optional, Sequence
+
+# The header holds the number of payloads, then the end offset of each one.
+COUNT_FORMAT = "Q"
+OFFSET_TYPECODE = "Q"
+OFFSET_SIZE = 8
+
+
+class SharedBatch:
+    """Raw message payloads packed into one block of shared memory.
+
+    The process reading the stream packs a batch once, with a single copy of the
+    payloads. Only the name of the block is passed to the worker process that writes
+    the batch, rather than a pickled list of messages. The block holds the number of
+    payloads, the end offset of each one, and then the payloads back to back.
+
+    The process that creates a batch owns the block and frees it with `close`; other
+    processes only detach from it.
+
+    Attributes:
+        name (str): Name of the block, which other processes attach to.
+        size (int): Size of the packed batch in bytes.
+    """
+
+    def __init__(self, block: shared_memory.SharedMemory, size: int, owner: bool):
+        """Initializes SharedBatch. Use `create` or `attach` instead.
+
+        Args:
+            block (shared_memory.SharedMemory): The block holding the batch.
+            size (int): Size of the packed batch in bytes.
+            owner (bool): Whether `close` frees the block.
+        """
+
+        self._block: Optional[shared_memory.SharedMemory] = block
+        self.name = block.name
+        self.size = size
+        self._owner = owner
+
+    @classmethod
+    def create(cls, payloads: Sequence[bytes]) -> "SharedBatch":
+        """Packs payloads into a new block.
+
+        Args:
+            payloads (Sequence[bytes]): The payloads, in order.
+
+        Returns:
+            SharedBatch: The batch, owned by the caller.
+
+        Raises:
+            OSError: If no shared memory of that size could be allocated.
+        """
+
+        header = struct.pack(COUNT_FORMAT, len(payloads)) + array(
+            OFFSET_TYPECODE, itertools.accumulate(len(payload) for payload in payloads)
+        ).tobytes()
+        data = b"".join(payloads)
+        size = len(header) + len(data)
+        block = shared_memory.SharedMemory(create=True, size=size)
+        try:
+            block.buf[: len(header)] = header
+            block.buf[len(header) : size] = data
+        except BaseException:
+            block.close()
+            block.unlink()
+            raise
+        return cls(block, size, owner=True)
+
+    @classmethod
+    def attach(cls, name: str) -> "SharedBatch":
+        """Opens a batch packed by another process.
+
+        Args:
+            name (str): Name of the block.
+
+        Returns:
+            SharedBatch: The batch, which `close` only detaches from.
+        """
+
+        block = shared_memory.SharedMemory(name=name)
+        return cls(block, block.size, owner=False)
+
+    def payloads(self) -> List[bytes]:
+        """Copies the payloads out of the block.
+
+        Returns:
+            List[bytes]: The payloads, in order.
+        """
+
+        buf = self._block.buf
+        (count,) = struct.unpack_from(COUNT_FORMAT, buf)
+        data_start = struct.calcsize(COUNT_FORMAT) + count * OFFSET_SIZE
+        ends = array(OFFSET_TYPECODE)
+        ends.frombytes(buf[struct.calcsize(COUNT_FORMAT) : data_start])
+        payloads = []
+        start = data_start
+        for end in ends:
+            payloads.append(bytes(buf[start : data_start + end]))
+            start = data_start + end
+        return payloads
+
+    def close(self):
+        """Detaches from the block, and frees it if this process created it. Closing
+        twice does nothing."""
+
+        if self._block is None:
+            return
+        self._block.close()
+        if self._owner:
+            try:
+                self._block.unlink()
+            except FileNotFoundError:
+                pass
+        self._block = None
@@ -0,0 +1,178 @@
+import os
+import shutil
+import time
+import uuid
+
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Gzip members, zstd frames and newline terminated lines can each be concatenated into
+# a valid file of the same format. Parquet files cannot.
+CONCATENABLE_EXTENSIONS = (".jsonl.gz", ".jsonl.zst", ".jsonl")
+
+# Hidden, so scans of the spool never pick up merged files.
+COALESCED_DIR = ".coalesced"
+
+PARTIAL_SUFFIX = ".partial"
+
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+class SpoolCoalescer:
+    """Merges small spool files into fewer, larger files before they are exported.
+
+    Files of the same directory and format are grouped until the group reaches
+    `target_size` bytes, or its oldest file is `max_age` seconds old. A group is then
+    merged by concatenating its files, byte for byte, which yields a valid file of the
+    same format without recompressing it. Merged files are written to a hidden
+    directory in `base_dir`, under a temporary name they are renamed from once synced.
+
+    The inputs are left in place; they are removed once the merged file is exported.
+
+    Attributes:
+        base_dir (str): Directory holding the spool.
+        target_size (int): Size in bytes a group is merged at.
+        max_age (float): Age in seconds of its oldest file a group is merged at.
+        directory (str): Directory merged files are written to.
+    """
+
+    def __init__(
+        self,
+        base_dir: str,
+        target_size: int,
+        max_age: float = 300,
+        clock: Callable[[], float] = time.time,
+    ):
+        """Initializes SpoolCoalescer.
+
+        Args:
+            base_dir (str): Directory holding the spool.
+            target_size (int): Size in bytes a group is merged at.
+            max_age (float, optional): Age in seconds a group is merged at. Defaults to 300.
+            clock (Callable[[], float], optional): Source of the current wall clock time,
+                comparable with file mtimes. Defaults to time.time.
+        """
+
+        self.base_dir = base_dir
+        self.target_size = target_size
+        self.max_age = max_age
+        self.directory = os.path.join(base_dir, COALESCED_DIR)
+        self._clock = clock
+        # Files waiting to be merged, with their total size and the oldest mtime, by
+        # directory and extension.
+        self._groups: Dict[Tuple[str, str], Tuple[List[str], int, float]] = {}
+        self._ready: List[List[str]] = []
+
+    def __len__(self) -> int:
+        """Returns the number of files waiting to be merged."""
+
+        return sum(len(files) for files, _, _ in self._groups.values()) + sum(
+            len(files) for files in self._ready
+        )
+
+    @staticmethod
+    def extension(file: str) -> Optional[str]:
+        """Returns the extension of a file that can be merged, or None if it cannot."""
+
+        for extension in CONCATENABLE_EXTENSIONS:
+            if file.endswith(extension):
+                return extension
+        return None
+
+    def add(self, file: str, size: int, mtime: float) -> bool:
+        """Adds a file to the group of its directory and format, if it is worth merging.
+
+        Args:
+            file (str): Path of the file.
+            size (int): Size of the file in bytes.
+            mtime (float): Modification time of the file, in seconds.
+
+        Returns:
+            bool: Whether the file was added; False if it is not smaller than
+                `target_size` or of a format that cannot be merged.
+        """
+
+        extension = self.extension(file)
+        if extension is None or size >= self.target_size:
+            return False
+        key = (os.path.dirname(file), extension)
+        files, total, oldest = self._groups.pop(key, ([], 0, mtime))
+        if files and total + size > self.target_size:
+            # Merged files stay within the target size.
+            self._ready.append(files)
+            files, total, oldest = [], 0, mtime
+        files.append(file)
+        total += size
+        oldest = min(oldest, mtime)
+        if total >= self.target_size:
+            self._ready.append(files)
+        else:
+            self._groups[key] = (files, total, oldest)
+        return True
+
+    def pop_ready(self) -> List[List[str]]:
+        """Takes the groups that are big or old enough to be merged.
+
+        Returns:
+            List[List[str]]: Paths of the files of each group, in the order they were added.
+        """
+
+        now = self._clock()
+        for key, (files, _, oldest) in list(self._groups.items()):
+            if now - oldest >= self.max_age:
+                del self._groups[key]
+                self._ready.append(files)
+        ready, self._ready = self._ready, []
+        return ready
+
+    def merge(self, files: List[str]) -> Tuple[str, List[str]]:
+        """Concatenates files into a new merged file. Blocks on file I/O.
+
+        Args:
+            files (List[str]): Paths of the files, which must share a format.
+
+        Returns:
+            Tuple[str, List[str]]: Path of the merged file, and the paths of the files
+                that went into it; files removed in the meantime are left out.
+        """
+
+        os.makedirs(self.directory, exist_ok=True)
+        name = uuid.uuid4().hex + self.extension(files[0])
+        merged = os.path.join(self.directory, name)
+        partial = os.path.join(self.directory, f".{name}{PARTIAL_SUFFIX}")
+        inputs = []
+        with open(partial, "wb") as out:
+            for file in files:
+                try:
+                    with open(file, "rb") as f:
+                        shutil.copyfileobj(f, out, COPY_BUFFER_SIZE)
+                except FileNotFoundError:
+                    continue
+                inputs.append(file)
+            out.flush()
+            os.fsync(out.fileno())
+        os.rename(partial, merged)
+        # The rename is only durable once the directory is synced.
+        fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        return merged, inputs
+
+    def remove_orphans(self, merged_files: List[str]):
+        """Removes merged files not in the given list, e.g. left by a crash before they
+        were recorded. Their inputs are still in the spool and get merged again.
+
+        Args:
+            merged_files (List[str]): Paths of the merged files to keep.
+        """
+
+        keep = set(merged_files)
+        try:
+            entries = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            path = os.path.join(self.directory, entry)
+            if path not in keep:
+                os.remove(path)
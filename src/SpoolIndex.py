@@ -0,0 +1,180 @@
+import fnmatch
+import heapq
+import os
+import time
+
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+# File system timestamps are only as fine as the kernel's clock tick, so a directory
+# changed again within this long of a listing may still show the listed mtime.
+RACY_SECONDS = 2
+
+
+class SpoolIndex:
+    """Incrementally maintained index of the files waiting in the spool directory.
+
+    Adding, removing or renaming a file changes the mtime of its directory, so a
+    refresh stats each known directory and only lists those whose mtime changed.
+    Listing uses `os.scandir`, which needs no stat per entry; only files that are new
+    to the index are stat'ed, once, and their mtime is cached. New files are queued in
+    a heap ordered by mtime, so taking them in upload order does not sort the spool.
+
+    A pass over an unchanged spool therefore costs one stat per directory, and a pass
+    after changes costs one listing of each changed directory plus one stat per new file.
+
+    Like `glob`, hidden files and directories are skipped.
+
+    Attributes:
+        base_dir (str): Directory holding the spool.
+        pattern (str): Shell style pattern file names must match, e.g. "*.jsonl.gz".
+        recursive (bool): Whether files in sub-directories are indexed too.
+        files (Dict[str, int]): mtime (in nanoseconds) of every indexed file, by path.
+    """
+
+    def __init__(
+        self,
+        base_dir: str,
+        pattern: str,
+        recursive: bool = False,
+        clock: Callable[[], float] = time.time,
+    ):
+        """Initializes SpoolIndex. The spool is listed on the first `refresh`.
+
+        Args:
+            base_dir (str): Directory holding the spool.
+            pattern (str): Shell style pattern file names must match.
+            recursive (bool, optional): Whether to index sub-directories too. Defaults to False.
+            clock (Callable[[], float], optional): Source of the current wall clock time,
+                comparable with file mtimes. Defaults to time.time.
+        """
+
+        self.base_dir = base_dir
+        self.pattern = pattern
+        self.recursive = recursive
+        self.files: Dict[str, int] = {}
+        self._clock = clock
+        # mtime of each directory when it was last listed, or None to list it again.
+        self._dirs: Dict[str, Optional[int]] = {base_dir: None}
+        self._dir_files: Dict[str, Set[str]] = {}
+        self._dir_subdirs: Dict[str, Set[str]] = {}
+        self._pending: List[Tuple[int, str]] = []
+        self._queued: Set[str] = set()
+
+    def __len__(self) -> int:
+        """Returns the number of indexed files."""
+
+        return len(self.files)
+
+    def refresh(self) -> int:
+        """Brings the index up to date with the spool.
+
+        Returns:
+            int: Number of directories that had to be listed.
+        """
+
+        listed = 0
+        directories = list(self._dirs)
+        while directories:
+            directory = directories.pop()
+            if directory not in self._dirs:
+                continue
+            try:
+                mtime = os.stat(directory).st_mtime_ns
+            except FileNotFoundError:
+                self._remove_dir(directory)
+                continue
+            if mtime == self._dirs[directory]:
+                continue
+            directories.extend(self._list(directory, mtime))
+            listed += 1
+        return listed
+
+    def _list(self, directory: str, mtime: int) -> List[str]:
+        """Lists a directory, indexing new files and forgetting removed ones.
+
+        Returns:
+            List[str]: Sub-directories found for the first time.
+        """
+
+        old_files = self._dir_files.get(directory, set())
+        files: Set[str] = set()
+        subdirs: Set[str] = set()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.name.startswith("."):
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        if self.recursive:
+                            subdirs.add(entry.path)
+                    elif fnmatch.fnmatch(entry.name, self.pattern):
+                        if entry.path not in old_files:
+                            try:
+                                self._add_file(entry.path, entry.stat().st_mtime_ns)
+                            except FileNotFoundError:
+                                continue
+                        files.add(entry.path)
+        except FileNotFoundError:
+            self._remove_dir(directory)
+            return []
+
+        for path in old_files - files:
+            self._remove_file(path)
+        self._dir_files[directory] = files
+
+        old_subdirs = self._dir_subdirs.get(directory, set())
+        for subdir in old_subdirs - subdirs:
+            self._remove_dir(subdir)
+        self._dir_subdirs[directory] = subdirs
+        new_subdirs = [subdir for subdir in subdirs - old_subdirs if subdir not in self._dirs]
+        for subdir in new_subdirs:
+            self._dirs[subdir] = None
+
+        # A listing taken within the timestamp granularity of the last change might
+        # miss a change that does not move the mtime, so list such directories again.
+        racy = self._clock() - mtime / 1e9 < RACY_SECONDS
+        self._dirs[directory] = None if racy else mtime
+        return new_subdirs
+
+    def _add_file(self, path: str, mtime: int):
+        self.files[path] = mtime
+        self._queued.add(path)
+        heapq.heappush(self._pending, (mtime, path))
+
+    def _remove_file(self, path: str):
+        del self.files[path]
+        self._queued.discard(path)
+
+    def _remove_dir(self, directory: str):
+        self._dirs.pop(directory, None)
+        for path in self._dir_files.pop(directory, set()):
+            self._remove_file(path)
+        for subdir in self._dir_subdirs.pop(directory, set()):
+            self._remove_dir(subdir)
+
+    def pop_new(self) -> List[str]:
+        """Takes the files that were added since they were last taken.
+
+        Returns:
+            List[str]: Paths of the files, oldest first.
+        """
+
+        new_files: List[str] = []
+        while self._pending:
+            mtime, path = heapq.heappop(self._pending)
+            if path not in self._queued or self.files.get(path) != mtime:
+                continue  # Removed, or a duplicate of a requeued entry.
+            self._queued.discard(path)
+            new_files.append(path)
+        return new_files
+
+    def requeue(self, path: str):
+        """Queues an indexed file again, e.g. because its upload failed.
+
+        Args:
+            path (str): Path of the file. Files that are no longer indexed are ignored.
+        """
+
+        if path in self.files and path not in self._queued:
+            self._queued.add(path)
+            heapq.heappush(self._pending, (self.files[path], path))
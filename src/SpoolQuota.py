@@ -0,0 +1,147 @@
+import asyncio
+import os
+
+from typing import Callable, Dict, List
+
+QUOTA_POLICY_PAUSE = "pause"
+QUOTA_POLICY_DROP_OLDEST = "drop_oldest"
+QUOTA_POLICY_DROP_NEWEST = "drop_newest"
+QUOTA_POLICIES = (QUOTA_POLICY_PAUSE, QUOTA_POLICY_DROP_OLDEST, QUOTA_POLICY_DROP_NEWEST)
+
+
+class SpoolQuota:
+    """Keeps the batch files waiting in the spool directory within a size limit.
+
+    The spool is listed once, by `scan`; afterwards the processor reports every batch
+    it publishes and the uploader every file it removes, so the size is tracked without
+    listing the spool again. Once `max_bytes` is reached, the policy applies:
+
+    * "pause" stops reading streams until uploads make room again. Messages wait in
+      StreamManager, which applies its own limits to them.
+    * "drop_oldest" removes the oldest files until the spool fits.
+    * "drop_newest" removes the newest files, usually the batch just written.
+
+    Files the uploader is exporting are never removed; `protected` tells which those are.
+    Like the uploader, hidden files and directories are not counted.
+
+    Attributes:
+        path (str): Spool directory.
+        max_bytes (int): Size limit of the spool in bytes. 0 disables the limit.
+        policy (str): One of "pause", "drop_oldest" or "drop_newest".
+        files (Dict[str, int]): Size of every tracked file, by path, oldest first.
+        used_bytes (int): Total size of the tracked files.
+        evicted_files (int): Number of files removed to stay within the limit.
+        evicted_bytes (int): Total size of the files removed to stay within the limit.
+        protected (Callable[[str], bool]): Returns whether a file must not be removed.
+    """
+
+    def __init__(self, path: str, max_bytes: int, policy: str = QUOTA_POLICY_PAUSE):
+        """Initializes SpoolQuota. The spool is listed by `scan`.
+
+        Args:
+            path (str): Spool directory.
+            max_bytes (int): Size limit of the spool in bytes. 0 disables the limit.
+            policy (str, optional): What to do once the limit is reached. Defaults to "pause".
+        """
+
+        if policy not in QUOTA_POLICIES:
+            raise ValueError(f"Unknown spool quota policy {policy}, expected one of {QUOTA_POLICIES}")
+        self.path = path
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.files: Dict[str, int] = {}
+        self.used_bytes = 0
+        self.evicted_files = 0
+        self.evicted_bytes = 0
+        self.protected: Callable[[str], bool] = lambda file: False
+        self._space = asyncio.Event()
+
+    @property
+    def full(self) -> bool:
+        """Whether the spool has reached its limit."""
+
+        return self.max_bytes > 0 and self.used_bytes >= self.max_bytes
+
+    @property
+    def paused(self) -> bool:
+        """Whether stream reads must wait for room in the spool."""
+
+        return self.policy == QUOTA_POLICY_PAUSE and self.full
+
+    def scan(self):
+        """Lists the spool to learn the size of the files already in it."""
+
+        found = []
+        for root, dirs, names in os.walk(self.path):
+            dirs[:] = [name for name in dirs if not name.startswith(".")]
+            for name in names:
+                if name.startswith("."):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                found.append((stat.st_mtime_ns, path, stat.st_size))
+        found.sort()
+        self.files = {path: size for _, path, size in found}
+        self.used_bytes = sum(self.files.values())
+
+    def add(self, file: str, size: int) -> List[str]:
+        """Tracks a file written to the spool, and makes room if the policy drops files.
+
+        Args:
+            file (str): Path of the file.
+            size (int): Size of the file in bytes.
+
+        Returns:
+            List[str]: Paths of the files removed to stay within the limit, which may
+                include `file` itself.
+        """
+
+        self.used_bytes += size - self.files.pop(file, 0)
+        self.files[file] = size
+        if self.policy == QUOTA_POLICY_PAUSE or not self.full:
+            return []
+        return self._evict()
+
+    def remove(self, file: str):
+        """Stops tracking a file that was removed from the spool, e.g. once it was exported.
+
+        Args:
+            file (str): Path of the file. Files that are not tracked are ignored.
+        """
+
+        self.used_bytes -= self.files.pop(file, 0)
+        if not self.full:
+            self._space.set()
+
+    async def wait_for_space(self):
+        """Waits until the spool is below its limit, if the policy pauses reads."""
+
+        while self.paused:
+            self._space.clear()
+            await self._space.wait()
+
+    def _evict(self) -> List[str]:
+        """Removes unprotected files, oldest or newest first, until the spool fits."""
+
+        candidates = list(self.files)
+        if self.policy == QUOTA_POLICY_DROP_NEWEST:
+            candidates.reverse()
+        evicted = []
+        for file in candidates:
+            if not self.full:
+                break
+            if self.protected(file):
+                continue
+            size = self.files.pop(file)
+            self.used_bytes -= size
+            try:
+                os.remove(file)
+            except FileNotFoundError:
+                continue
+            evicted.append(file)
+            self.evicted_files += 1
+            self.evicted_bytes += size
+        return evicted
@@ -0,0 +1,73 @@
+import json
+import os
+
+from typing import Optional
+
+
+class StreamCheckpoint:
+    """Persists the last sequence number of a stream that has been flushed to disk.
+
+    The checkpoint is a small JSON document that is replaced atomically, so a crash
+    part way through a save leaves either the previous or the new value behind,
+    never a truncated file.
+
+    Attributes:
+        path (str): Location of the checkpoint file.
+    """
+
+    def __init__(self, path: str):
+        """Initializes StreamCheckpoint.
+
+        Args:
+            path (str): Location of the checkpoint file.
+        """
+
+        self.path = path
+
+    def load(self) -> Optional[int]:
+        """Reads the checkpoint.
+
+        Returns:
+            Optional[int]: The last flushed sequence number, or None if no valid
+                checkpoint has been written yet.
+        """
+
+        try:
+            with open(self.path, "r") as f:
+                sequence_number = json.load(f)["sequence_number"]
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        return sequence_number if isinstance(sequence_number, int) else None
+
+    def save(self, sequence_number: int) -> None:
+        """Atomically replaces the checkpoint with a new sequence number.
+
+        Args:
+            sequence_number (int): The last sequence number flushed to disk.
+        """
+
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"sequence_number": sequence_number}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+        # Persist the rename itself where the platform allows opening directories.
+        if hasattr(os, "O_DIRECTORY"):
+            dir_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+
+    def clear(self) -> None:
+        """Removes the checkpoint, if any."""
+
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
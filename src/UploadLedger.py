@@ -0,0 +1,242 @@
+import contextlib
+import os
+import sqlite3
+import time
+
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Optional
+
+STATE_QUEUED = "queued"
+STATE_SUBMITTED = "submitted"
+STATE_SUCCEEDED = "succeeded"
+STATE_FAILED = "failed"
+
+# Keeps the ledger in memory, so nothing survives a restart.
+IN_MEMORY = ":memory:"
+
+
+@dataclass
+class LedgerEntry:
+    """The recorded state of one file.
+
+    Attributes:
+        file (str): Path of the file.
+        state (str): One of "queued", "submitted", "succeeded" or "failed".
+        s3_key (str): Key the file is exported to.
+        size (int): Size of the file in bytes when it was queued.
+        attempts (int): Number of times an export task was submitted for the file.
+    """
+    file: str
+    state: str
+    s3_key: str
+    size: int
+    attempts: int
+
+
+class UploadLedger:
+    """Crash-safe record of the files being exported, kept in SQLite.
+
+    Each file moves from "queued" (claimed, its export task about to be appended) to
+    "submitted" (appended to the export stream), and then to "succeeded" or "failed"
+    as reported by the status stream. The position in the status stream is kept
+    alongside, so after a restart the uploader knows which files are still in flight
+    and which statuses it has already seen, without re-exporting the whole spool.
+    Files merged into one export are recorded along with the merged file, so they are
+    only removed once it was exported.
+
+    The database uses write-ahead logging with `synchronous=NORMAL`: a commit is a
+    sequential append to the log, and a crash of the process never loses one. A power
+    loss can lose the latest commits, which at worst exports a file again, because a
+    file is only removed once its success has been committed.
+
+    Attributes:
+        path (str): Location of the database, or ":memory:".
+    """
+
+    def __init__(self, path: str = IN_MEMORY):
+        """Initializes UploadLedger, creating the database if needed.
+
+        Args:
+            path (str, optional): Location of the database. Defaults to ":memory:".
+        """
+
+        self.path = path
+        if path != IN_MEMORY:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Transactions are managed explicitly, so several changes share one commit.
+        self._connection = sqlite3.connect(path, isolation_level=None)
+        self._depth = 0
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS files (
+                file TEXT PRIMARY KEY,
+                state TEXT NOT NULL,
+                s3_key TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS files_state ON files (state)")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS merges (input TEXT PRIMARY KEY, merged TEXT NOT NULL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS merges_merged ON merges (merged)")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)"
+        )
+
+    @contextlib.contextmanager
+    def transaction(self) -> Iterator[None]:
+        """Groups the changes made inside the block into a single commit."""
+
+        if self._depth == 0:
+            self._connection.execute("BEGIN")
+        self._depth += 1
+        try:
+            yield
+        except BaseException:
+            self._depth -= 1
+            if self._depth == 0:
+                self._connection.execute("ROLLBACK")
+            raise
+        self._depth -= 1
+        if self._depth == 0:
+            self._connection.execute("COMMIT")
+
+    def queue(self, file: str, s3_key: str, size: int):
+        """Records that a file was claimed for export, keeping its earlier attempts.
+
+        Args:
+            file (str): Path of the file.
+            s3_key (str): Key the file is exported to.
+            size (int): Size of the file in bytes.
+        """
+
+        self._connection.execute(
+            """
+            INSERT INTO files (file, state, s3_key, size, updated_at) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (file) DO UPDATE SET
+                state = excluded.state, s3_key = excluded.s3_key,
+                size = excluded.size, updated_at = excluded.updated_at
+            """,
+            (file, STATE_QUEUED, s3_key, size, time.time()),
+        )
+
+    def submit(self, file: str) -> int:
+        """Records that the export task of a queued file was appended.
+
+        Args:
+            file (str): Path of the file.
+
+        Returns:
+            int: Number of times the file has been submitted, including this one.
+        """
+
+        with self.transaction():
+            self._connection.execute(
+                "UPDATE files SET state = ?, attempts = attempts + 1, updated_at = ? WHERE file = ?",
+                (STATE_SUBMITTED, time.time(), file),
+            )
+            row = self._connection.execute("SELECT attempts FROM files WHERE file = ?", (file,)).fetchone()
+        return row[0] if row else 1
+
+    def succeed(self, file: str):
+        """Records that a file was exported. It may be removed once this is committed."""
+
+        self._set_state(file, STATE_SUCCEEDED)
+
+    def fail(self, file: str):
+        """Records that the export of a file failed, so it is submitted again."""
+
+        self._set_state(file, STATE_FAILED)
+
+    def _set_state(self, file: str, state: str):
+        self._connection.execute(
+            "UPDATE files SET state = ?, updated_at = ? WHERE file = ?", (state, time.time(), file)
+        )
+
+    def forget(self, files: Iterable[str]):
+        """Removes files from the ledger, e.g. once they were exported and removed.
+
+        Args:
+            files (Iterable[str]): Paths of the files.
+        """
+
+        self._connection.executemany("DELETE FROM files WHERE file = ?", ((file,) for file in files))
+
+    def forget_succeeded(self):
+        """Removes every file recorded as exported."""
+
+        self._connection.execute("DELETE FROM files WHERE state = ?", (STATE_SUCCEEDED,))
+
+    def entries(self, state: Optional[str] = None) -> List[LedgerEntry]:
+        """Returns the recorded files, optionally only those in one state.
+
+        Args:
+            state (Optional[str], optional): State to filter by. Defaults to all states.
+
+        Returns:
+            List[LedgerEntry]: The files, in the order they were last updated.
+        """
+
+        query = "SELECT file, state, s3_key, size, attempts FROM files"
+        params: tuple = ()
+        if state is not None:
+            query += " WHERE state = ?"
+            params = (state,)
+        query += " ORDER BY updated_at"
+        return [LedgerEntry(*row) for row in self._connection.execute(query, params)]
+
+    def record_merge(self, merged: str, inputs: Iterable[str]):
+        """Records the files that were merged into one file.
+
+        Args:
+            merged (str): Path of the merged file.
+            inputs (Iterable[str]): Paths of the files that went into it.
+        """
+
+        self._connection.executemany(
+            "INSERT OR REPLACE INTO merges (input, merged) VALUES (?, ?)",
+            ((file, merged) for file in inputs),
+        )
+
+    def forget_merge(self, merged: str):
+        """Removes the record of a merged file and its inputs."""
+
+        self._connection.execute("DELETE FROM merges WHERE merged = ?", (merged,))
+
+    def merges(self) -> Dict[str, List[str]]:
+        """Returns the paths of the files that went into each merged file, by merged file."""
+
+        merges: Dict[str, List[str]] = {}
+        for file, merged in self._connection.execute("SELECT input, merged FROM merges ORDER BY rowid"):
+            merges.setdefault(merged, []).append(file)
+        return merges
+
+    @property
+    def status_sequence_number(self) -> Optional[int]:
+        """Sequence number of the next status message to read, if any was read."""
+
+        row = self._connection.execute(
+            "SELECT value FROM meta WHERE key = 'status_sequence_number'"
+        ).fetchone()
+        return row[0] if row else None
+
+    @status_sequence_number.setter
+    def status_sequence_number(self, sequence_number: Optional[int]):
+        if sequence_number is None:
+            self._connection.execute("DELETE FROM meta WHERE key = 'status_sequence_number'")
+        else:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('status_sequence_number', ?)",
+                (sequence_number,),
+            )
+
+    def close(self):
+        """Closes the database."""
+
+        self._connection.close()
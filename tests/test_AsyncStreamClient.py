@@ -0,0 +1,93 @@
+import unittest
+import unittest.mock
+import tempfile
+import threading
+import logging
+import asyncio
+import os
+
+from src.AsyncStreamClient import AsyncStreamClient
+from src.BatchMessageProcessor import BatchMessageProcessor, ProcessorConfig
+from src.DirectoryUploader import DirectoryUploader, UploaderConfig
+
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger()
+
+
+class TestAsyncStreamClient(unittest.TestCase):
+    def test_calls_are_delegated(self):
+        mock_client = unittest.mock.MagicMock()
+        mock_client.append_message.return_value = 42
+
+        async_client = AsyncStreamClient(mock_client)
+        loop = asyncio.get_event_loop()
+
+        sequence_number = loop.run_until_complete(
+            async_client.append_message("stream1", b"{}")
+        )
+        self.assertEqual(sequence_number, 42)
+        mock_client.append_message.assert_called_once_with("stream1", b"{}")
+
+        async_client.close()
+        mock_client.close.assert_called_once()
+
+    def test_processor_and_uploader_make_progress_concurrently(self):
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            for i, name in enumerate(["old.jsonl.gz", "new.jsonl.gz"]):
+                file_path = os.path.join(tmpdirname, name)
+                with open(file_path, "w") as f:
+                    f.write("{}")
+                os.utime(file_path, (1000 + i, 1000 + i))
+
+            appended = threading.Event()
+            read_saw_append = []
+
+            def blocking_read(*_args, **_kwargs):
+                # Only returns once the uploader has appended, which can only
+                # happen if this read is not holding the event loop.
+                read_saw_append.append(appended.wait(timeout=5))
+                return []
+
+            def append(*_args, **_kwargs):
+                appended.set()
+                return 1
+
+            processor_client = unittest.mock.MagicMock()
+            processor_client.read_messages.side_effect = blocking_read
+            uploader_client = unittest.mock.MagicMock()
+            uploader_client.append_message.side_effect = append
+
+            processor = BatchMessageProcessor(
+                ProcessorConfig(stream_name="stream1", batch_size=3, path=tmpdirname, interval=0),
+                logger,
+                client=processor_client,
+            )
+            uploader = DirectoryUploader(
+                UploaderConfig(
+                    bucket_name="test-bucket",
+                    prefix="sample",
+                    interval=0,
+                    path=tmpdirname + "/*.jsonl.gz",
+                ),
+                logger,
+                client=uploader_client,
+            )
+
+            async def run_both():
+                await asyncio.gather(
+                    processor.run(under_test=True),
+                    uploader._scan(under_test=True),
+                )
+
+            loop = asyncio.get_event_loop()
+            loop.run_until_complete(run_both())
+
+            self.assertEqual(read_saw_append, [True])
+            self.assertEqual(uploader_client.append_message.call_count, 2)
+
+            processor.close()
+            uploader.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
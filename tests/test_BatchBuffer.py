@@ -0,0 +1,60 @@
+import unittest
+
+from src.BatchBuffer import BatchBuffer
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class TestBatchBuffer(unittest.TestCase):
+    def test_flush_on_message_count(self):
+        buffer = BatchBuffer(max_messages=2)
+        self.assertFalse(buffer.should_flush())
+        buffer.add(b'{"a":1}', 7, 0)
+        self.assertFalse(buffer.should_flush())
+        buffer.add(b'{"a":2}', 7, 1)
+        self.assertTrue(buffer.should_flush())
+
+        messages, first_sequence_number, last_sequence_number = buffer.drain()
+        self.assertEqual(messages, [b'{"a":1}', b'{"a":2}'])
+        self.assertEqual(first_sequence_number, 0)
+        self.assertEqual(last_sequence_number, 1)
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(buffer.size_bytes, 0)
+
+    def test_flush_on_size(self):
+        buffer = BatchBuffer(max_messages=100, max_bytes=10)
+        buffer.add(b'{"a":1}', 7, 0)
+        self.assertFalse(buffer.should_flush())
+        buffer.add(b'{"a":2}', 7, 1)
+        self.assertTrue(buffer.should_flush())
+
+    def test_flush_on_age(self):
+        clock = FakeClock()
+        buffer = BatchBuffer(max_messages=100, max_age=30, clock=clock)
+
+        # An empty buffer never expires.
+        clock.now = 100
+        self.assertFalse(buffer.should_flush())
+
+        buffer.add(b'{"a":1}', 7, 0)
+        clock.now = 120
+        buffer.add(b'{"a":2}', 7, 1)
+        self.assertFalse(buffer.should_flush())
+
+        # Age is measured from the oldest message.
+        clock.now = 130
+        self.assertEqual(buffer.age(), 30)
+        self.assertTrue(buffer.should_flush())
+
+        buffer.drain()
+        self.assertEqual(buffer.age(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
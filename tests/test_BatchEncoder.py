@@ -0,0 +1,114 @@
+import unittest
+import unittest.mock
+import tempfile
+import threading
+import asyncio
+import gzip
+import os
+import tracemalloc
+
+from src.BatchEncoder import BatchEncoder, write_jsonl_batch
+from src.Compression import Compression
+
+
+class TestBatchEncoder(unittest.TestCase):
+    def _write_batches(self, encoder: BatchEncoder, tmpdirname: str):
+        async def scenario():
+            futures = [
+                await encoder.submit(
+                    write_jsonl_batch,
+                    os.path.join(tmpdirname, f"{i}.jsonl.gz"),
+                    [b'{"n":%d}' % i],
+                    Compression(),
+                )
+                for i in range(3)
+            ]
+            return await asyncio.gather(*futures)
+
+        loop = asyncio.get_event_loop()
+        sizes = loop.run_until_complete(scenario())
+
+        for i, size in enumerate(sizes):
+            file_path = os.path.join(tmpdirname, f"{i}.jsonl.gz")
+            self.assertEqual(size, os.path.getsize(file_path))
+            with gzip.open(file_path, "rb") as f:
+                self.assertEqual(f.read(), b'{"n":%d}\n' % i)
+
+    def test_thread_pool(self):
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            encoder = BatchEncoder(workers=2, mode="thread")
+            self._write_batches(encoder, tmpdirname)
+            encoder.close()
+
+    def test_process_pool(self):
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            encoder = BatchEncoder(workers=2, mode="process")
+            self._write_batches(encoder, tmpdirname)
+            encoder.close()
+
+    def test_batch_synced_to_disk(self):
+        with tempfile.TemporaryDirectory() as tmpdirname, unittest.mock.patch(
+            "src.BatchEncoder.os.fsync"
+        ) as mock_fsync:
+            write_jsonl_batch(os.path.join(tmpdirname, "0.jsonl.gz"), [b'{"n":0}'], Compression())
+            mock_fsync.assert_called_once()
+
+    def test_batch_streamed_through_each_codec(self):
+        messages = [b'{"n":%d,"pad":"%s"}' % (i, b"x" * (i % 50)) for i in range(5000)]
+        expected = b"".join(message + b"\n" for message in messages)
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            for codec in ["gzip", "zstd", "none"]:
+                compression = Compression(codec=codec)
+                file_path = os.path.join(tmpdirname, "0.jsonl" + compression.extension)
+                size = write_jsonl_batch(file_path, messages, compression)
+                self.assertEqual(size, os.path.getsize(file_path))
+                with open(file_path, "rb") as f:
+                    self.assertEqual(compression.decompress(f.read()), expected)
+
+    def test_batch_memory_bounded(self):
+        # 4 MB of random messages; writing them must not copy the batch.
+        messages = [os.urandom(50).hex().encode() for _ in range(40000)]
+        batch_bytes = sum(len(message) + 1 for message in messages)
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            for codec in ["gzip", "zstd", "none"]:
+                file_path = os.path.join(tmpdirname, f"{codec}.jsonl")
+                tracemalloc.start()
+                try:
+                    write_jsonl_batch(file_path, messages, Compression(codec=codec))
+                    _, peak = tracemalloc.get_traced_memory()
+                finally:
+                    tracemalloc.stop()
+                # Chunk and compressor state only, well short of a copy of the batch.
+                self.assertLess(peak, batch_bytes / 4, codec)
+
+    def test_invalid_mode(self):
+        with self.assertRaises(ValueError):
+            BatchEncoder(mode="fiber")
+
+    def test_max_pending(self):
+        encoder = BatchEncoder(workers=4, max_pending=2)
+        release = threading.Event()
+        submitted = []
+
+        async def scenario():
+            async def submit_all():
+                for i in range(3):
+                    submitted.append(await encoder.submit(release.wait, 5))
+
+            task = asyncio.ensure_future(submit_all())
+            await asyncio.sleep(0.05)
+
+            # The third batch waits until one of the first two completes.
+            self.assertEqual(len(submitted), 2)
+            release.set()
+            await task
+            await asyncio.gather(*submitted)
+
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(scenario())
+        self.assertEqual(len(submitted), 3)
+        encoder.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,13 +1,29 @@
 import unittest
 import unittest.mock
 import tempfile
+import threading
 import logging
 import asyncio
 import os
 import gzip
 from datetime import datetime
-
-from src.BatchMessageProcessor import BatchMessageProcessor, ProcessorConfig
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from src.BatchEncoder import BatchEncoder, write_jsonl_batch
+from src.Compression import Compression
+from src import ParquetBatch
+from src.BatchMessageProcessor import (
+    BatchMessageProcessor,
+    BatchWriteError,
+    ProcessorConfig,
+    ShardJob,
+    ShardResult,
+    write_shard,
+)
+from src.Metrics import Metrics
+from src.SpoolQuota import QUOTA_POLICY_DROP_NEWEST, SpoolQuota
+from src.StreamCheckpoint import StreamCheckpoint
 
 from stream_manager import (
     NotEnoughMessagesException,
@@ -139,12 +155,14 @@ class TestBatchMessageProcessor(unittest.TestCase):
 
         with tempfile.TemporaryDirectory() as tmpdirname:
             mock_client = unittest.mock.MagicMock()
+            mock_client.describe_message_stream.side_effect = ResourceNotFoundException("Mock Not Found")
 
             config = ProcessorConfig(stream_name="stream1", batch_size=3, path=tmpdirname, interval=1)
 
             # Verify the logger message
+            bmp = BatchMessageProcessor(config, logger, client=mock_client)
             with self.assertLogs(logger, level="INFO") as cm:
-                _ = BatchMessageProcessor(config, logger, client=mock_client)
+                asyncio.get_event_loop().run_until_complete(bmp.start())
                 self.assertIn(f"INFO:root:Creating stream {config.stream_name}...", cm.output)
 
             # Verify that create_message_stream was called after the exception
@@ -190,6 +208,692 @@ class TestBatchMessageProcessor(unittest.TestCase):
             # Check that asyncio.sleep was called with both 5 and 1 seconds delay
             _.assert_has_calls([unittest.mock.call(5), unittest.mock.call(1)])
 
+    def test_resume_from_checkpoint(self):
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            StreamCheckpoint(os.path.join(tmpdirname, ".stream1.checkpoint")).save(41)
+
+            mock_client = unittest.mock.MagicMock()
+            mock_client.describe_message_stream.return_value.storage_status.newest_sequence_number = 100
+            mock_client.read_messages.side_effect = NotEnoughMessagesException("Mock Not Enough Messages")
+
+            config = ProcessorConfig(stream_name="stream1", batch_size=3, path=tmpdirname, interval=0)
+            bmp = BatchMessageProcessor(config, logger, client=mock_client)
+            loop = asyncio.get_event_loop()
+            loop.run_until_complete(bmp.start())
+
+            # The existing stream is reused rather than recreated.
+            mock_client.delete_message_stream.assert_not_called()
+            mock_client.create_message_stream.assert_not_called()
+            self.assertEqual(bmp.start_sequence_number, 42)
+
+            loop.run_until_complete(bmp.run(under_test=True))
+            mock_client.describe_message_stream.assert_called_once()
+            options = mock_client.read_messages.call_args[0][1]
+            self.assertEqual(options.desired_start_sequence_number, 42)
+
+    def test_resume_with_stale_checkpoint(self):
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            checkpoint = StreamCheckpoint(os.path.join(tmpdirname, ".stream1.checkpoint"))
+            checkpoint.save(500)
+
+            mock_client = unittest.mock.MagicMock()
+            mock_client.describe_message_stream.return_value.storage_status.newest_sequence_number = 10
+
+            config = ProcessorConfig(stream_name="stream1", batch_size=3, path=tmpdirname, interval=0)
+            bmp = BatchMessageProcessor(config, logger, client=mock_client)
+            asyncio.get_event_loop().run_until_complete(bmp.start())
+
+            self.assertEqual(bmp.start_sequence_number, 0)
+            self.assertIsNone(checkpoint.load())
+
+    def test_recreate_mode(self):
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            checkpoint = StreamCheckpoint(os.path.join(tmpdirname, ".stream1.checkpoint"))
+            checkpoint.save(41)
+
+            mock_client = unittest.mock.MagicMock()
+
+            config = ProcessorConfig(
+                stream_name="stream1", batch_size=3, path=tmpdirname, interval=0, startup_mode="recreate"
+            )
+            bmp = BatchMessageProcessor(config, logger, client=mock_client)
+            asyncio.get_event_loop().run_until_complete(bmp.start())
+
+            mock_client.delete_message_stream.assert_called_once_with(stream_name="stream1")
+            mock_client.create_message_stream.assert_called_once_with(definition=unittest.mock.ANY)
+            self.assertEqual(bmp.start_sequence_number, 0)
+            self.assertIsNone(checkpoint.load())
+
+    def test_invalid_startup_mode(self):
+        config = ProcessorConfig(
+            stream_name="stream1", batch_size=3, path="/tmp", interval=0, startup_mode="bogus"
+        )
+        with self.assertRaises(ValueError):
+            BatchMessageProcessor(config, logger, client=unittest.mock.MagicMock())
+
+    @unittest.mock.patch("src.BatchMessageProcessor.datetime")
+    def test_checkpoint_saved_after_write(self, mock_datetime: datetime):
+        mock_datetime.now.return_value = datetime(2023, 1, 1, 12, 0, 0) # type: ignore
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            mock_client = unittest.mock.MagicMock()
+            mock_client.read_messages.return_value = [
+                Message(stream_name="stream1", sequence_number=i, ingest_time=1000, payload=b'{"a": 1}')
+                for i in range(7, 10)
+            ]
+
+            config = ProcessorConfig(stream_name="stream1", batch_size=3, path=tmpdirname, interval=0)
+            bmp = BatchMessageProcessor(config, logger, client=mock_client)
+            loop = asyncio.get_event_loop()
+            loop.run_until_complete(bmp.run(under_test=True))
+
+            self.assertEqual(bmp.checkpoint.load(), 9)
+
+    @unittest.mock.patch("src.BatchMessageProcessor.datetime")
+    def test_published_files_handed_over(self, mock_datetime: datetime):
+        mock_datetime.now.return_value = datetime(2023, 1, 1, 12, 0, 0) # type: ignore
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            mock_client = unittest.mock.MagicMock()
+            mock_client.read_messages.return_value = [
+                Message(stream_name="stream1", sequence_number=i, ingest_time=1000, payload=b'{"a": 1}')
+                for i in range(0, 7)
+            ]
+            published_files: asyncio.Queue = asyncio.Queue()
+
+            config = ProcessorConfig(stream_name="stream1", batch_size=3, path=tmpdirname, interval=0)
+            bmp = BatchMessageProcessor(config, logger, client=mock_client, published_files=published_files)
+            asyncio.get_event_loop().run_until_complete(bmp.run(under_test=True))
+
+            # Only complete batches are handed over, in order, once they are in place.
+            files = [published_files.get_nowait() for _ in range(published_files.qsize())]
+            self.assertEqual(
+                files,
+                [
+                    os.path.join(tmpdirname, "2023-01-01_12-00-00_0.jsonl.gz"),
+                    os.path.join(tmpdirname, "2023-01-01_12-00-00_1.jsonl.gz"),
+                ],
+            )
+            for file in files:
+                self.assertTrue(os.path.exists(file))
+
+    @unittest.mock.patch("src.BatchMessageProcessor.datetime")
+    def test_spool_quota_drops_newest_batches(self, mock_datetime: datetime):
+        mock_datetime.now.return_value = datetime(2023, 1, 1, 12, 0, 0) # type: ignore
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            mock_client = unittest.mock.MagicMock()
+            mock_client.read_messages.return_value = [
+                Message(stream_name="stream1", sequence_number=i, ingest_time=1000, payload=b'{"a": 1}')
+                for i in range(0, 6)
+            ]
+            published_files: asyncio.Queue = asyncio.Queue()
+            quota = SpoolQuota(tmpdirname, max_bytes=1, policy=QUOTA_POLICY_DROP_NEWEST)
+
+            config = ProcessorConfig(stream_name="stream1", batch_size=3, path=tmpdirname, interval=0)
+            bmp = BatchMessageProcessor(
+                config, logger, client=mock_client, published_files=published_files, quota=quota
+            )
+            asyncio.get_event_loop().run_until_complete(bmp.run(under_test=True))
+
+            # Dropped batches are not handed over, but their messages count as written.
+            self.assertTrue(published_files.empty())
+            self.assertEqual(quota.evicted_files, 2)
+            self.assertEqual(quota.used_bytes, 0)
+            self.assertFalse(os.path.exists(os.path.join(tmpdirname, "2023-01-01_12-00-00_0.jsonl.gz")))
+            self.assertEqual(bmp.checkpoint.load(), 5)
+
+    def test_spool_quota_pauses_reads(self):
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            mock_client = unittest.mock.MagicMock()
+            mock_client.read_messages.side_effect = NotEnoughMessagesException("Mock Not Enough")
+            quota = SpoolQuota(tmpdirname, max_bytes=10)
+            quota.add(os.path.join(tmpdirname, "waiting.jsonl.gz"), 10)
+
+            config = ProcessorConfig(stream_name="stream1", batch_size=3, path=tmpdirname, interval=0)
+            bmp = BatchMessageProcessor(config, logger, client=mock_client, quota=quota)
+            loop = asyncio.get_event_loop()
+            loop.run_until_complete(bmp.start())
+            reading = loop.create_task(bmp._read_messages(under_test=True))
+            loop.run_until_complete(asyncio.sleep(0.05))
+            mock_client.read_messages.assert_not_called()
+
+            # Reads resume once an upload makes room.
+            quota.remove(os.path.join(tmpdirname, "waiting.jsonl.gz"))
+            loop.run_until_complete(reading)
+            mock_client.read_messages.assert_called_once()
+
+    @unittest.mock.patch("src.BatchMessageProcessor.datetime")
+    def test_partial_batches_carried_across_reads(self, mock_datetime: datetime):
+        mock_datetime.now.return_value = datetime(2023, 1, 1, 12, 0, 0) # type: ignore
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            mock_client = unittest.mock.MagicMock()
+
+            config = ProcessorConfig(
+                stream_name="stream1", batch_size=3, path=tmpdirname, interval=0, batch_max_age=0
+            )
+            bmp = BatchMessageProcessor(config, logger, client=mock_client)
+            loop = asyncio.get_event_loop()
+            expected_file = os.path.join(tmpdirname, "2023-01-01_12-00-00_0.jsonl.gz")
+
+            # Two messages are not enough for a batch, but they must not be dropped.
+            mock_client.read_messages.return_value = [
+                Message(stream_name="stream1", sequence_number=i, ingest_time=1000, payload=b'{"n": %d}' % i)
+                for i in range(0, 2)
+            ]
+            loop.run_until_complete(bmp.run(under_test=True))
+            self.assertFalse(os.path.exists(expected_file))
+            self.assertIsNone(bmp.checkpoint.load())
+
+            mock_client.read_messages.return_value = [
+                Message(stream_name="stream1", sequence_number=i, ingest_time=1000, payload=b'{"n": %d}' % i)
+                for i in range(2, 4)
+            ]
+            loop.run_until_complete(bmp.run(under_test=True))
+
+            with gzip.open(expected_file, "rt") as f:
+                self.assertEqual(f.readlines(), ['{"n":0}\n', '{"n":1}\n', '{"n":2}\n'])
+            self.assertEqual(bmp.checkpoint.load(), 2)
+            self.assertEqual(len(bmp.partitions), 1)
+
+    @unittest.mock.patch("src.BatchMessageProcessor.datetime")
+    def test_partial_batch_flushed_on_age(self, mock_datetime: datetime):
+        mock_datetime.now.return_value = datetime(2023, 1, 1, 12, 0, 0) # type: ignore
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            mock_client = unittest.mock.MagicMock()
+            mock_client.read_messages.return_value = [
+                Message(stream_name="stream1", sequence_number=5, ingest_time=1000, payload=b'{"n": 5}')
+            ]
+
+            config = ProcessorConfig(
+                stream_name="stream1", batch_size=3, path=tmpdirname, interval=0, batch_max_age=0
+            )
+            bmp = BatchMessageProcessor(config, logger, client=mock_client)
+            loop = asyncio.get_event_loop()
+            loop.run_until_complete(bmp.run(under_test=True))
+            self.assertEqual(len(bmp.partitions), 1)
+
+            # Once the message is older than the limit, the next (empty) pass flushes it.
+            bmp.partitions.buffers[None].max_age = 0.01
+            mock_client.read_messages.side_effect = NotEnoughMessagesException("Mock Not Enough Messages")
+            loop.run_until_complete(asyncio.sleep(0.02))
+            loop.run_until_complete(bmp.run(under_test=True))
+
+            expected_file = os.path.join(tmpdirname, "2023-01-01_12-00-00_0.jsonl.gz")
+            with gzip.open(expected_file, "rt") as f:
+                self.assertEqual(f.readlines(), ['{"n":5}\n'])
+            self.assertEqual(bmp.checkpoint.load(), 5)
+
+    @unittest.mock.patch("asyncio.sleep")
+    @unittest.mock.patch("src.BatchMessageProcessor.datetime")
+    def test_read_loop_adapts_to_backlog(self, mock_datetime: datetime, mock_sleep):
+        mock_datetime.now.return_value = datetime(2023, 1, 1, 12, 0, 0) # type: ignore
+
+        def messages(start: int, count: int):
+            return [
+                Message(stream_name="stream1", sequence_number=i, ingest_time=1000, payload=b'{"n": %d}' % i)
+                for i in range(start, start + count)
+            ]
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            mock_client = unittest.mock.MagicMock()
+            config = ProcessorConfig(stream_name="stream1", batch_size=1, path=tmpdirname, interval=5)
+            bmp = BatchMessageProcessor(config, logger, client=mock_client)
+
+            # A full read, a partial one, an empty one and then a stop.
+            mock_client.describe_message_stream.return_value.storage_status.newest_sequence_number = 99
+            mock_client.read_messages.side_effect = [
+                messages(0, 10),
+                messages(10, 3),
+                NotEnoughMessagesException("Mock Not Enough Messages"),
+                asyncio.CancelledError(),
+            ]
+            loop = asyncio.get_event_loop()
+            with self.assertRaises(asyncio.CancelledError):
+                loop.run_until_complete(bmp.run())
+            # Reading stopped with batches still being written into the directory.
+            if bmp.pending_batches:
+                loop.run_until_complete(asyncio.wait([batch.future for batch in bmp.pending_batches]))
+            bmp.close()
+
+            options = [c.args[1] for c in mock_client.read_messages.call_args_list]
+            self.assertEqual([o.desired_start_sequence_number for o in options], [0, 10, 13, 13])
+            # Only the empty read turns the next one into a long poll.
+            self.assertEqual([o.read_timeout_millis for o in options], [1000, 1000, 1000, 5000])
+            # Only the partial read sleeps for the interval.
+            self.assertEqual(mock_sleep.await_args_list, [unittest.mock.call(5)])
+
+            # The first full read measured 99 + 1 - 10 unread messages; the empty one none.
+            mock_client.describe_message_stream.assert_called_with(stream_name="stream1")
+            self.assertEqual(bmp.lag, 0)
+
+    @unittest.mock.patch("src.BatchMessageProcessor.datetime")
+    def test_lag(self, mock_datetime: datetime):
+        mock_datetime.now.return_value = datetime(2023, 1, 1, 12, 0, 0) # type: ignore
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            mock_client = unittest.mock.MagicMock()
+            mock_client.describe_message_stream.side_effect = ResourceNotFoundException("Mock Not Found")
+            config = ProcessorConfig(stream_name="stream1", batch_size=1, path=tmpdirname, interval=0)
+            bmp = BatchMessageProcessor(config, logger, client=mock_client)
+            asyncio.get_event_loop().run_until_complete(bmp.start())
+
+            mock_client.describe_message_stream.side_effect = None
+            mock_client.describe_message_stream.return_value.storage_status.newest_sequence_number = 99
+            mock_client.read_messages.return_value = [
+                Message(stream_name="stream1", sequence_number=i, ingest_time=1000, payload=b'{"n": %d}' % i)
+                for i in range(0, 10)
+            ]
+            asyncio.get_event_loop().run_until_complete(bmp.run(under_test=True))
+            self.assertEqual(bmp.lag, 90)
+            bmp.close()
+
+    @unittest.mock.patch("src.BatchMessageProcessor.datetime")
+    def test_metrics(self, mock_datetime: datetime):
+        mock_datetime.now.return_value = datetime(2023, 1, 1, 12, 0, 0) # type: ignore
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            mock_client = unittest.mock.MagicMock()
+            mock_client.describe_message_stream.return_value.storage_status.newest_sequence_number = 9
+            mock_client.read_messages.return_value = [
+                Message(stream_name="stream1", sequence_number=i, ingest_time=1000, payload=b'{"n": %d}' % i)
+                for i in range(0, 3)
+            ] + [Message(stream_name="stream1", sequence_number=3, ingest_time=1000, payload=b"not json")]
+            metrics = Metrics()
+            config = ProcessorConfig(stream_name="stream1", batch_size=3, path=tmpdirname, interval=0)
+            bmp = BatchMessageProcessor(config, logger, client=mock_client, metrics=metrics)
+            asyncio.get_event_loop().run_until_complete(bmp.run(under_test=True))
+
+            snapshot = metrics.snapshot()
+            def value(name: str, key: str = "total"):
+                return snapshot["s3ingestor_" + name]["samples"][0][key]
+            self.assertEqual(snapshot["s3ingestor_messages_read"]["samples"][0]["labels"], {"stream": "stream1"})
+            self.assertEqual(value("messages_read"), 4)
+            self.assertEqual(value("messages_valid"), 3)
+            self.assertEqual(value("messages_invalid"), 1)
+            self.assertEqual(value("batches_written"), 1)
+            self.assertEqual(value("messages_written"), 3)
+            self.assertEqual(value("batch_uncompressed_bytes"), len(b'{"n":0}\n') * 3)
+            self.assertEqual(
+                value("batch_compressed_bytes"),
+                os.path.getsize(os.path.join(tmpdirname, "2023-01-01_12-00-00_0.jsonl.gz")),
+            )
+            self.assertGreater(value("compression_ratio", "value"), 0)
+            self.assertEqual(value("batch_encode_seconds", "count"), 1)
+            self.assertEqual(value("stream_lag_messages", "value"), 6)
+
+    @unittest.mock.patch("src.BatchMessageProcessor.datetime")
+    def test_batches_published_in_order(self, mock_datetime: datetime):
+        mock_datetime.now.return_value = datetime(2023, 1, 1, 12, 0, 0) # type: ignore
+
+        release_first = threading.Event()
+
+        def slow_first_batch(file_path: str, messages: List[bytes], compression: Compression) -> int:
+            if "_0.jsonl.gz" in file_path:
+                release_first.wait(timeout=5)
+            return write_jsonl_batch(file_path, messages, compression)
+
+        with tempfile.TemporaryDirectory() as tmpdirname, unittest.mock.patch(
+            "src.BatchMessageProcessor.write_jsonl_batch", slow_first_batch
+        ):
+            config = ProcessorConfig(
+                stream_name="stream1", batch_size=2, path=tmpdirname, interval=0, encoder_workers=2
+            )
+            bmp = BatchMessageProcessor(config, logger, client=unittest.mock.MagicMock())
+
+            async def scenario():
+                for i in range(4):
+                    await bmp._process_message(
+                        Message(stream_name="stream1", sequence_number=i, ingest_time=1000, payload=b'{"n":%d}' % i)
+                    )
+
+                # Batch 1 finishes first, but must wait for batch 0 to be published.
+                await asyncio.wait_for(bmp.pending_batches[1].future, timeout=5)
+                await bmp._publish_batches()
+                self.assertEqual([f for f in os.listdir(tmpdirname) if f.endswith(".gz")], [])
+                self.assertIsNone(bmp.checkpoint.load())
+
+                release_first.set()
+                await bmp._publish_batches(wait=True)
+
+            loop = asyncio.get_event_loop()
+            loop.run_until_complete(scenario())
+
+            with gzip.open(os.path.join(tmpdirname, "2023-01-01_12-00-00_0.jsonl.gz"), "rt") as f:
+                self.assertEqual(f.readlines(), ['{"n":0}\n', '{"n":1}\n'])
+            with gzip.open(os.path.join(tmpdirname, "2023-01-01_12-00-00_1.jsonl.gz"), "rt") as f:
+                self.assertEqual(f.readlines(), ['{"n":2}\n', '{"n":3}\n'])
+            self.assertEqual(bmp.checkpoint.load(), 3)
+            bmp.close()
+
+    def test_failed_batch_write(self):
+        with tempfile.TemporaryDirectory() as tmpdirname, unittest.mock.patch(
+            "src.BatchMessageProcessor.write_jsonl_batch", side_effect=OSError("No space left on device")
+        ):
+            mock_client = unittest.mock.MagicMock()
+            mock_client.read_messages.return_value = [
+                Message(stream_name="stream1", sequence_number=i, ingest_time=1000, payload=b'{"n": 1}')
+                for i in range(3)
+            ]
+            config = ProcessorConfig(stream_name="stream1", batch_size=3, path=tmpdirname, interval=0)
+            bmp = BatchMessageProcessor(config, logger, client=mock_client)
+
+            # The processor stops so that it restarts from its checkpoint.
+            loop = asyncio.get_event_loop()
+            with self.assertRaises(BatchWriteError):
+                loop.run_until_complete(bmp.run(under_test=True))
+            self.assertIsNone(bmp.checkpoint.load())
+            bmp.close()
+
+    def test_failed_batch_submission(self):
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            mock_client = unittest.mock.MagicMock()
+            mock_client.read_messages.return_value = [
+                Message(stream_name="stream1", sequence_number=i, ingest_time=1000, payload=b'{"n": 1}')
+                for i in range(5)
+            ]
+            config = ProcessorConfig(stream_name="stream1", batch_size=3, path=tmpdirname, interval=0)
+            bmp = BatchMessageProcessor(config, logger, client=mock_client)
+            bmp.encoder.submit = unittest.mock.AsyncMock(side_effect=RuntimeError("Encoder pool is closed"))
+
+            loop = asyncio.get_event_loop()
+            with self.assertRaises(BatchWriteError):
+                loop.run_until_complete(bmp.run(under_test=True))
+
+            # The messages were not queued, so they stay buffered and are not checkpointed.
+            self.assertEqual(len(bmp.partitions.get(None)[0]), 3)
+            bmp._save_checkpoint()
+            self.assertIsNone(bmp.checkpoint.load())
+            bmp.close()
+
+    def test_partial_batches_removed_on_start(self):
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            partial_path = os.path.join(tmpdirname, ".2023-01-01_12-00-00_0.jsonl.gz.partial")
+            with open(partial_path, "wb") as f:
+                f.write(b"\x1f\x8b")
+
+            config = ProcessorConfig(stream_name="stream1", batch_size=3, path=tmpdirname, interval=0)
+            BatchMessageProcessor(config, logger, client=unittest.mock.MagicMock()).close()
+
+            self.assertFalse(os.path.exists(partial_path))
+
+    @unittest.mock.patch("src.BatchMessageProcessor.datetime")
+    def test_output_compression(self, mock_datetime: datetime):
+        mock_datetime.now.return_value = datetime(2023, 1, 1, 12, 0, 0) # type: ignore
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            mock_client = unittest.mock.MagicMock()
+            mock_client.read_messages.return_value = [
+                Message(stream_name="stream1", sequence_number=i, ingest_time=1000, payload=b'{"n": %d}' % i)
+                for i in range(3)
+            ]
+
+            config = ProcessorConfig(
+                stream_name="stream1", batch_size=3, path=tmpdirname, interval=0, compression="none"
+            )
+            bmp = BatchMessageProcessor(config, logger, client=mock_client)
+            loop = asyncio.get_event_loop()
+            loop.run_until_complete(bmp.run(under_test=True))
+            bmp.close()
+
+            with open(os.path.join(tmpdirname, "2023-01-01_12-00-00_0.jsonl"), "rb") as f:
+                self.assertEqual(f.read(), b'{"n":0}\n{"n":1}\n{"n":2}\n')
+
+    @unittest.skipIf(ParquetBatch.pyarrow is None, "pyarrow is not installed")
+    @unittest.mock.patch("src.BatchMessageProcessor.datetime")
+    def test_parquet_output(self, mock_datetime: datetime):
+        import pyarrow.parquet
+
+        mock_datetime.now.return_value = datetime(2023, 1, 1, 12, 0, 0) # type: ignore
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            mock_client = unittest.mock.MagicMock()
+            mock_client.read_messages.return_value = [
+                Message(
+                    stream_name="stream1",
+                    sequence_number=i,
+                    ingest_time=1000,
+                    payload=b'{"id": "%d", "speed": %d}' % (i, 50 + i),
+                )
+                for i in range(6)
+            ]
+
+            config = ProcessorConfig(
+                stream_name="stream1", batch_size=3, path=tmpdirname, interval=0, output_format="parquet"
+            )
+            self.assertEqual(BatchMessageProcessor.file_extension_for(config), ".parquet")
+            bmp = BatchMessageProcessor(config, logger, client=mock_client)
+            loop = asyncio.get_event_loop()
+            loop.run_until_complete(bmp.run(under_test=True))
+            bmp.close()
+
+            # Both batches share the schema inferred from the first one.
+            first = pyarrow.parquet.read_table(os.path.join(tmpdirname, "2023-01-01_12-00-00_0.parquet"))
+            second = pyarrow.parquet.read_table(os.path.join(tmpdirname, "2023-01-01_12-00-00_1.parquet"))
+            self.assertEqual(first.schema, second.schema)
+            self.assertEqual(first.column("id").to_pylist(), ["0", "1", "2"])
+            self.assertEqual(second.column("speed").to_pylist(), [53, 54, 55])
+            self.assertEqual(bmp.checkpoint.load(), 5)
+
+    @unittest.skipIf(ParquetBatch.pyarrow is None, "pyarrow is not installed")
+    @unittest.mock.patch("src.BatchMessageProcessor.datetime")
+    def test_parquet_output_with_unconvertible_messages(self, mock_datetime: datetime):
+        import pyarrow.parquet
+
+        mock_datetime.now.return_value = datetime(2023, 1, 1, 12, 0, 0) # type: ignore
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            payloads = [b"[1, 2]", b"3", b'{"id": 1}', b'{"id": "a"}', b'{"id": 2}', b'{"id": 3}']
+            mock_client = unittest.mock.MagicMock()
+            mock_client.read_messages.return_value = [
+                Message(stream_name="stream1", sequence_number=i, ingest_time=1000, payload=payload)
+                for i, payload in enumerate(payloads)
+            ]
+
+            config = ProcessorConfig(
+                stream_name="stream1", batch_size=2, path=tmpdirname, interval=0, output_format="parquet"
+            )
+            bmp = BatchMessageProcessor(config, logger, client=mock_client)
+            asyncio.get_event_loop().run_until_complete(bmp.run(under_test=True))
+            bmp.close()
+
+            # Non-object messages are skipped, and a batch that fits no schema is set
+            # aside without holding up the next one.
+            self.assertFalse(os.path.exists(os.path.join(tmpdirname, "2023-01-01_12-00-00_0.parquet")))
+            with open(os.path.join(tmpdirname, ".dead-letter", "2023-01-01_12-00-00_0.jsonl"), "rb") as f:
+                self.assertEqual(f.read(), b'{"id":1}\n{"id":"a"}\n')
+            table = pyarrow.parquet.read_table(os.path.join(tmpdirname, "2023-01-01_12-00-00_1.parquet"))
+            self.assertEqual(table.column("id").to_pylist(), [2, 3])
+            self.assertEqual(bmp.checkpoint.load(), 5)
+
+    @unittest.skipIf(ParquetBatch.pyarrow is None, "pyarrow is not installed")
+    @unittest.mock.patch("src.BatchMessageProcessor.datetime")
+    def test_parquet_output_keeps_configured_schema(self, mock_datetime: datetime):
+        import pyarrow.parquet
+
+        mock_datetime.now.return_value = datetime(2023, 1, 1, 12, 0, 0) # type: ignore
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            payloads = [b'{"id": 1}', b'{"id": 2}', b'{"id": "a"}', b'{"id": "b"}']
+            mock_client = unittest.mock.MagicMock()
+            mock_client.read_messages.return_value = [
+                Message(stream_name="stream1", sequence_number=i, ingest_time=1000, payload=payload)
+                for i, payload in enumerate(payloads)
+            ]
+
+            config = ProcessorConfig(
+                stream_name="stream1",
+                batch_size=2,
+                path=tmpdirname,
+                interval=0,
+                output_format="parquet",
+                parquet_schema='{"id": "int64"}',
+            )
+            bmp = BatchMessageProcessor(config, logger, client=mock_client)
+            asyncio.get_event_loop().run_until_complete(bmp.run(under_test=True))
+            bmp.close()
+
+            # The second batch would convert with a schema of its own, but not with the
+            # configured one, so it is set aside rather than written with another schema.
+            table = pyarrow.parquet.read_table(os.path.join(tmpdirname, "2023-01-01_12-00-00_0.parquet"))
+            self.assertEqual(table.column("id").to_pylist(), [1, 2])
+            self.assertFalse(os.path.exists(os.path.join(tmpdirname, "2023-01-01_12-00-00_1.parquet")))
+            with open(os.path.join(tmpdirname, ".dead-letter", "2023-01-01_12-00-00_1.jsonl"), "rb") as f:
+                self.assertEqual(f.read(), b'{"id":"a"}\n{"id":"b"}\n')
+            self.assertEqual(bmp.checkpoint.load(), 3)
+
+    @unittest.mock.patch("src.BatchMessageProcessor.datetime")
+    def test_partitioned_output(self, mock_datetime: datetime):
+        mock_datetime.now.return_value = datetime(2023, 1, 1, 12, 0, 0) # type: ignore
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            payloads = [
+                b'{"id": "a", "n": 0}',
+                b'{"id": "b/../c", "n": 1}',
+                b'{"id": "a", "n": 2}',
+                b'{"n": 3}',
+                b'{"id": "d", "n": 4}',
+            ]
+            mock_client = unittest.mock.MagicMock()
+            mock_client.read_messages.return_value = [
+                Message(stream_name="stream1", sequence_number=i, ingest_time=1000, payload=payload)
+                for i, payload in enumerate(payloads)
+            ]
+
+            config = ProcessorConfig(
+                stream_name="stream1",
+                batch_size=2,
+                path=tmpdirname,
+                interval=0,
+                batch_max_age=0,
+                compression="none",
+                partition_key="id",
+                max_open_partitions=3,
+            )
+            bmp = BatchMessageProcessor(config, logger, client=mock_client)
+            loop = asyncio.get_event_loop()
+            loop.run_until_complete(bmp.run(under_test=True))
+            bmp.close()
+
+            def read(partition: str, batch_id: int) -> bytes:
+                with open(os.path.join(tmpdirname, partition, f"2023-01-01_12-00-00_{batch_id}.jsonl"), "rb") as f:
+                    return f.read()
+
+            # "a" fills its batch first; "b/../c" is evicted when "d" arrives.
+            self.assertEqual(read("id=a", 0), b'{"id":"a","n":0}\n{"id":"a","n":2}\n')
+            self.assertEqual(read("id=b%2F..%2Fc", 1), b'{"id":"b/../c","n":1}\n')
+
+            # Messages 3 and 4 are still buffered, so the checkpoint stops before them.
+            self.assertEqual(sorted(bmp.partitions.buffers), ["id=__HIVE_DEFAULT_PARTITION__", "id=a", "id=d"])
+            self.assertEqual(bmp.checkpoint.load(), 2)
+
+    @unittest.mock.patch("src.BatchMessageProcessor.datetime")
+    def test_sharded_output(self, mock_datetime: datetime):
+        mock_datetime.now.return_value = datetime(2023, 1, 1, 12, 0, 0) # type: ignore
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            payloads = [b'{"id": "a", "n": 0}', b'{"id": "b", "n": 1}', b"not json", b'{"id": "a", "n": 3}', b"[1]"]
+            mock_client = unittest.mock.MagicMock()
+            mock_client.read_messages.return_value = [
+                Message(stream_name="stream1", sequence_number=i, ingest_time=1000, payload=payload)
+                for i, payload in enumerate(payloads)
+            ]
+            metrics = Metrics()
+            published_files: asyncio.Queue = asyncio.Queue()
+            config = ProcessorConfig(
+                stream_name="stream1",
+                batch_size=3,
+                path=tmpdirname,
+                interval=0,
+                batch_max_age=0,
+                compression="none",
+                partition_key="id",
+                encoder_workers=2,
+                encoder_mode="sharded",
+            )
+            bmp = BatchMessageProcessor(
+                config, logger, client=mock_client, published_files=published_files, metrics=metrics
+            )
+            loop = asyncio.get_event_loop()
+            loop.run_until_complete(bmp.run(under_test=True))
+            bmp.close()
+
+            def read(partition: str, batch_id: int) -> bytes:
+                with open(os.path.join(tmpdirname, partition, f"2023-01-01_12-00-00_{batch_id}.jsonl"), "rb") as f:
+                    return f.read()
+
+            # The first three messages form a batch, split into a file per partition.
+            self.assertEqual(read("id=a", 0), b'{"id":"a","n":0}\n')
+            self.assertEqual(read("id=b", 0), b'{"id":"b","n":1}\n')
+            self.assertEqual(
+                sorted(published_files.get_nowait() for _ in range(published_files.qsize())),
+                [
+                    os.path.join(tmpdirname, "id=a", "2023-01-01_12-00-00_0.jsonl"),
+                    os.path.join(tmpdirname, "id=b", "2023-01-01_12-00-00_0.jsonl"),
+                ],
+            )
+            # Messages 3 and 4 are still buffered, so the checkpoint stops before them.
+            self.assertEqual(bmp.checkpoint.load(), 2)
+
+            snapshot = metrics.snapshot()
+            def value(name: str):
+                return snapshot["s3ingestor_" + name]["samples"][0]["total"]
+            self.assertEqual(value("messages_read"), 5)
+            self.assertEqual(value("messages_valid"), 2)
+            self.assertEqual(value("messages_invalid"), 1)
+            self.assertEqual(value("batches_written"), 2)
+            self.assertEqual(value("messages_written"), 2)
+
+    @unittest.mock.patch("src.BatchMessageProcessor.datetime")
+    def test_sharded_batches_published_in_order(self, mock_datetime: datetime):
+        mock_datetime.now.return_value = datetime(2023, 1, 1, 12, 0, 0) # type: ignore
+
+        release_first = threading.Event()
+
+        def slow_first_shard(job: ShardJob) -> ShardResult:
+            if job.file_name.endswith("_0.jsonl.gz"):
+                release_first.wait(timeout=5)
+            return write_shard(job)
+
+        with tempfile.TemporaryDirectory() as tmpdirname, unittest.mock.patch(
+            "src.BatchMessageProcessor.write_shard", slow_first_shard
+        ):
+            encoder = BatchEncoder(workers=2, mode="sharded")
+            # Threads, so the patched worker function is used; the payloads still go
+            # through shared memory.
+            encoder._executor.shutdown()
+            encoder._executor = ThreadPoolExecutor(max_workers=2)
+            config = ProcessorConfig(stream_name="stream1", batch_size=2, path=tmpdirname, interval=0)
+            bmp = BatchMessageProcessor(config, logger, client=unittest.mock.MagicMock(), encoder=encoder)
+
+            async def scenario():
+                for i in range(4):
+                    await bmp._process_message(
+                        Message(stream_name="stream1", sequence_number=i, ingest_time=1000, payload=b'{"n": %d}' % i)
+                    )
+
+                # Batch 1 finishes first, but the checkpoint must not skip batch 0.
+                await asyncio.wait_for(bmp.pending_batches[1].future, timeout=5)
+                await bmp._publish_batches()
+                self.assertEqual([f for f in os.listdir(tmpdirname) if f.endswith(".gz")], [])
+                self.assertIsNone(bmp.checkpoint.load())
+
+                release_first.set()
+                await bmp._publish_batches(wait=True)
+
+            loop = asyncio.get_event_loop()
+            loop.run_until_complete(scenario())
+
+            with gzip.open(os.path.join(tmpdirname, "2023-01-01_12-00-00_0.jsonl.gz"), "rt") as f:
+                self.assertEqual(f.readlines(), ['{"n":0}\n', '{"n":1}\n'])
+            with gzip.open(os.path.join(tmpdirname, "2023-01-01_12-00-00_1.jsonl.gz"), "rt") as f:
+                self.assertEqual(f.readlines(), ['{"n":2}\n', '{"n":3}\n'])
+            self.assertEqual(bmp.checkpoint.load(), 3)
+            bmp.close()
+            encoder.close()
+
     def test_close_method(self):
         with tempfile.TemporaryDirectory() as tmpdirname:
             mock_client = unittest.mock.MagicMock()
@@ -0,0 +1,63 @@
+import unittest
+
+from src.CircuitBreaker import STATE_CLOSED, STATE_HALF_OPEN, STATE_OPEN, CircuitBreaker
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30, clock=lambda: self.now)
+
+    def test_opens_after_consecutive_failures(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, STATE_CLOSED)
+        self.assertTrue(self.breaker.allow())
+        self.assertIsNone(self.breaker.retry_after())
+
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, STATE_OPEN)
+        self.assertEqual(self.breaker.trips, 1)
+        self.assertFalse(self.breaker.allow())
+        self.now += 10
+        self.assertEqual(self.breaker.retry_after(), 20)
+
+    def test_probe(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+        self.now += 30
+
+        # A single probe is allowed.
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.state, STATE_HALF_OPEN)
+        self.assertFalse(self.breaker.allow())
+
+        # A failed probe opens the breaker again.
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, STATE_OPEN)
+        self.assertEqual(self.breaker.trips, 2)
+        self.now += 30
+        self.assertTrue(self.breaker.allow())
+
+        # A probe that never reports back is replaced.
+        self.now += 30
+        self.assertTrue(self.breaker.allow())
+
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, STATE_CLOSED)
+        self.assertEqual(self.breaker.consecutive_failures, 0)
+        self.assertTrue(self.breaker.allow())
+
+    def test_disabled(self):
+        breaker = CircuitBreaker(failure_threshold=0, clock=lambda: self.now)
+        for _ in range(100):
+            breaker.record_failure()
+        self.assertEqual(breaker.state, STATE_CLOSED)
+        self.assertTrue(breaker.allow())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+import unittest
+import unittest.mock
+import gzip
+
+from src import Compression as compression_module
+from src.Compression import Compression
+
+
+class TestCompression(unittest.TestCase):
+    data = b'{"id":"1","speed":50}\n' * 100
+
+    def test_gzip(self):
+        compression = Compression(codec="gzip", level=1)
+        self.assertEqual(compression.extension, ".gz")
+        compressed = compression.compress(self.data)
+        self.assertLess(len(compressed), len(self.data))
+        self.assertEqual(gzip.decompress(compressed), self.data)
+
+        # Defaults to the level gzip.open uses.
+        self.assertEqual(Compression().level, 9)
+
+    @unittest.skipIf(compression_module.zstandard is None, "zstandard is not installed")
+    def test_zstd(self):
+        for threads in (0, 2):
+            compression = Compression(codec="zstd", threads=threads)
+            self.assertEqual(compression.extension, ".zst")
+            self.assertEqual(compression.level, 3)
+            self.assertEqual(compression.decompress(compression.compress(self.data)), self.data)
+
+    def test_none(self):
+        compression = Compression(codec="none")
+        self.assertEqual(compression.extension, "")
+        self.assertEqual(compression.compress(self.data), self.data)
+
+    def test_invalid_settings(self):
+        with self.assertRaises(ValueError):
+            Compression(codec="lz4")
+        with self.assertRaises(ValueError):
+            Compression(codec="gzip", level=12)
+        with unittest.mock.patch.object(compression_module, "zstandard", None):
+            with self.assertRaises(ImportError):
+                Compression(codec="zstd")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -5,10 +5,18 @@ import unittest.mock
 import tempfile
 import logging
 import asyncio
+import gzip
 import os
+import shutil
+import time
 
 from src.DirectoryUploader import DirectoryUploader, UploaderConfig
+from src.InotifyWatcher import inotify_available
+from src.Metrics import Metrics
+from src.RetryScheduler import RetryScheduler
+from src.SpoolQuota import SpoolQuota
 from stream_manager import (
+    ResourceNotFoundException,
     StatusMessage,
     S3ExportTaskDefinition,
     EventType,
@@ -23,6 +31,18 @@ logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger()
 
 
+def status_message_for(file: str, status: Status) -> StatusMessage:
+    task_def = S3ExportTaskDefinition(input_url="file://" + file, bucket="bucket", key="key")
+    return StatusMessage(
+        event_type=EventType.S3Task,
+        status_level=StatusLevel.INFO,
+        status=status,
+        status_context=StatusContext(s3_export_task_definition=task_def, sequence_number=1),
+        message="message",
+        timestamp_epoch_ms=1,
+    )
+
+
 class TestDirectoryUploader(unittest.TestCase):
     def test_scan(self):
         tmpdir = tempfile.mkdtemp()
@@ -44,13 +64,439 @@ class TestDirectoryUploader(unittest.TestCase):
         f = open(tmpdir + "/test1.csv", "a")
         f.write("test file 1!")
         f.close()
+        # Files are published complete, so the newest one is not held back.
         loop.run_until_complete(du._scan(under_test=True))
-        mock_client.assert_not_called()
+        append_mock.assert_called_once()
         f = open(tmpdir + "/test2.csv", "a")
         f.write("test file 2!")
         f.close()
         loop.run_until_complete(du._scan(under_test=True))
-        append_mock.assert_called()
+        self.assertEqual(append_mock.call_count, 2)
+
+    def test_scan_partition_sub_directories(self):
+        tmpdir = tempfile.mkdtemp()
+        for i, name in enumerate(["id=1/a.jsonl.gz", "id=2/b.jsonl.gz", "c.jsonl.gz"]):
+            os.makedirs(os.path.dirname(os.path.join(tmpdir, name)), exist_ok=True)
+            with open(os.path.join(tmpdir, name), "w") as f:
+                f.write("test file!")
+            os.utime(os.path.join(tmpdir, name), (1000 + i, 1000 + i))
+
+        mock_client = unittest.mock.MagicMock()
+        mock_client.append_message.return_value = 123
+
+        config = UploaderConfig(
+            bucket_name="test-bucket",
+            prefix="sample",
+            interval=0,
+            path=tmpdir + "/**/*.jsonl.gz",
+        )
+        du = DirectoryUploader(config, logger, client=mock_client)
+        self.assertEqual(du.base_dir, tmpdir)
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(du._scan(under_test=True))
+
+        keys = sorted(
+            Util.deserialize_json_bytes_to_obj(call[0][1], S3ExportTaskDefinition).key
+            for call in mock_client.append_message.call_args_list
+        )
+        time_partition = "year=!{timestamp:YYYY}/month=!{timestamp:MM}/day=!{timestamp:dd}/hour=!{timestamp:HH}"
+        self.assertEqual(
+            keys,
+            [
+                f"sample/id=1/{time_partition}/a.jsonl.gz",
+                f"sample/id=2/{time_partition}/b.jsonl.gz",
+                f"sample/{time_partition}/c.jsonl.gz",
+            ],
+        )
+
+    @unittest.skipUnless(inotify_available(), "inotify is not available")
+    def test_inotify_watch_with_large_backlog(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        backlog = 100_000
+        for i in range(backlog):
+            open(os.path.join(tmpdir, f"{i}.jsonl.gz"), "wb").close()
+
+        config = UploaderConfig(
+            bucket_name="test-bucket",
+            prefix="sample",
+            interval=60,
+            path=tmpdir + "/*.jsonl.gz",
+            watch_mode="inotify",
+            # No status messages confirm the exports in this test.
+            max_outstanding_exports=0,
+        )
+        du = DirectoryUploader(config, logger, client=unittest.mock.MagicMock())
+        uploaded = []
+        new_file = asyncio.Event()
+
+        async def append_s3_task(file):
+            uploaded.append(file)
+            if file.endswith("new.jsonl.gz"):
+                new_file.set()
+
+        async def watch_and_publish():
+            scan = asyncio.create_task(du._scan())
+            try:
+                # The backlog is found by the initial scan, without waiting an interval.
+                while len(uploaded) < backlog:
+                    await asyncio.sleep(0.01)
+
+                # A batch published by renaming is queued without scanning again.
+                with unittest.mock.patch("src.DirectoryUploader.glob.glob") as mock_glob:
+                    with open(os.path.join(tmpdir, ".new.jsonl.gz.partial"), "wb") as f:
+                        f.write(b"test file!")
+                    published = time.monotonic()
+                    os.replace(
+                        os.path.join(tmpdir, ".new.jsonl.gz.partial"),
+                        os.path.join(tmpdir, "new.jsonl.gz"),
+                    )
+                    await asyncio.wait_for(new_file.wait(), timeout=5)
+                    latency = time.monotonic() - published
+                    mock_glob.assert_not_called()
+            finally:
+                scan.cancel()
+            return latency
+
+        du._append_s3_task = append_s3_task
+        latency = asyncio.get_event_loop().run_until_complete(watch_and_publish())
+
+        self.assertLess(latency, 1)
+        self.assertEqual(len(uploaded), backlog + 1)
+        self.assertEqual(len(set(uploaded)), backlog + 1)
+
+    @unittest.skipUnless(inotify_available(), "inotify is not available")
+    def test_inotify_watch_partition_sub_directories(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        config = UploaderConfig(
+            bucket_name="test-bucket",
+            prefix="sample",
+            interval=1,
+            path=tmpdir + "/**/*.jsonl.gz",
+            watch_mode="inotify",
+        )
+        du = DirectoryUploader(config, logger, client=unittest.mock.MagicMock())
+        uploaded = []
+
+        async def append_s3_task(file):
+            uploaded.append(os.path.relpath(file, tmpdir))
+
+        async def watch():
+            scan = asyncio.create_task(du._scan())
+            await asyncio.sleep(0.1)
+            os.makedirs(os.path.join(tmpdir, "id=1"))
+            for name in ["id=1/a.jsonl.gz", "id=1/.b.jsonl.gz.partial", "c.csv", "d.jsonl.gz"]:
+                with open(os.path.join(tmpdir, name), "wb") as f:
+                    f.write(b"test file!")
+            await asyncio.sleep(0.2)
+            scan.cancel()
+
+        du._append_s3_task = append_s3_task
+        asyncio.get_event_loop().run_until_complete(watch())
+
+        self.assertEqual(sorted(uploaded), ["d.jsonl.gz", os.path.join("id=1", "a.jsonl.gz")])
+
+    def test_upload_published_files(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        mock_client = unittest.mock.MagicMock()
+        mock_client.append_message.return_value = 123
+        published_files: asyncio.Queue = asyncio.Queue()
+
+        config = UploaderConfig(
+            bucket_name="test-bucket",
+            prefix="sample",
+            interval=60,
+            path=tmpdir + "/**/*.jsonl.gz",
+        )
+        du = DirectoryUploader(config, logger, client=mock_client, published_files=published_files)
+
+        async def hand_over():
+            consumer = asyncio.create_task(du._upload_published_files())
+            for name in ["id=1/a.jsonl.gz", "b.csv", "c.jsonl.gz"]:
+                os.makedirs(os.path.dirname(os.path.join(tmpdir, name)), exist_ok=True)
+                with open(os.path.join(tmpdir, name), "wb") as f:
+                    f.write(b"test file!")
+                published_files.put_nowait(os.path.join(tmpdir, name))
+            # Already uploaded, e.g. found by a scan in the meantime.
+            published_files.put_nowait(os.path.join(tmpdir, "c.jsonl.gz"))
+            while not published_files.empty():
+                await asyncio.sleep(0.01)
+            await asyncio.sleep(0.1)
+            consumer.cancel()
+
+        asyncio.get_event_loop().run_until_complete(hand_over())
+
+        keys = [
+            Util.deserialize_json_bytes_to_obj(call[0][1], S3ExportTaskDefinition).key
+            for call in mock_client.append_message.call_args_list
+        ]
+        self.assertEqual(len(keys), 2)
+        self.assertTrue(keys[0].startswith("sample/id=1/") and keys[0].endswith("/a.jsonl.gz"))
+        self.assertTrue(keys[1].endswith("/c.jsonl.gz"))
+
+    def test_outstanding_exports_limit(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        files = []
+        for i in range(4):
+            files.append(f"{tmpdir}/{i}.jsonl.gz")
+            with open(files[-1], "wb") as f:
+                f.write(b"test file!")
+
+        config = UploaderConfig(
+            bucket_name="test-bucket",
+            prefix="sample",
+            interval=1,
+            path=tmpdir + "/*.jsonl.gz",
+            max_outstanding_exports=2,
+        )
+        du = DirectoryUploader(config, logger, client=unittest.mock.MagicMock())
+        submitted = []
+
+        async def append_s3_task(file):
+            submitted.append(file)
+            return True
+
+        du._append_s3_task = append_s3_task
+
+        async def settle():
+            for _ in range(10):
+                await asyncio.sleep(0)
+
+        async def test():
+            upload = asyncio.ensure_future(du._upload_new_files(files))
+            await settle()
+            self.assertEqual(submitted, files[:2])
+            self.assertFalse(upload.done())
+
+            du._handle_status_message(status_message_for(files[0], Status.Success))
+            await settle()
+            self.assertEqual(submitted, files[:3])
+
+            # Failed exports free their slot too.
+            du._handle_status_message(status_message_for(files[1], Status.Failure))
+            await settle()
+            self.assertEqual(submitted, files)
+            self.assertTrue(upload.done())
+            await upload
+            self.assertEqual(
+                [upload.file for upload in du.pending_uploads.uploads.values()], [files[2], files[3]]
+            )
+            self.assertEqual(du.submission_rate.total, 4)
+
+        asyncio.get_event_loop().run_until_complete(test())
+
+    def test_invalid_export_task_not_pending(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        file = f"{tmpdir}/0.jsonl.gz"
+        with open(file, "wb") as f:
+            f.write(b"test file!")
+
+        metrics = Metrics()
+        config = UploaderConfig(
+            bucket_name="test-bucket",
+            prefix="sample",
+            interval=1,
+            path=tmpdir + "/*.jsonl.gz",
+            max_outstanding_exports=1,
+        )
+        du = DirectoryUploader(config, logger, client=unittest.mock.MagicMock(), metrics=metrics)
+        # The task failed validation, so it was never appended.
+        du._append_s3_task = unittest.mock.AsyncMock(return_value=False)
+
+        loop = asyncio.get_event_loop()
+        self.assertFalse(loop.run_until_complete(du._submit(file)))
+        self.assertEqual(len(du.pending_uploads), 0)
+        self.assertEqual(du.ledger.entries(), [])
+        self.assertEqual(du.submission_rate.total, 0)
+        self.assertEqual(metrics.snapshot()["s3ingestor_exports_submitted"]["samples"][0]["total"], 0)
+        # The export slot was given back, so the next file can be submitted.
+        self.assertFalse(du._export_slots.locked())
+        du.close()
+
+    def test_concurrent_submissions_limit(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        files = [f"{tmpdir}/{i}.jsonl.gz" for i in range(6)]
+        for file in files:
+            with open(file, "wb") as f:
+                f.write(b"test file!")
+
+        config = UploaderConfig(
+            bucket_name="test-bucket",
+            prefix="sample",
+            interval=1,
+            path=tmpdir + "/*.jsonl.gz",
+            max_concurrent_submissions=2,
+        )
+        du = DirectoryUploader(config, logger, client=unittest.mock.MagicMock())
+        started = []
+        in_flight = 0
+        max_in_flight = 0
+
+        async def append_s3_task(file):
+            nonlocal in_flight, max_in_flight
+            started.append(file)
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+            for _ in range(3):
+                await asyncio.sleep(0)
+            in_flight -= 1
+            return True
+
+        du._append_s3_task = append_s3_task
+        asyncio.get_event_loop().run_until_complete(du._upload_new_files(files))
+
+        self.assertEqual(max_in_flight, 2)
+        self.assertEqual(started, files)
+        self.assertEqual(du.files_processed, set(files))
+
+    def test_exported_file_not_submitted_again(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        file = tmpdir + "/test1.csv"
+        with open(file, "w") as f:
+            f.write("test file 1!")
+
+        mock_client = unittest.mock.MagicMock()
+        config = UploaderConfig(bucket_name="test-bucket", prefix="", interval=1, path=tmpdir + "/*.csv")
+        du = DirectoryUploader(config, logger, client=mock_client)
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(du._upload_new_files([file]))
+
+        # A rescan listed the file just before its export finished.
+        du._handle_status_message(status_message_for(file, Status.Success))
+        loop.run_until_complete(du._upload_new_files([file]))
+
+        mock_client.append_message.assert_called_once()
+        self.assertEqual(du.files_processed, set())
+        self.assertEqual(len(du.pending_uploads), 0)
+
+    @unittest.mock.patch("asyncio.sleep")
+    def test_process_status_backlog(self, mock_sleep):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        files = []
+        for i in range(1500):
+            files.append(f"{tmpdir}/{i}.jsonl.gz")
+            open(files[-1], "wb").close()
+
+        mock_client = unittest.mock.MagicMock()
+        config = UploaderConfig(
+            bucket_name="test-bucket",
+            prefix="",
+            interval=1,
+            path=tmpdir + "/*.jsonl.gz",
+            max_outstanding_exports=0,
+        )
+        du = DirectoryUploader(config, logger, client=mock_client)
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(du._upload_new_files(files))
+        self.assertEqual(len(du.pending_uploads), 1500)
+
+        statuses = [
+            Message(
+                stream_name="status",
+                sequence_number=i,
+                payload=Util.validate_and_serialize_to_json_bytes(status_message_for(file, Status.Success)),
+            )
+            for i, file in enumerate(files)
+        ]
+        mock_client.read_messages.side_effect = [statuses[:1000], statuses[1000:]]
+
+        # A full read is followed by the next one without sleeping.
+        loop.run_until_complete(du._process_status(under_test=True))
+        mock_sleep.assert_not_called()
+        self.assertEqual(len(du.pending_uploads), 500)
+        options = mock_client.read_messages.call_args[0][1]
+        self.assertEqual(options.max_message_count, 1000)
+
+        loop.run_until_complete(du._process_status(under_test=True))
+        mock_sleep.assert_called_once_with(1)
+        self.assertEqual(len(du.pending_uploads), 0)
+        self.assertEqual(du.pending_uploads.latency.count, 1500)
+        self.assertEqual(os.listdir(tmpdir), [])
+
+    def test_failed_export_resubmitted(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        file = tmpdir + "/test1.csv"
+        with open(file, "w") as f:
+            f.write("test file 1!")
+
+        config = UploaderConfig(bucket_name="test-bucket", prefix="", interval=1, path=tmpdir + "/*.csv")
+        du = DirectoryUploader(config, logger, client=unittest.mock.MagicMock())
+        clock = unittest.mock.MagicMock(return_value=0)
+        du.retries = RetryScheduler(base_delay=5, jitter=0, clock=clock)
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(du._poll())
+        self.assertEqual(du.pending_uploads.uploads[f"file://{file}"].size, 12)
+
+        du._handle_status_message(status_message_for(file, Status.Failure))
+        self.assertEqual(len(du.pending_uploads), 0)
+        self.assertIn(file, du.retries)
+
+        # Scans leave the file alone until its retry is due.
+        loop.run_until_complete(du._poll())
+        self.assertEqual(len(du.pending_uploads), 0)
+
+        with unittest.mock.patch("asyncio.sleep") as mock_sleep:
+            loop.run_until_complete(du._retry_failed_exports(under_test=True))
+            mock_sleep.assert_called_once_with(1)
+            self.assertEqual(len(du.pending_uploads), 0)
+
+            clock.return_value = 5
+            loop.run_until_complete(du._retry_failed_exports(under_test=True))
+        self.assertEqual(du.pending_uploads.uploads[f"file://{file}"].attempts, 2)
+
+        # The second failure backs off twice as long.
+        du._handle_status_message(status_message_for(file, Status.Failure))
+        self.assertEqual(du.retries.next_due_in(), 10)
+
+    def test_circuit_breaker_pauses_submissions(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        files = []
+        for name in ["a.csv", "b.csv", "c.csv"]:
+            files.append(os.path.join(tmpdir, name))
+            with open(files[-1], "w") as f:
+                f.write("test file!")
+        config = UploaderConfig(
+            bucket_name="test-bucket",
+            prefix="",
+            interval=1,
+            path=tmpdir + "/*.csv",
+            breaker_failure_threshold=2,
+            breaker_reset_timeout=30,
+        )
+        mock_client = unittest.mock.MagicMock()
+        du = DirectoryUploader(config, logger, client=mock_client)
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(du._upload_new_files(files[:2]))
+        du._handle_status_message(status_message_for(files[0], Status.Failure))
+        du._handle_status_message(status_message_for(files[1], Status.Canceled))
+        self.assertEqual(du.breaker.state, "open")
+
+        # While open, submissions wait for the breaker; then one probe goes through.
+        clock = unittest.mock.MagicMock(return_value=du.breaker._changed_at)
+        du.breaker._clock = clock
+
+        async def sleep(delay):
+            self.assertEqual(delay, 30)
+            clock.return_value += delay
+
+        with unittest.mock.patch("asyncio.sleep", side_effect=sleep) as mock_sleep:
+            loop.run_until_complete(du._upload_new_files(files[2:]))
+        mock_sleep.assert_called_once()
+        self.assertEqual(du.breaker.state, "half_open")
+        self.assertFalse(du.breaker.allow())
+        self.assertEqual(mock_client.append_message.call_count, 3)
+
+        du._handle_status_message(status_message_for(files[2], Status.Success))
+        self.assertEqual(du.breaker.state, "closed")
 
     def test_process_status(self):
         tmpdir = tempfile.mkdtemp()
@@ -101,6 +547,215 @@ class TestDirectoryUploader(unittest.TestCase):
         loop.run_until_complete(du._process_status(under_test=True))
         self.assertFalse(os.path.exists(filename))
 
+    def test_start(self):
+        mock_client = unittest.mock.MagicMock()
+        mock_client.describe_message_stream.side_effect = [
+            ResourceNotFoundException("Mock Not Found"),
+            unittest.mock.MagicMock(),
+        ]
+        config = UploaderConfig(bucket_name="test-bucket", prefix="", interval=1, path="/tmp/*.csv")
+        du = DirectoryUploader(config, logger, client=mock_client)
+        mock_client.describe_message_stream.assert_not_called()
+
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(du.start())
+        loop.run_until_complete(du.start())
+
+        # Existing streams are kept, missing ones created.
+        mock_client.delete_message_stream.assert_not_called()
+        created = [c.kwargs["definition"].name for c in mock_client.create_message_stream.call_args_list]
+        self.assertEqual(created, ["test-bucketStreamStatus"])
+        du.close()
+
+    def test_restart_resumes_from_ledger(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        files = []
+        for name in ["a.csv", "b.csv", "c.csv"]:
+            files.append(os.path.join(tmpdir, name))
+            with open(files[-1], "w") as f:
+                f.write("test file!")
+        config = UploaderConfig(
+            bucket_name="test-bucket",
+            prefix="",
+            interval=1,
+            path=tmpdir + "/*.csv",
+            max_outstanding_exports=2,
+            ledger_path=os.path.join(tmpdir, ".ledger", "uploads.sqlite"),
+        )
+        loop = asyncio.get_event_loop()
+
+        def status(sequence_number, file, state):
+            payload = Util.validate_and_serialize_to_json_bytes(status_message_for(file, state))
+            return Message(stream_name="status", sequence_number=sequence_number, payload=payload)
+
+        def uploader(streams_exist):
+            mock_client = unittest.mock.MagicMock()
+            if not streams_exist:
+                mock_client.describe_message_stream.side_effect = ResourceNotFoundException("Mock Not Found")
+            mock_client.describe_message_stream.return_value.storage_status.newest_sequence_number = 0
+            du = DirectoryUploader(config, logger, client=mock_client)
+            loop.run_until_complete(du.start())
+            return du, mock_client
+
+        async def poll_until_blocked(du):
+            poll = asyncio.ensure_future(du._poll())
+            await asyncio.sleep(0.1)
+            poll.cancel()
+            await asyncio.gather(poll, return_exceptions=True)
+
+        # The first run submits two files, then a is exported.
+        du, mock_client = uploader(streams_exist=False)
+        loop.run_until_complete(poll_until_blocked(du))
+        self.assertEqual(mock_client.append_message.call_count, 2)
+        mock_client.read_messages.return_value = [status(0, files[0], Status.Success)]
+        loop.run_until_complete(du._process_status(under_test=True))
+        self.assertFalse(os.path.exists(files[0]))
+        du.close()
+
+        # After a restart b is still in flight, so only c is submitted, and statuses
+        # are read after the one already handled.
+        du, mock_client = uploader(streams_exist=True)
+        du.retries = RetryScheduler(base_delay=0, jitter=0)
+        mock_client.create_message_stream.assert_not_called()
+        self.assertEqual([upload.file for upload in du.pending_uploads.uploads.values()], [files[1]])
+        loop.run_until_complete(poll_until_blocked(du))
+        self.assertEqual(
+            [Util.deserialize_json_bytes_to_obj(c.args[1], S3ExportTaskDefinition).input_url for c in mock_client.append_message.call_args_list],
+            [f"file://{files[2]}"],
+        )
+        mock_client.read_messages.return_value = [status(1, files[1], Status.Failure)]
+        loop.run_until_complete(du._process_status(under_test=True))
+        self.assertEqual(mock_client.read_messages.call_args[0][1].desired_start_sequence_number, 1)
+        loop.run_until_complete(du._retry_failed_exports(under_test=True))
+        self.assertEqual(du.pending_uploads.uploads[f"file://{files[1]}"].attempts, 2)
+        du.close()
+
+        # Exports submitted to a stream that no longer exists are submitted again.
+        du, mock_client = uploader(streams_exist=False)
+        self.assertEqual(len(du.pending_uploads), 0)
+        loop.run_until_complete(poll_until_blocked(du))
+        self.assertEqual(mock_client.append_message.call_count, 2)
+        self.assertEqual(du.pending_uploads.uploads[f"file://{files[1]}"].attempts, 3)
+        du.close()
+
+    def test_small_files_coalesced(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        files = []
+        for i, name in enumerate(["a.jsonl.gz", "b.jsonl.gz", "c.jsonl.gz", "large.jsonl.gz"]):
+            files.append(os.path.join(tmpdir, name))
+            with open(files[-1], "wb") as f:
+                f.write(gzip.compress(b"{}\n") if name != "large.jsonl.gz" else os.urandom(2000))
+            os.utime(files[-1], (1000 + i, 1000 + i))
+        config = UploaderConfig(
+            bucket_name="test-bucket",
+            prefix="",
+            interval=1,
+            path=tmpdir + "/*.jsonl.gz",
+            coalesce_target_size=1000,
+            coalesce_max_age=0,
+            ledger_path=os.path.join(tmpdir, ".ledger", "uploads.sqlite"),
+        )
+        loop = asyncio.get_event_loop()
+
+        def uploader():
+            mock_client = unittest.mock.MagicMock()
+            mock_client.describe_message_stream.return_value.storage_status.newest_sequence_number = 0
+            du = DirectoryUploader(config, logger, client=mock_client)
+            loop.run_until_complete(du.start())
+            return du, mock_client
+
+        def appended(mock_client):
+            return [
+                Util.deserialize_json_bytes_to_obj(c.args[1], S3ExportTaskDefinition)
+                for c in mock_client.append_message.call_args_list
+            ]
+
+        # The large file is exported as it is, the small ones as one merged file under
+        # the key of the first of them.
+        du, mock_client = uploader()
+        loop.run_until_complete(du._poll())
+        tasks = appended(mock_client)
+        self.assertEqual(tasks[0].input_url, f"file://{files[3]}")
+        merged = tasks[1].input_url.partition("file://")[2]
+        self.assertEqual(du.merges, {merged: files[:3]})
+        self.assertEqual(tasks[1].key, du._s3_key(files[0]))
+        with gzip.open(merged) as f:
+            self.assertEqual(f.read(), b"{}\n{}\n{}\n")
+        du.close()
+
+        # After a restart, the inputs are not exported again on their own.
+        du, mock_client = uploader()
+        self.assertEqual(du.merges, {merged: files[:3]})
+        loop.run_until_complete(du._poll())
+        self.assertEqual(appended(mock_client), [])
+
+        # Once the merged file is exported, it is removed along with its inputs.
+        du._handle_status_message(status_message_for(merged, Status.Success))
+        self.assertEqual(du.merges, {})
+        self.assertEqual(du.ledger.merges(), {})
+        for file in files[:3] + [merged]:
+            self.assertFalse(os.path.exists(file))
+        self.assertTrue(os.path.exists(files[3]))
+        du.close()
+
+    def test_spool_quota(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        file = os.path.join(tmpdir, "test1.csv")
+        with open(file, "w") as f:
+            f.write("test file 1!")
+        quota = SpoolQuota(tmpdir, max_bytes=1000)
+        quota.scan()
+
+        config = UploaderConfig(bucket_name="test-bucket", prefix="", interval=1, path=tmpdir + "/*.csv")
+        du = DirectoryUploader(config, logger, client=unittest.mock.MagicMock(), quota=quota)
+        self.assertFalse(quota.protected(file))
+        asyncio.get_event_loop().run_until_complete(du._poll())
+
+        # Files being exported are not evicted, and exported files no longer count.
+        self.assertTrue(quota.protected(file))
+        du._handle_status_message(status_message_for(file, Status.Success))
+        self.assertEqual(quota.used_bytes, 0)
+        self.assertFalse(quota.protected(file))
+
+    def test_metrics(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        files = [os.path.join(tmpdir, f"test{i}.csv") for i in range(2)]
+        for file in files:
+            with open(file, "w") as f:
+                f.write("test file!")
+        quota = SpoolQuota(tmpdir, max_bytes=0)
+        quota.scan()
+        metrics = Metrics()
+
+        config = UploaderConfig(bucket_name="test-bucket", prefix="", interval=1, path=tmpdir + "/*.csv")
+        du = DirectoryUploader(config, logger, client=unittest.mock.MagicMock(), quota=quota, metrics=metrics)
+        asyncio.get_event_loop().run_until_complete(du._poll())
+        du._handle_status_message(status_message_for(files[0], Status.Success))
+        du._handle_status_message(status_message_for(files[1], Status.Failure))
+
+        def value(name: str, key: str = "value"):
+            return metrics.snapshot()["s3ingestor_" + name]["samples"][0][key]
+        self.assertEqual(value("exports_submitted", "total"), 2)
+        self.assertEqual(value("exports_succeeded", "total"), 1)
+        self.assertEqual(value("exports_failed", "total"), 1)
+        self.assertEqual(value("upload_latency_seconds", "count"), 1)
+        self.assertEqual(value("exports_pending"), 0)
+        self.assertEqual(value("retries_scheduled"), 1)
+        self.assertEqual(value("spool_files"), 1)
+        self.assertEqual(value("spool_bytes"), 10)
+
+        # Counters keep counting when the uploader is recreated.
+        du.close()
+        du = DirectoryUploader(config, logger, client=unittest.mock.MagicMock(), quota=quota, metrics=metrics)
+        self.assertEqual(value("exports_submitted", "total"), 2)
+        self.assertEqual(value("upload_latency_seconds", "count"), 1)
+        self.assertEqual(value("retries_scheduled"), 0)
+        du.close()
+
     def test_scan_dir_not_exist(self):
         fakedir = "/does/not/exists/*.cvs"
         mock_client = unittest.mock.MagicMock()
@@ -0,0 +1,77 @@
+import unittest
+import tempfile
+import asyncio
+import shutil
+import os
+
+from src.InotifyWatcher import InotifyWatcher, inotify_available
+
+
+@unittest.skipUnless(inotify_available(), "inotify is not available")
+class TestInotifyWatcher(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def path(self, *names: str) -> str:
+        return os.path.join(self.tmpdir, *names)
+
+    def test_reports_closed_and_renamed_files(self):
+        watcher = InotifyWatcher(self.tmpdir)
+        self.addCleanup(watcher.close)
+
+        with open(self.path("a.jsonl.gz"), "wb") as f:
+            f.write(b"a")
+            # Not reported while still open for writing.
+            self.assertEqual(watcher.read_events(), ([], False))
+        with open(self.path(".b.partial"), "wb") as f:
+            f.write(b"b")
+        os.replace(self.path(".b.partial"), self.path("b.jsonl.gz"))
+
+        files, overflow = asyncio.get_event_loop().run_until_complete(watcher.read(timeout=1))
+        self.assertEqual(files, [self.path("a.jsonl.gz"), self.path(".b.partial"), self.path("b.jsonl.gz")])
+        self.assertFalse(overflow)
+
+        # Times out without events.
+        files, _ = asyncio.get_event_loop().run_until_complete(watcher.read(timeout=0.01))
+        self.assertEqual(files, [])
+
+    def test_recursive_watches_new_directories(self):
+        os.mkdir(self.path("old"))
+        watcher = InotifyWatcher(self.tmpdir, recursive=True)
+        self.addCleanup(watcher.close)
+
+        os.makedirs(self.path("new", "nested"))
+        with open(self.path("new", "nested", "a.jsonl.gz"), "wb") as f:
+            f.write(b"a")
+        with open(self.path("old", "b.jsonl.gz"), "wb") as f:
+            f.write(b"b")
+        files, _ = watcher.read_events()
+        with open(self.path("new", "nested", "c.jsonl.gz"), "wb") as f:
+            f.write(b"c")
+        more_files, _ = watcher.read_events()
+
+        # a.jsonl.gz may be found both by the scan of the new directory and by its event.
+        self.assertEqual(
+            set(files + more_files),
+            {
+                self.path("new", "nested", "a.jsonl.gz"),
+                self.path("old", "b.jsonl.gz"),
+                self.path("new", "nested", "c.jsonl.gz"),
+            },
+        )
+
+    def test_deleted_base_dir(self):
+        watched = self.path("watched")
+        os.mkdir(watched)
+        watcher = InotifyWatcher(watched)
+        self.addCleanup(watcher.close)
+        self.assertTrue(watcher.active)
+
+        os.rmdir(watched)
+        watcher.read_events()
+        self.assertFalse(watcher.active)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+import unittest
+import unittest.mock
+
+from src import JsonCodec
+from src.JsonCodec import OrjsonCodec, PassthroughCodec, StdlibJsonCodec, get_codec
+
+
+class TestJsonCodec(unittest.TestCase):
+    def _assert_compacts(self, codec: JsonCodec.JsonCodec):
+        self.assertEqual(codec.compact(b'{"a": 1,\n "b": [1, 2]}'), b'{"a":1,"b":[1,2]}')
+        self.assertEqual(codec.compact(b"[1, 2]"), b"[1,2]")
+        self.assertIsNone(codec.compact(b"test"))
+        self.assertIsNone(codec.compact(b'{"a": '))
+        self.assertIsNone(codec.compact(b"\xff\xfe"))
+
+    def test_stdlib_codec(self):
+        self._assert_compacts(StdlibJsonCodec())
+
+    @unittest.skipIf(JsonCodec.orjson is None, "orjson is not installed")
+    def test_orjson_codec(self):
+        self._assert_compacts(OrjsonCodec())
+
+    def test_passthrough_codec(self):
+        codec = PassthroughCodec()
+
+        # Single-line payloads are written as-is, only trimmed.
+        self.assertEqual(codec.compact(b' {"a": 1} \n'), b'{"a": 1}')
+        self.assertEqual(codec.compact(b"[1, 2]"), b"[1, 2]")
+
+        # Multi-line payloads are compacted so they stay on one JSON line.
+        self.assertEqual(codec.compact(b'{"a": 1,\n "b": 2}'), b'{"a":1,"b":2}')
+
+        self.assertIsNone(codec.compact(b"test"))
+        self.assertIsNone(codec.compact(b""))
+        self.assertIsNone(codec.compact(b'{"a"'))
+
+    def test_compact_with_key(self):
+        codecs = [StdlibJsonCodec(), PassthroughCodec()]
+        if JsonCodec.orjson is not None:
+            codecs.append(OrjsonCodec())
+        for codec in codecs:
+            self.assertEqual(
+                codec.compact_with_key(b'{"id":"7","loc":{"cc":"AU"}}', ("loc", "cc")),
+                (b'{"id":"7","loc":{"cc":"AU"}}', "AU"),
+            )
+            self.assertEqual(codec.compact_with_key(b'{"id":"7"}', ("loc", "cc")), (b'{"id":"7"}', None))
+            self.assertEqual(codec.compact_with_key(b"[1,2]", ("id",)), (b"[1,2]", None))
+            self.assertEqual(codec.compact_with_key(b'{"id":', ("id",)), (None, None))
+
+    def test_codec_interface(self):
+        with self.assertRaises(TypeError):
+            JsonCodec.JsonCodec()
+        self.assertEqual(PassthroughCodec().loads(b'{"a": 1}'), {"a": 1})
+
+    def test_get_codec(self):
+        self.assertIsInstance(get_codec("json"), StdlibJsonCodec)
+        self.assertIsInstance(get_codec("passthrough"), PassthroughCodec)
+        with self.assertRaises(ValueError):
+            get_codec("yaml")
+
+        with unittest.mock.patch.object(JsonCodec, "orjson", None):
+            self.assertIsInstance(get_codec("auto"), StdlibJsonCodec)
+            with self.assertRaises(ImportError):
+                get_codec("orjson")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,28 @@
+import unittest
+
+from src.LatencyHistogram import LatencyHistogram
+
+
+class TestLatencyHistogram(unittest.TestCase):
+    def test_observe(self):
+        histogram = LatencyHistogram(buckets=[1, 10])
+        for seconds in [0.5, 1, 3, 20]:
+            histogram.observe(seconds)
+
+        self.assertEqual(histogram.counts, [2, 1, 1])
+        self.assertEqual(histogram.count, 4)
+        self.assertEqual(histogram.sum, 24.5)
+
+    def test_quantile(self):
+        histogram = LatencyHistogram(buckets=[1, 10])
+        self.assertEqual(histogram.quantile(0.5), 0.0)
+
+        for seconds in [0.5] * 98 + [5, 20]:
+            histogram.observe(seconds)
+        self.assertEqual(histogram.quantile(0.5), 1)
+        self.assertEqual(histogram.quantile(0.99), 10)
+        self.assertEqual(histogram.quantile(1), float("inf"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import json
+import unittest
+
+from src.LatencyHistogram import LatencyHistogram
+from src.Metrics import Metrics
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.metrics = Metrics(clock=lambda: self.now)
+
+    def test_counter(self):
+        counter = self.metrics.counter("messages_read", "Messages read.", stream="Telemetry")
+        self.now += 2
+        counter.inc(10)
+        self.assertEqual(counter.total, 10)
+        self.assertEqual(counter.rate(), 5.0)
+
+        # The same name and labels return the same counter, e.g. after a restart.
+        self.assertIs(self.metrics.counter("messages_read", "Messages read.", stream="Telemetry"), counter)
+        self.assertIsNot(self.metrics.counter("messages_read", "Messages read.", stream="Events"), counter)
+
+    def test_values_read_when_exported(self):
+        pending = []
+        self.metrics.gauge("exports_pending", "Pending exports.").set_function(lambda: len(pending))
+        self.metrics.counter("spool_evicted_files", "Evicted files.").set_function(lambda: 3)
+        pending.append("file")
+
+        snapshot = self.metrics.snapshot()
+        self.assertEqual(snapshot["s3ingestor_exports_pending"]["samples"][0]["value"], 1)
+        self.assertEqual(snapshot["s3ingestor_spool_evicted_files"]["samples"][0]["total"], 3)
+        self.assertIsNone(snapshot["s3ingestor_spool_evicted_files"]["samples"][0]["rate"])
+
+    def test_kind_conflict(self):
+        self.metrics.counter("batches_written", "Batches.")
+        with self.assertRaises(ValueError):
+            self.metrics.gauge("batches_written", "Batches.")
+
+    def test_histogram_replaced(self):
+        latency = LatencyHistogram()
+        self.assertIs(self.metrics.histogram("upload_latency_seconds", "Latency.", histogram=latency), latency)
+        # A restarted component hands over its histogram again.
+        self.assertIs(self.metrics.histogram("upload_latency_seconds", "Latency.", histogram=latency), latency)
+        self.assertIs(self.metrics.histogram("upload_latency_seconds", "Latency."), latency)
+
+    def test_render(self):
+        self.metrics.counter("messages_read", "Messages read.", stream='a"b').inc(5)
+        self.metrics.gauge("compression_ratio", "Ratio.", stream="a").set(2.5)
+        histogram = self.metrics.histogram("batch_encode_seconds", "Encode time.", buckets=(0.1, 1))
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(5)
+
+        self.assertEqual(
+            self.metrics.render(),
+            "# HELP s3ingestor_messages_read_total Messages read.\n"
+            "# TYPE s3ingestor_messages_read_total counter\n"
+            's3ingestor_messages_read_total{stream="a\\"b"} 5\n'
+            "# HELP s3ingestor_compression_ratio Ratio.\n"
+            "# TYPE s3ingestor_compression_ratio gauge\n"
+            's3ingestor_compression_ratio{stream="a"} 2.5\n'
+            "# HELP s3ingestor_batch_encode_seconds Encode time.\n"
+            "# TYPE s3ingestor_batch_encode_seconds histogram\n"
+            's3ingestor_batch_encode_seconds_bucket{le="0.1"} 1\n'
+            's3ingestor_batch_encode_seconds_bucket{le="1"} 2\n'
+            's3ingestor_batch_encode_seconds_bucket{le="+Inf"} 3\n'
+            "s3ingestor_batch_encode_seconds_sum 5.55\n"
+            "s3ingestor_batch_encode_seconds_count 3\n",
+        )
+
+    def test_snapshot_is_json(self):
+        histogram = self.metrics.histogram("upload_latency_seconds", "Latency.", buckets=(1,))
+        histogram.observe(5)
+
+        snapshot = json.loads(json.dumps(self.metrics.snapshot(), allow_nan=False))
+        sample = snapshot["s3ingestor_upload_latency_seconds"]["samples"][0]
+        self.assertEqual(sample["count"], 1)
+        # Above the last bucket, so unbounded.
+        self.assertIsNone(sample["p99"])
+
+
+if __name__ == "__main__":
+    unittest.main()
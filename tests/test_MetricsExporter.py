@@ -0,0 +1,78 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import tempfile
+import unittest
+import unittest.mock
+
+from src.Metrics import Metrics
+from src.MetricsExporter import MetricsExporter
+
+logger = logging.getLogger()
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class TestMetricsExporter(unittest.TestCase):
+    def setUp(self):
+        self.metrics = Metrics()
+        self.metrics.counter("batches_written", "Batches.", stream="Telemetry").inc(3)
+
+    def test_http_endpoint(self):
+        port = free_port()
+        exporter = MetricsExporter(self.metrics, logger, port=port, interval=3600)
+
+        async def scrape(method: bytes) -> bytes:
+            task = asyncio.create_task(exporter.run())
+            try:
+                for _ in range(100):
+                    try:
+                        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+                        break
+                    except ConnectionRefusedError:
+                        await asyncio.sleep(0.01)
+                writer.write(method + b" /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n")
+                response = await reader.read()
+                writer.close()
+                return response
+            finally:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+
+        loop = asyncio.get_event_loop()
+        response = loop.run_until_complete(scrape(b"GET"))
+        head, _, body = response.partition(b"\r\n\r\n")
+        self.assertTrue(head.startswith(b"HTTP/1.1 200 OK"))
+        self.assertIn(b's3ingestor_batches_written_total{stream="Telemetry"} 3\n', body)
+        self.assertIn(f"Content-Length: {len(body)}".encode(), head)
+
+        response = loop.run_until_complete(scrape(b"POST"))
+        self.assertTrue(response.startswith(b"HTTP/1.1 405"))
+
+    @unittest.mock.patch("asyncio.sleep")
+    def test_snapshot_file(self, mock_sleep):
+        # The second interval stops the exporter.
+        mock_sleep.side_effect = [None, asyncio.CancelledError()]
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            path = os.path.join(tmpdirname, "metrics", "metrics.json")
+            exporter = MetricsExporter(self.metrics, logger, snapshot_path=path, interval=10)
+            with self.assertRaises(asyncio.CancelledError):
+                asyncio.get_event_loop().run_until_complete(exporter.run())
+
+            mock_sleep.assert_called_with(10)
+            with open(path) as f:
+                snapshot = json.load(f)
+            sample = snapshot["metrics"]["s3ingestor_batches_written"]["samples"][0]
+            self.assertEqual(sample["labels"], {"stream": "Telemetry"})
+            self.assertEqual(sample["total"], 3)
+            self.assertEqual(os.listdir(os.path.dirname(path)), ["metrics.json"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+import unittest
+import unittest.mock
+import tempfile
+import logging
+import asyncio
+import glob
+import gzip
+import os
+
+from src.BatchMessageProcessor import BatchWriteError, ProcessorConfig
+from src.MultiStreamProcessor import MultiStreamProcessor, stream_configs
+
+from stream_manager import ResourceNotFoundException
+from stream_manager.data import Message
+
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger()
+
+
+def read_messages(stream_name, options):
+    return [
+        Message(
+            stream_name=stream_name,
+            sequence_number=i,
+            ingest_time=1000,
+            payload=f'{{"stream": "{stream_name}", "n": {i}}}'.encode(),
+        )
+        for i in range(2)
+    ]
+
+
+class TestMultiStreamProcessor(unittest.TestCase):
+    def test_stream_configs(self):
+        base = ProcessorConfig(stream_name="Default", batch_size=10, interval=1, path="/data")
+
+        self.assertEqual(stream_configs(base, ""), [base])
+
+        configs = stream_configs(
+            base,
+            '[{"StreamName": "Telemetry"}, {"StreamName": "Events", "BatchSize": "5", '
+            '"BatchMaxAge": 60, "PartitionKey": "", "Path": "/events"}]',
+        )
+        self.assertEqual([c.stream_name for c in configs], ["Telemetry", "Events"])
+        self.assertEqual(configs[0].path, os.path.join("/data", "Telemetry"))
+        self.assertEqual(configs[0].batch_size, 10)
+        self.assertEqual(configs[1].path, "/events")
+        self.assertEqual(configs[1].batch_size, 5)
+        self.assertEqual(configs[1].batch_max_age, 60)
+        self.assertIsNone(configs[1].partition_key)
+
+        with self.assertRaises(ValueError):
+            stream_configs(base, '[{"StreamName": "A"}, {"StreamName": "A"}]')
+        with self.assertRaises(ValueError):
+            stream_configs(base, '[{"BatchSize": 5}]')
+        with self.assertRaises(ValueError):
+            stream_configs(base, '[{"StreamName": "A", "Unknown": 1}]')
+        with self.assertRaises(ValueError):
+            stream_configs(base, '[{"StreamName": "A", "EncoderWorkers": 2}]')
+
+    @unittest.mock.patch("asyncio.sleep")
+    def test_streams_share_client_and_encoder(self, _):
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            mock_client = unittest.mock.MagicMock()
+            mock_client.describe_message_stream.side_effect = ResourceNotFoundException
+            mock_client.read_messages.side_effect = read_messages
+
+            base = ProcessorConfig(stream_name="Default", batch_size=2, interval=1, path=tmpdirname)
+            configs = stream_configs(
+                base, '[{"StreamName": "Telemetry"}, {"StreamName": "Events", "Compression": "none"}]'
+            )
+            processor = MultiStreamProcessor(configs, logger, client=mock_client)
+            try:
+                telemetry, events = processor.processors
+                self.assertIs(telemetry.client, mock_client)
+                self.assertIs(telemetry.async_client, events.async_client)
+                self.assertIs(telemetry.encoder, events.encoder)
+                self.assertEqual(processor.async_client.max_workers, 2)
+
+                asyncio.get_event_loop().run_until_complete(processor.run(under_test=True))
+            finally:
+                processor.close()
+
+            telemetry_files = glob.glob(os.path.join(tmpdirname, "Telemetry", "*.jsonl.gz"))
+            events_files = glob.glob(os.path.join(tmpdirname, "Events", "*.jsonl"))
+            self.assertEqual(len(telemetry_files), 1)
+            self.assertEqual(len(events_files), 1)
+            with gzip.open(telemetry_files[0], "rt") as f:
+                self.assertIn('"stream":"Telemetry"', f.read())
+            with open(events_files[0]) as f:
+                self.assertIn('"stream":"Events"', f.read())
+
+            # Each stream keeps its own checkpoint.
+            self.assertTrue(os.path.exists(os.path.join(tmpdirname, "Telemetry", ".Telemetry.checkpoint")))
+            self.assertTrue(os.path.exists(os.path.join(tmpdirname, "Events", ".Events.checkpoint")))
+
+    @unittest.mock.patch("asyncio.sleep")
+    def test_failing_stream_stops_all(self, _):
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            mock_client = unittest.mock.MagicMock()
+            mock_client.describe_message_stream.side_effect = ResourceNotFoundException
+            mock_client.read_messages.side_effect = read_messages
+
+            base = ProcessorConfig(stream_name="Default", batch_size=2, interval=1, path=tmpdirname)
+            configs = stream_configs(base, '[{"StreamName": "Telemetry"}, {"StreamName": "Events"}]')
+            processor = MultiStreamProcessor(configs, logger, client=mock_client)
+            try:
+                with unittest.mock.patch(
+                    "src.BatchMessageProcessor.write_jsonl_batch", side_effect=OSError("disk full")
+                ):
+                    with self.assertRaises(BatchWriteError):
+                        asyncio.get_event_loop().run_until_complete(processor.run())
+            finally:
+                processor.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
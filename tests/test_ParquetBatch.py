@@ -0,0 +1,97 @@
+import unittest
+import unittest.mock
+import tempfile
+import os
+
+from src import ParquetBatch
+from src.ParquetBatch import ParquetConversionError, infer_schema, parse_schema, write_parquet_batch
+
+DATA = (
+    b'{"id":"1","speed":50,"location":{"lat":-31.9,"lng":115.9},"extra":true}\n'
+    b'{"id":"2","speed":52,"location":{"lat":-31.8,"lng":115.8},"extra":false}\n'
+    b'{"id":"3","speed":49,"location":{"lat":-31.7,"lng":115.7},"extra":true}\n'
+)
+
+
+@unittest.skipIf(ParquetBatch.pyarrow is None, "pyarrow is not installed")
+class TestParquetBatch(unittest.TestCase):
+    def test_parse_schema(self):
+        schema = parse_schema(
+            '{"id": "string", "speed": "int64", "tags": ["string"], '
+            '"location": {"lat": "double", "lng": "double"}}'
+        )
+        self.assertEqual(schema.names, ["id", "speed", "tags", "location"])
+        self.assertEqual(str(schema.field("tags").type), "list<item: string>")
+        self.assertEqual(str(schema.field("location").type), "struct<lat: double, lng: double>")
+
+        with self.assertRaises(ValueError):
+            parse_schema("[]")
+        with self.assertRaises(ValueError):
+            parse_schema('{"id": 1}')
+
+    def test_write_with_explicit_schema(self):
+        import pyarrow.parquet
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            file_path = os.path.join(tmpdirname, "batch.parquet")
+            schema = parse_schema('{"id": "string", "speed": "double"}')
+
+            with unittest.mock.patch("src.ParquetBatch.os.fsync") as mock_fsync:
+                size = write_parquet_batch(file_path, DATA, schema, 2, "zstd")
+            mock_fsync.assert_called_once()
+
+            self.assertEqual(size, os.path.getsize(file_path))
+            parquet_file = pyarrow.parquet.ParquetFile(file_path)
+            self.assertEqual(parquet_file.metadata.num_rows, 3)
+            self.assertEqual(parquet_file.metadata.num_row_groups, 2)
+            # Fields outside the schema are dropped and types follow the schema.
+            table = parquet_file.read()
+            self.assertEqual(table.schema, schema)
+            self.assertEqual(table.column("speed").to_pylist(), [50.0, 52.0, 49.0])
+
+    def test_write_falls_back_to_inferred_schema(self):
+        import pyarrow.parquet
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            file_path = os.path.join(tmpdirname, "batch.parquet")
+            # As inferred from an earlier batch, which this one does not fit.
+            schema = parse_schema('{"id": "int64"}')
+
+            write_parquet_batch(file_path, DATA, schema, None, "snappy", infer_on_mismatch=True)
+
+            table = pyarrow.parquet.read_table(file_path)
+            self.assertEqual(table.schema, infer_schema(DATA))
+            self.assertEqual(table.column("id").to_pylist(), ["1", "2", "3"])
+
+    def test_schema_mismatch_is_dead_lettered(self):
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            file_path = os.path.join(tmpdirname, "batch.parquet")
+            dead_letter_path = os.path.join(tmpdirname, ".dead-letter", "batch.jsonl")
+
+            # The batch converts with an inferred schema, but not with the configured one.
+            infer_schema(DATA)
+            with self.assertRaisesRegex(ParquetConversionError, "does not fit the Parquet schema"):
+                write_parquet_batch(file_path, DATA, parse_schema('{"id": "int64"}'), None, "snappy", dead_letter_path)
+
+            self.assertFalse(os.path.exists(file_path))
+            with open(dead_letter_path, "rb") as f:
+                self.assertEqual(f.read(), DATA)
+
+    def test_unconvertible_batch_is_dead_lettered(self):
+        data = b'{"id":1}\n{"id":"a"}\n'
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            file_path = os.path.join(tmpdirname, "batch.parquet")
+            dead_letter_path = os.path.join(tmpdirname, ".dead-letter", "batch.jsonl")
+
+            with self.assertRaises(ParquetConversionError):
+                infer_schema(data)
+            with self.assertRaises(ParquetConversionError):
+                write_parquet_batch(file_path, data, parse_schema('{"id": "int64"}'), None, "snappy", dead_letter_path)
+
+            self.assertFalse(os.path.exists(file_path))
+            with open(dead_letter_path, "rb") as f:
+                self.assertEqual(f.read(), data)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+import unittest
+
+from src.BatchBuffer import BatchBuffer
+from src.PartitionedBuffer import PartitionedBuffer
+
+
+class TestPartitionedBuffer(unittest.TestCase):
+    def test_partitions_are_independent(self):
+        partitions = PartitionedBuffer(lambda: BatchBuffer(max_messages=2))
+
+        a, _ = partitions.get("id=a")
+        b, _ = partitions.get("id=b")
+        a.add(b'{"id":"a"}', 11, 3)
+        b.add(b'{"id":"b"}', 11, 4)
+        a.add(b'{"id":"a"}', 11, 5)
+
+        self.assertEqual(len(partitions), 3)
+        self.assertEqual(partitions.ready(), [("id=a", a)])
+        self.assertEqual(partitions.oldest_sequence_number(), 3)
+
+        a.drain()
+        self.assertEqual(partitions.oldest_sequence_number(), 4)
+        b.drain()
+        self.assertIsNone(partitions.oldest_sequence_number())
+
+    def test_least_recently_used_partition_is_evicted(self):
+        partitions = PartitionedBuffer(lambda: BatchBuffer(max_messages=10), max_partitions=2)
+
+        a, _ = partitions.get("id=a")
+        partitions.get("id=b")
+        # Using "a" again makes "b" the least recently used partition.
+        self.assertIs(partitions.get("id=a")[0], a)
+
+        _, evicted = partitions.get("id=c")
+        self.assertEqual(evicted[0], "id=b")
+        self.assertEqual(list(partitions.buffers), ["id=a", "id=c"])
+
+
+if __name__ == "__main__":
+    unittest.main()
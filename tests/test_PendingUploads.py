@@ -0,0 +1,41 @@
+import unittest
+
+from src.PendingUploads import PendingUploads
+
+
+class TestPendingUploads(unittest.TestCase):
+    def setUp(self):
+        self.now = 100.0
+        self.pending = PendingUploads(clock=lambda: self.now)
+
+    def test_succeed(self):
+        upload = self.pending.submit("file:///a", "/a", 10)
+        self.pending.submit("file:///b", "/b", 5)
+        self.assertEqual(upload.attempts, 1)
+        self.assertIn("file:///a", self.pending)
+        self.assertEqual(self.pending.size_bytes, 15)
+
+        self.now += 3
+        self.assertIs(self.pending.succeed("file:///a"), upload)
+        self.assertNotIn("file:///a", self.pending)
+        self.assertEqual(len(self.pending), 1)
+        self.assertEqual(self.pending.latency.count, 1)
+        self.assertEqual(self.pending.latency.sum, 3)
+
+        # Unknown or already confirmed tasks are not timed.
+        self.assertIsNone(self.pending.succeed("file:///a"))
+        self.assertEqual(self.pending.latency.count, 1)
+
+    def test_attempts_counted_across_failures(self):
+        self.pending.submit("file:///a", "/a", 10)
+        self.assertEqual(self.pending.fail("file:///a").attempts, 1)
+        self.assertIsNone(self.pending.fail("file:///a"))
+        self.assertEqual(len(self.pending), 0)
+
+        self.assertEqual(self.pending.submit("file:///a", "/a", 10).attempts, 2)
+        self.pending.succeed("file:///a")
+        self.assertEqual(self.pending.submit("file:///a", "/a", 10).attempts, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
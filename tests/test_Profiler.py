@@ -0,0 +1,98 @@
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import unittest
+import unittest.mock
+
+from src.Profiler import CONTROL_FILE, PROFILES_DIR, Profiler
+
+logger = logging.getLogger()
+
+
+def busy_encoder(stop: threading.Event):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+class TestProfiler(unittest.TestCase):
+    def test_profile(self):
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            profiler = Profiler(tmpdirname, logger, sample_interval=0.005)
+            stop = threading.Event()
+            encoder = threading.Thread(target=busy_encoder, args=(stop,), name="encoder")
+            encoder.start()
+
+            async def blocked_loop():
+                await asyncio.sleep(0.05)
+                # Blocks the event loop, as a slow synchronous call would.
+                time.sleep(0.2)
+
+            async def profile():
+                blocking = asyncio.create_task(blocked_loop())
+                output_dir = await profiler.profile(0.4)
+                await blocking
+                return output_dir
+
+            try:
+                output_dir = asyncio.get_event_loop().run_until_complete(profile())
+            finally:
+                stop.set()
+                encoder.join()
+
+            self.assertFalse(profiler.profiling)
+            self.assertEqual(os.path.dirname(output_dir), os.path.join(tmpdirname, PROFILES_DIR))
+            self.assertEqual(
+                sorted(os.listdir(output_dir)),
+                ["cprofile.prof", "cprofile.txt", "stacks.txt", "summary.json", "tracemalloc.txt"],
+            )
+            with open(os.path.join(output_dir, "cprofile.txt")) as f:
+                self.assertIn("blocked_loop", f.read())
+            # Threads other than the event loop are sampled too.
+            with open(os.path.join(output_dir, "stacks.txt")) as f:
+                self.assertIn("encoder;", f.read())
+            with open(os.path.join(output_dir, "summary.json")) as f:
+                summary = json.load(f)
+            self.assertGreaterEqual(summary["loop_lag_seconds"]["max"], 0.1)
+            self.assertGreater(summary["stack_samples"], 0)
+
+    def test_control_file(self):
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            profiler = Profiler(tmpdirname, logger, duration=60)
+            profiler._check_control_file()
+            self.assertFalse(profiler._requested.is_set())
+
+            with open(os.path.join(tmpdirname, CONTROL_FILE), "w") as f:
+                f.write("5\n")
+            profiler._check_control_file()
+            self.assertTrue(profiler._requested.is_set())
+            self.assertEqual(profiler._requested_duration, 5)
+            self.assertFalse(os.path.exists(os.path.join(tmpdirname, CONTROL_FILE)))
+
+    def test_run_profiles_on_request(self):
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            profiler = Profiler(tmpdirname, logger, duration=60)
+            profiler.profile = unittest.mock.AsyncMock()
+
+            async def run():
+                task = asyncio.create_task(profiler.run())
+                profiler.request(0.1)
+                await asyncio.sleep(0.01)
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+
+            asyncio.get_event_loop().run_until_complete(run())
+            profiler.profile.assert_awaited_once_with(0.1)
+
+    def test_request_while_profiling(self):
+        profiler = Profiler("/tmp", logger)
+        profiler.profiling = True
+        profiler.request()
+        self.assertFalse(profiler._requested.is_set())
+
+
+if __name__ == "__main__":
+    unittest.main()
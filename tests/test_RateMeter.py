@@ -0,0 +1,37 @@
+import unittest
+
+from src.RateMeter import RateMeter
+
+
+class TestRateMeter(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.meter = RateMeter(window=10, clock=lambda: self.now)
+
+    def test_rate_before_a_full_window(self):
+        self.assertEqual(self.meter.rate(), 0.0)
+        self.now += 2
+        self.meter.add(4)
+        self.assertEqual(self.meter.rate(), 2.0)
+
+    def test_rate_over_the_window(self):
+        for _ in range(20):
+            self.now += 1
+            self.meter.add()
+        self.assertEqual(self.meter.rate(), 1.0)
+        self.assertEqual(self.meter.total, 20)
+
+        # Events older than the window no longer count.
+        self.now += 10
+        self.assertEqual(self.meter.rate(), 0.0)
+        self.assertEqual(self.meter.total, 20)
+
+    def test_events_at_the_same_time(self):
+        self.now += 5
+        self.meter.add()
+        self.meter.add(2)
+        self.assertEqual(self.meter.rate(), 0.6)
+
+
+if __name__ == "__main__":
+    unittest.main()
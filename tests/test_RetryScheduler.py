@@ -0,0 +1,53 @@
+import unittest
+
+from src.RetryScheduler import RetryScheduler
+
+
+class TestRetryScheduler(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.random = 0.0
+        self.retries = RetryScheduler(
+            base_delay=5, max_delay=60, jitter=0.5, clock=lambda: self.now, rng=lambda: self.random
+        )
+
+    def test_exponential_backoff(self):
+        self.assertEqual([self.retries.delay(attempts) for attempts in range(1, 6)], [5, 10, 20, 40, 60])
+        self.assertEqual(self.retries.delay(100), 60)
+
+    def test_jitter(self):
+        self.random = 0.5
+        self.assertEqual(self.retries.delay(2), 7.5)
+        self.random = 0.999
+        self.assertGreater(self.retries.delay(2), 5)
+
+    def test_pop_due(self):
+        self.assertIsNone(self.retries.next_due_in())
+        self.retries.schedule("b", 2)
+        self.retries.schedule("a", 1)
+        self.assertEqual(len(self.retries), 2)
+        self.assertEqual(self.retries.next_due_in(), 5)
+        self.assertEqual(self.retries.pop_due(), [])
+
+        self.now += 10
+        self.assertEqual(self.retries.pop_due(), ["a", "b"])
+        self.assertEqual(len(self.retries), 0)
+        self.assertEqual(self.retries.retries_scheduled, 2)
+
+    def test_reschedule_and_cancel(self):
+        self.retries.schedule("a", 1)
+        self.retries.schedule("a", 3)
+        self.retries.schedule("b", 1)
+        self.retries.cancel("b")
+        self.assertNotIn("b", self.retries)
+        self.assertEqual(self.retries.next_due_in(), 20)
+
+        self.now += 5
+        self.assertEqual(self.retries.pop_due(), [])
+        self.now += 15
+        self.assertEqual(self.retries.pop_due(), ["a"])
+        self.assertIsNone(self.retries.next_due_in())
+
+
+if __name__ == "__main__":
+    unittest.main()
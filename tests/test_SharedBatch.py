@@ -0,0 +1,54 @@
+import multiprocessing
+import unittest
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+
+from src.SharedBatch import SharedBatch
+
+
+def read_payloads(name: str) -> List[bytes]:
+    shared_batch = SharedBatch.attach(name)
+    try:
+        return shared_batch.payloads()
+    finally:
+        shared_batch.close()
+
+
+class TestSharedBatch(unittest.TestCase):
+    def test_round_trip(self):
+        payloads = [b'{"n":1}', b"", b"x" * 100000, b"\x00\xff"]
+        shared_batch = SharedBatch.create(payloads)
+        try:
+            self.assertEqual(read_payloads(shared_batch.name), payloads)
+            self.assertEqual(shared_batch.payloads(), payloads)
+        finally:
+            shared_batch.close()
+
+    def test_read_by_another_process(self):
+        payloads = [b'{"n":%d}' % i for i in range(1000)]
+        shared_batch = SharedBatch.create(payloads)
+        try:
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+                self.assertEqual(executor.submit(read_payloads, shared_batch.name).result(), payloads)
+        finally:
+            shared_batch.close()
+
+    def test_close_frees_the_block(self):
+        shared_batch = SharedBatch.create([b"a"])
+        shared_batch.close()
+        shared_batch.close()
+        with self.assertRaises(FileNotFoundError):
+            SharedBatch.attach(shared_batch.name)
+
+    def test_close_after_attach_keeps_the_block(self):
+        shared_batch = SharedBatch.create([b"a"])
+        try:
+            SharedBatch.attach(shared_batch.name).close()
+            self.assertEqual(read_payloads(shared_batch.name), [b"a"])
+        finally:
+            shared_batch.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+import unittest
+import tempfile
+import shutil
+import gzip
+import os
+
+from src.SpoolCoalescer import COALESCED_DIR, SpoolCoalescer
+
+
+class TestSpoolCoalescer(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.now = 1000.0
+        self.coalescer = SpoolCoalescer(self.tmpdir, target_size=100, max_age=60, clock=lambda: self.now)
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.tmpdir, name)
+
+    def test_groups_up_to_target_size(self):
+        self.assertTrue(self.coalescer.add(self.path("a.jsonl.gz"), 40, 1000))
+        self.assertTrue(self.coalescer.add(self.path("b.jsonl.gz"), 40, 1000))
+        self.assertEqual(self.coalescer.pop_ready(), [])
+        self.assertEqual(len(self.coalescer), 2)
+
+        # Would exceed the target, so the group is closed without it.
+        self.assertTrue(self.coalescer.add(self.path("c.jsonl.gz"), 40, 1000))
+        self.assertEqual(self.coalescer.pop_ready(), [[self.path("a.jsonl.gz"), self.path("b.jsonl.gz")]])
+
+        self.assertTrue(self.coalescer.add(self.path("d.jsonl.gz"), 60, 1000))
+        self.assertEqual(self.coalescer.pop_ready(), [[self.path("c.jsonl.gz"), self.path("d.jsonl.gz")]])
+        self.assertEqual(len(self.coalescer), 0)
+
+    def test_groups_by_directory_and_format(self):
+        self.coalescer.add(self.path("id=1/a.jsonl.gz"), 10, 1000)
+        self.coalescer.add(self.path("id=2/b.jsonl.gz"), 10, 1000)
+        self.coalescer.add(self.path("id=1/c.jsonl.zst"), 10, 1000)
+        self.coalescer.add(self.path("id=1/d.jsonl.gz"), 10, 1000)
+        self.now += 60
+        self.assertEqual(
+            sorted(self.coalescer.pop_ready()),
+            sorted([
+                [self.path("id=1/a.jsonl.gz"), self.path("id=1/d.jsonl.gz")],
+                [self.path("id=2/b.jsonl.gz")],
+                [self.path("id=1/c.jsonl.zst")],
+            ]),
+        )
+
+    def test_large_and_unmergeable_files_are_not_added(self):
+        self.assertFalse(self.coalescer.add(self.path("a.jsonl.gz"), 100, 1000))
+        self.assertFalse(self.coalescer.add(self.path("b.parquet"), 10, 1000))
+        self.assertEqual(len(self.coalescer), 0)
+
+    def test_merged_by_age(self):
+        self.coalescer.add(self.path("a.jsonl.gz"), 10, 950)
+        self.coalescer.add(self.path("b.jsonl.gz"), 10, 1000)
+        self.now = 1009
+        self.assertEqual(self.coalescer.pop_ready(), [])
+        self.now = 1010
+        self.assertEqual(self.coalescer.pop_ready(), [[self.path("a.jsonl.gz"), self.path("b.jsonl.gz")]])
+
+    def test_merge(self):
+        files = []
+        for i in range(3):
+            files.append(self.path(f"{i}.jsonl.gz"))
+            with open(files[-1], "wb") as f:
+                f.write(gzip.compress(f'{{"id": {i}}}\n'.encode()))
+
+        merged, inputs = self.coalescer.merge(files + [self.path("removed.jsonl.gz")])
+        self.assertEqual(inputs, files)
+        self.assertEqual(os.path.dirname(merged), os.path.join(self.tmpdir, COALESCED_DIR))
+        self.assertTrue(merged.endswith(".jsonl.gz"))
+        with gzip.open(merged) as f:
+            self.assertEqual(f.read(), b'{"id": 0}\n{"id": 1}\n{"id": 2}\n')
+        self.assertEqual(os.listdir(os.path.dirname(merged)), [os.path.basename(merged)])
+        for file in files:
+            self.assertTrue(os.path.exists(file))
+
+    def test_remove_orphans(self):
+        self.coalescer.remove_orphans([])
+        file = self.path("a.jsonl")
+        with open(file, "wb") as f:
+            f.write(b"{}\n")
+        kept, _ = self.coalescer.merge([file])
+        orphan, _ = self.coalescer.merge([file])
+        self.coalescer.remove_orphans([kept])
+        self.assertTrue(os.path.exists(kept))
+        self.assertFalse(os.path.exists(orphan))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+import unittest
+import unittest.mock
+import tempfile
+import shutil
+import os
+
+from src.SpoolIndex import SpoolIndex
+
+
+class TestSpoolIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        # Far enough in the future that no listing is considered racy.
+        self.clock = lambda: 1e10
+
+    def write(self, name: str, mtime: int) -> str:
+        path = os.path.join(self.tmpdir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(b"test file!")
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def test_new_files_in_mtime_order(self):
+        b = self.write("b.jsonl.gz", 2000)
+        a = self.write("a.jsonl.gz", 1000)
+        self.write("c.csv", 500)
+        self.write(".d.jsonl.gz.partial", 500)
+        index = SpoolIndex(self.tmpdir, "*.jsonl.gz", clock=self.clock)
+
+        self.assertEqual(index.refresh(), 1)
+        self.assertEqual(index.pop_new(), [a, b])
+        self.assertEqual(index.pop_new(), [])
+        self.assertEqual(len(index), 2)
+
+        c = self.write("c.jsonl.gz", 1500)
+        index.refresh()
+        self.assertEqual(index.pop_new(), [c])
+
+    def test_unchanged_directory_is_not_listed(self):
+        self.write("a.jsonl.gz", 1000)
+        index = SpoolIndex(self.tmpdir, "*.jsonl.gz", clock=self.clock)
+        index.refresh()
+        index.pop_new()
+
+        with unittest.mock.patch("src.SpoolIndex.os.scandir") as mock_scandir:
+            self.assertEqual(index.refresh(), 0)
+            mock_scandir.assert_not_called()
+
+    def test_recently_changed_directory_is_listed_again(self):
+        self.write("a.jsonl.gz", 1000)
+        index = SpoolIndex(self.tmpdir, "*.jsonl.gz")
+        index.refresh()
+
+        # The directory changed just now, so its mtime cannot be trusted yet.
+        self.assertEqual(index.refresh(), 1)
+
+    def test_removed_files_are_forgotten(self):
+        a = self.write("a.jsonl.gz", 1000)
+        b = self.write("b.jsonl.gz", 2000)
+        index = SpoolIndex(self.tmpdir, "*.jsonl.gz", clock=self.clock)
+        index.refresh()
+
+        os.remove(a)
+        os.utime(self.tmpdir, (3000, 3000))
+        index.refresh()
+        self.assertEqual(index.pop_new(), [b])
+        self.assertEqual(list(index.files), [b])
+
+    def test_requeue(self):
+        a = self.write("a.jsonl.gz", 1000)
+        b = self.write("b.jsonl.gz", 2000)
+        index = SpoolIndex(self.tmpdir, "*.jsonl.gz", clock=self.clock)
+        index.refresh()
+        self.assertEqual(index.pop_new(), [a, b])
+
+        index.requeue(a)
+        index.requeue(a)
+        index.requeue(os.path.join(self.tmpdir, "unknown.jsonl.gz"))
+        self.assertEqual(index.pop_new(), [a])
+
+    def test_recursive(self):
+        a = self.write("id=1/a.jsonl.gz", 1000)
+        b = self.write("b.jsonl.gz", 2000)
+        self.write(".hidden/c.jsonl.gz", 500)
+        index = SpoolIndex(self.tmpdir, "*.jsonl.gz", recursive=True, clock=self.clock)
+        index.refresh()
+        self.assertEqual(index.pop_new(), [a, b])
+
+        shutil.rmtree(os.path.join(self.tmpdir, "id=1"))
+        index.refresh()
+        self.assertEqual(list(index.files), [b])
+
+        # Not indexed when not recursive.
+        index = SpoolIndex(self.tmpdir, "*.jsonl.gz", clock=self.clock)
+        index.refresh()
+        self.assertEqual(index.pop_new(), [b])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+import unittest
+import tempfile
+import asyncio
+import shutil
+import os
+
+from src.SpoolQuota import QUOTA_POLICY_DROP_NEWEST, QUOTA_POLICY_DROP_OLDEST, SpoolQuota
+
+
+class TestSpoolQuota(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def write(self, name: str, size: int, mtime: int = 1000) -> str:
+        path = os.path.join(self.tmpdir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(b"x" * size)
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def test_scan(self):
+        b = self.write("id=1/b.jsonl.gz", 20, 2000)
+        a = self.write("a.jsonl.gz", 10, 1000)
+        self.write(".a.jsonl.gz.partial", 100)
+        self.write(".coalesced/c.jsonl.gz", 100)
+        quota = SpoolQuota(self.tmpdir, max_bytes=100)
+        quota.scan()
+        self.assertEqual(list(quota.files), [a, b])
+        self.assertEqual(quota.used_bytes, 30)
+        self.assertFalse(quota.full)
+
+    def test_add_and_remove(self):
+        quota = SpoolQuota(self.tmpdir, max_bytes=30)
+        self.assertEqual(quota.add("/a", 10), [])
+        self.assertEqual(quota.add("/a", 15), [])
+        self.assertEqual(quota.add("/b", 15), [])
+        self.assertEqual(quota.used_bytes, 30)
+        self.assertTrue(quota.paused)
+
+        quota.remove("/a")
+        quota.remove("/unknown")
+        self.assertEqual(quota.used_bytes, 15)
+        self.assertFalse(quota.paused)
+
+    def test_no_limit(self):
+        quota = SpoolQuota(self.tmpdir, max_bytes=0)
+        quota.add("/a", 10 ** 12)
+        self.assertFalse(quota.full)
+
+    def test_wait_for_space(self):
+        quota = SpoolQuota(self.tmpdir, max_bytes=10)
+        quota.add("/a", 10)
+        loop = asyncio.get_event_loop()
+        waiting = loop.create_task(quota.wait_for_space())
+        loop.run_until_complete(asyncio.sleep(0))
+        self.assertFalse(waiting.done())
+
+        quota.remove("/a")
+        loop.run_until_complete(asyncio.wait_for(waiting, 1))
+
+    def test_drop_oldest(self):
+        a = self.write("a.jsonl.gz", 10, 1000)
+        b = self.write("b.jsonl.gz", 10, 2000)
+        c = self.write("c.jsonl.gz", 10, 3000)
+        quota = SpoolQuota(self.tmpdir, max_bytes=25, policy=QUOTA_POLICY_DROP_OLDEST)
+        quota.scan()
+        quota.protected = lambda file: file == a
+
+        d = self.write("d.jsonl.gz", 10, 4000)
+        self.assertEqual(quota.add(d, 10), [b, c])
+        self.assertEqual(list(quota.files), [a, d])
+        self.assertFalse(os.path.exists(b))
+        self.assertTrue(os.path.exists(a))
+        self.assertEqual(quota.used_bytes, 20)
+        self.assertEqual((quota.evicted_files, quota.evicted_bytes), (2, 20))
+        self.assertFalse(quota.paused)
+
+    def test_drop_newest(self):
+        a = self.write("a.jsonl.gz", 10, 1000)
+        quota = SpoolQuota(self.tmpdir, max_bytes=15, policy=QUOTA_POLICY_DROP_NEWEST)
+        quota.scan()
+
+        b = self.write("b.jsonl.gz", 10, 2000)
+        self.assertEqual(quota.add(b, 10), [b])
+        self.assertEqual(list(quota.files), [a])
+        self.assertFalse(os.path.exists(b))
+
+    def test_invalid_policy(self):
+        with self.assertRaises(ValueError):
+            SpoolQuota(self.tmpdir, max_bytes=10, policy="unknown")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+import unittest
+import tempfile
+import os
+
+from src.StreamCheckpoint import StreamCheckpoint
+
+
+class TestStreamCheckpoint(unittest.TestCase):
+    def test_save_and_load(self):
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            checkpoint = StreamCheckpoint(os.path.join(tmpdirname, ".stream1.checkpoint"))
+            self.assertIsNone(checkpoint.load())
+
+            checkpoint.save(10)
+            checkpoint.save(25)
+            self.assertEqual(checkpoint.load(), 25)
+
+            # A fresh instance sees the persisted value and no temp file is left behind.
+            self.assertEqual(StreamCheckpoint(checkpoint.path).load(), 25)
+            self.assertEqual(os.listdir(tmpdirname), [".stream1.checkpoint"])
+
+    def test_corrupt_checkpoint(self):
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            path = os.path.join(tmpdirname, ".stream1.checkpoint")
+            with open(path, "w") as f:
+                f.write('{"sequence_nu')
+
+            self.assertIsNone(StreamCheckpoint(path).load())
+
+    def test_clear(self):
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            checkpoint = StreamCheckpoint(os.path.join(tmpdirname, ".stream1.checkpoint"))
+            checkpoint.clear()
+            checkpoint.save(3)
+            checkpoint.clear()
+            self.assertIsNone(checkpoint.load())
+
+
+if __name__ == "__main__":
+    unittest.main()
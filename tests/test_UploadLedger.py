@@ -0,0 +1,77 @@
+import unittest
+import tempfile
+import os
+
+from src.UploadLedger import (
+    STATE_FAILED,
+    STATE_QUEUED,
+    STATE_SUBMITTED,
+    STATE_SUCCEEDED,
+    UploadLedger,
+)
+
+
+class TestUploadLedger(unittest.TestCase):
+    def test_states(self):
+        ledger = UploadLedger()
+        ledger.queue("/a", "key/a", 10)
+        ledger.queue("/b", "key/b", 20)
+        self.assertEqual([entry.file for entry in ledger.entries(STATE_QUEUED)], ["/a", "/b"])
+
+        self.assertEqual(ledger.submit("/a"), 1)
+        ledger.fail("/a")
+        ledger.queue("/a", "key/a", 10)
+        self.assertEqual(ledger.submit("/a"), 2)
+        self.assertEqual(ledger.entries(STATE_SUBMITTED)[0].attempts, 2)
+
+        ledger.fail("/b")
+        self.assertEqual([entry.file for entry in ledger.entries(STATE_FAILED)], ["/b"])
+        ledger.succeed("/a")
+        self.assertEqual(ledger.entries(STATE_SUCCEEDED)[0].s3_key, "key/a")
+        ledger.forget_succeeded()
+        ledger.forget(["/b"])
+        self.assertEqual(ledger.entries(), [])
+        ledger.close()
+
+    def test_persisted(self):
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            path = os.path.join(tmpdirname, "ledger", "uploads.sqlite")
+            ledger = UploadLedger(path)
+            self.assertIsNone(ledger.status_sequence_number)
+            ledger.queue("/a", "key/a", 10)
+            ledger.submit("/a")
+            ledger.status_sequence_number = 42
+            ledger.close()
+
+            ledger = UploadLedger(path)
+            self.assertEqual([entry.file for entry in ledger.entries(STATE_SUBMITTED)], ["/a"])
+            self.assertEqual(ledger.status_sequence_number, 42)
+            ledger.close()
+
+    def test_transaction(self):
+        ledger = UploadLedger()
+        with ledger.transaction():
+            ledger.queue("/a", "key/a", 10)
+            with ledger.transaction():
+                ledger.queue("/b", "key/b", 10)
+
+        with self.assertRaises(RuntimeError):
+            with ledger.transaction():
+                ledger.forget(["/a", "/b"])
+                raise RuntimeError("Mock failure")
+        self.assertEqual(len(ledger.entries()), 2)
+        ledger.close()
+
+    def test_merges(self):
+        ledger = UploadLedger()
+        ledger.record_merge("/m1", ["/b", "/a"])
+        ledger.record_merge("/m2", ["/c"])
+        self.assertEqual(ledger.merges(), {"/m1": ["/b", "/a"], "/m2": ["/c"]})
+
+        ledger.forget_merge("/m1")
+        self.assertEqual(ledger.merges(), {"/m2": ["/c"]})
+        ledger.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+import json
+import random
+import unittest
+
+from benchmarks.load_generator import TELEMETRY_SCHEMA, BurstProfile, MessageFactory
+
+
+class TestBurstProfile(unittest.TestCase):
+    def test_parse(self):
+        self.assertEqual(BurstProfile.parse("60:5:10"), BurstProfile(60, 5, 10))
+        self.assertEqual(BurstProfile.parse("1.5:0.5:2.5"), BurstProfile(1.5, 0.5, 2.5))
+
+        for spec in ["60:5", "60:5:10:1", "a:5:10", "0:0:10", "60:61:10", "60:-1:10", "60:5:0"]:
+            with self.assertRaises(ValueError, msg=spec):
+                BurstProfile.parse(spec)
+
+    def test_factor(self):
+        burst = BurstProfile.parse("60:5:10")
+        self.assertEqual([burst.factor(t) for t in (0, 4.9, 5, 59.9, 60, 64.9, 65)], [10, 10, 1, 1, 10, 10, 1])
+
+
+class TestMessageFactory(unittest.TestCase):
+    def test_telemetry_schema(self):
+        factory = MessageFactory(TELEMETRY_SCHEMA)
+        first = json.loads(factory.payload("7", 0)[0])
+        second = json.loads(factory.payload("7", 1)[0])
+
+        self.assertEqual(sorted(first), ["id", "location", "speed", "temperature", "timestamp"])
+        self.assertEqual(first["id"], "7")
+        self.assertIsInstance(first["speed"], int)
+        # Each value walks from the previous one by at most a step.
+        self.assertLessEqual(abs(second["speed"] - first["speed"]), 5)
+        self.assertLessEqual(abs(second["location"]["lat"] - first["location"]["lat"]), 0.0001)
+
+    def test_schema_generators(self):
+        factory = MessageFactory(
+            {
+                "device": "device_id",
+                "n": "sequence",
+                "count": {"type": "int", "min": 1, "max": 3},
+                "ratio": {"type": "float", "min": 0, "max": 1, "precision": 2},
+                "status": {"type": "choice", "values": ["ok", "degraded"]},
+                "tag": {"type": "string", "length": 4},
+                "nested": {"version": 2},
+            }
+        )
+        message = json.loads(factory.payload("d", 5)[0])
+
+        self.assertEqual(message["device"], "d")
+        self.assertEqual(message["n"], 5)
+        self.assertIn(message["count"], [1, 2, 3])
+        self.assertEqual(message["ratio"], round(message["ratio"], 2))
+        self.assertIn(message["status"], ["ok", "degraded"])
+        self.assertEqual(len(message["tag"]), 4)
+        self.assertEqual(message["nested"], {"version": 2})
+
+        with self.assertRaises(ValueError):
+            MessageFactory({"x": {"type": "unknown"}})
+
+    def test_padding(self):
+        factory = MessageFactory({"id": "device_id"}, size=200)
+        payload, malformed = factory.payload("1", 0)
+
+        self.assertFalse(malformed)
+        self.assertEqual(len(payload), 200)
+        self.assertEqual(json.loads(payload)["id"], "1")
+
+    def test_malformed_ratio(self):
+        random.seed(1)
+        factory = MessageFactory(TELEMETRY_SCHEMA, malformed_ratio=0.1)
+        results = [factory.payload("1", i) for i in range(10000)]
+
+        malformed = [payload for payload, is_malformed in results if is_malformed]
+        self.assertAlmostEqual(len(malformed) / len(results), 0.1, delta=0.01)
+        # Malformed payloads are exactly the ones that are not valid JSON.
+        for payload, is_malformed in results:
+            try:
+                json.loads(payload)
+                valid = True
+            except ValueError:
+                valid = False
+            self.assertEqual(valid, not is_malformed)
+
+        factory = MessageFactory(TELEMETRY_SCHEMA)
+        self.assertFalse(any(factory.payload("1", i)[1] for i in range(1000)))
+
+
+if __name__ == "__main__":
+    unittest.main()